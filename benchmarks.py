@@ -0,0 +1,354 @@
+"""
+Benchmarks des chemins critiques du bot, sur une base SQLite synthétique.
+
+    python benchmarks.py                              # mesure + bench_results.json
+    python benchmarks.py --baseline bench_results.json --out new.json
+
+Chaque mesure est comparée à un budget absolu (p95) et, si --baseline est
+fourni, au p50 du run de référence (x --tolerance). Les plans de requête des
+HOT_QUERIES sont aussi vérifiés. Code de sortie 1 en cas de régression.
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Budget p95 par mesure (ms) : large, pour attraper les changements d'ordre de
+# grandeur (index perdu, scan complet) plutôt que le bruit de la machine.
+BUDGETS_MS = {
+    "get_balance": 2.0,
+    "update_balance": 5.0,
+    "is_number_used (inconnu)": 0.05,
+    "is_number_used (déjà vu)": 2.0,
+    "calculate_selling_price": 2.0,
+    "/stats": 5.0,
+    "/stats (détails)": 5.0,
+    "/history": 3.0,
+    "/history (dépôts)": 3.0,
+    "réservation compte Telegram": 5.0,
+    "extract_login_code": 0.05,
+    "parse_prices": 5.0,
+}
+
+SAMPLE_TELEGRAM_MESSAGES = (
+    "Login code: 48213. Do not give this code to anyone, even if they say they are from Telegram!",
+    "Code de connexion : 90712. Ne donnez ce code à personne.",
+    "New login. Dear User, we detected a login into your account from a new device on 12/03/2024.",
+    "Your login code is 55120\n\nThis code can be used to log in to your Telegram account.",
+)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks QuickSMS")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=300000)
+    parser.add_argument("--deposits", type=int, default=60000)
+    parser.add_argument("--accounts", type=int, default=5000)
+    parser.add_argument("--blocked", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", default=None, help="résultats de référence")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="p50 max autorisé = p50 de référence x tolérance",
+    )
+    parser.add_argument("--db", default=None, help="base SQLite (défaut: temporaire)")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser
+
+
+# --- BASE SYNTHÉTIQUE ---
+def random_phone(rng):
+    return "33" + "".join(str(rng.randint(0, 9)) for _ in range(9))
+
+
+def seed_database(conn, args, services, countries, rng):
+    """Utilisateurs, commandes sur un an, dépôts, stock Telegram et numéros bloqués."""
+    from database import rebuild_rollups
+
+    now = datetime.now()
+    conn.executemany(
+        "INSERT INTO users (discord_id, balance) VALUES (?, ?)",
+        (
+            (user_id, round(rng.uniform(0, 50), 2))
+            for user_id in range(1, args.users + 1)
+        ),
+    )
+
+    used = []  # Échantillon de (numéro, service) déjà vendus
+
+    def orders():
+        for index in range(args.orders):
+            created = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+            phone = random_phone(rng)
+            service = rng.choice(services)
+            if index % 10 == 0:
+                used.append((phone, service))
+            status = rng.choices(
+                ("COMPLETED", "REFUNDED", "PENDING"), weights=(80, 19, 1)
+            )[0]
+            price = round(rng.uniform(0.3, 3.0), 2)
+            yield (
+                f"B{index}",
+                rng.randint(1, args.users),
+                phone,
+                price,
+                status,
+                str(created),
+                int(created.timestamp()),
+                service,
+                round(price / 2, 2),
+                rng.choice(countries),
+            )
+
+    conn.executemany(
+        """INSERT INTO orders (order_id, discord_id, phone, price, status, created_at,
+                               created_ts, service, cost, country)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        orders(),
+    )
+
+    def deposits():
+        for _ in range(args.deposits):
+            created = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+            yield (
+                rng.randint(1, args.users),
+                rng.choice((5.0, 10.0, 20.0, 50.0)),
+                "Hoodpay",
+                str(created),
+                int(created.timestamp()),
+            )
+
+    conn.executemany(
+        "INSERT INTO deposits (discord_id, amount, source, created_at, created_ts) VALUES (?, ?, ?, ?, ?)",
+        deposits(),
+    )
+
+    def accounts():
+        # Stock réaliste : la majorité des comptes est déjà vendue
+        for _ in range(args.accounts):
+            if rng.random() < 0.7:
+                sold = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+                sale = ("SOLD", rng.randint(1, args.users), str(sold))
+                sale += (int(sold.timestamp()),)
+            else:
+                sale = ("AVAILABLE", None, None, None)
+            yield (random_phone(rng), "1" + "A" * 350, None, 0.8, str(now)) + sale
+
+    conn.executemany(
+        """INSERT OR IGNORE INTO telegram_accounts
+               (phone, session_string, password_2fa, price_cost, origin, added_at,
+                status, sold_to, sold_at, sold_ts)
+           VALUES (?, ?, ?, ?, 'BENCH', ?, ?, ?, ?, ?)""",
+        accounts(),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO blocked_numbers (phone, service, reported_at) VALUES (?, ?, ?)",
+        (
+            (random_phone(rng), rng.choice(services), str(now))
+            for _ in range(args.blocked)
+        ),
+    )
+    rebuild_rollups(conn)
+    conn.execute("ANALYZE")
+    return used
+
+
+def prices_payload(country, rng, services=700):
+    """Réponse getPrices réaliste (toute la grille d'un pays, ~700 services)."""
+    return json.dumps(
+        {
+            str(country): {
+                f"s{index}": {
+                    "cost": round(rng.uniform(0.05, 2.0), 2),
+                    "count": rng.randint(0, 5000),
+                }
+                for index in range(services)
+            }
+        }
+    )
+
+
+# --- MESURES ---
+def summarize(samples):
+    samples = sorted(samples)
+
+    def pick(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    total = sum(samples)
+    return {
+        "iterations": len(samples),
+        "mean_ms": total / len(samples) * 1000,
+        "p50_ms": pick(50) * 1000,
+        "p95_ms": pick(95) * 1000,
+        "p99_ms": pick(99) * 1000,
+        "ops_per_s": len(samples) / total if total else None,
+    }
+
+
+async def measure(fn, iterations):
+    """fn : fonction sans argument, qui peut retourner un awaitable."""
+    for _ in range(min(50, iterations)):  # Préchauffage (caches SQLite et regex)
+        result = fn()
+        if inspect.isawaitable(result):
+            await result
+    samples = []
+    for _ in range(iterations):
+        started = perf_counter()
+        result = fn()
+        if inspect.isawaitable(result):
+            await result
+        samples.append(perf_counter() - started)
+    return summarize(samples)
+
+
+def build_benchmarks(main, args, used, rng):
+    from database import HOT_QUERIES
+
+    queries = {name: sql for name, sql, _ in HOT_QUERIES}
+    start_day, end_day = main.month_bounds(datetime.now().strftime("%Y-%m"))
+    payload = prices_payload(main.COUNTRIES["france"], rng)
+    user_ids = list(range(1, args.users + 1))
+    service_names = [name.capitalize() for name in main.SERVICES]
+
+    async def reserve_cycle():
+        account = await main.reserve_telegram_account(0)
+        await main.release_telegram_account(account["id"], 0)
+
+    return {
+        "get_balance": lambda: main.get_balance(rng.choice(user_ids)),
+        "update_balance": lambda: main.update_balance(rng.choice(user_ids), 0.01),
+        "is_number_used (inconnu)": lambda: main.is_number_used(
+            random_phone(rng), rng.choice(service_names)
+        ),
+        "is_number_used (déjà vu)": lambda: main.is_number_used(*rng.choice(used)),
+        "calculate_selling_price": lambda: main.calculate_selling_price(
+            rng.uniform(0.05, 2.0)
+        ),
+        "/stats": lambda: main.db.fetchone(queries["/stats"], (start_day, end_day)),
+        "/stats (détails)": lambda: main.db.fetchall(
+            queries["/stats (détails)"], (start_day, end_day)
+        ),
+        "/history": lambda: main.db.fetchall(
+            queries["/history"], (rng.choice(user_ids),)
+        ),
+        "/history (dépôts)": lambda: main.db.fetchall(
+            queries["/history (dépôts)"], (rng.choice(user_ids),)
+        ),
+        "réservation compte Telegram": reserve_cycle,
+        "extract_login_code": lambda: [
+            main.extract_login_code(text) for text in SAMPLE_TELEGRAM_MESSAGES
+        ],
+        "parse_prices": lambda: main.parse_prices(payload, main.COUNTRIES["france"]),
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for name, stats in results.items():
+        budget = BUDGETS_MS.get(name)
+        if budget is not None and stats["p95_ms"] > budget:
+            regressions.append(
+                f"{name} : p95 {stats['p95_ms']:.3f} ms > budget {budget} ms"
+            )
+        reference = (baseline or {}).get(name)
+        if reference and stats["p50_ms"] > reference["p50_ms"] * tolerance:
+            regressions.append(
+                f"{name} : p50 {stats['p50_ms']:.3f} ms > {tolerance} x référence "
+                f"({reference['p50_ms']:.3f} ms)"
+            )
+    return regressions
+
+
+async def run(main, args, used, rng):
+    results = {}
+    for name, fn in build_benchmarks(main, args, used, rng).items():
+        results[name] = await measure(fn, args.iterations)
+        stats = results[name]
+        print(
+            f"{name:<30} p50 {stats['p50_ms']:8.3f} ms | p95 {stats['p95_ms']:8.3f} ms | "
+            f"p99 {stats['p99_ms']:8.3f} ms | {stats['ops_per_s']:10.0f} ops/s"
+        )
+    return results
+
+
+def main_cli():
+    args = build_parser().parse_args()
+    temp_dir = None
+    db_path = args.db
+    if db_path is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="quicksms-bench-")
+        db_path = os.path.join(temp_dir.name, "bench.db")
+    # Avant l'import : main/database lisent la config à l'import
+    os.environ["QUICKSMS_DB_PATH"] = db_path
+    sys.path.insert(0, HERE)
+    import main
+    from database import check_query_plans
+
+    rng = random.Random(args.seed)
+    try:
+        started = perf_counter()
+        used = main.db.run_sync(
+            seed_database,
+            args,
+            [name.capitalize() for name in main.SERVICES],
+            list(main.COUNTRIES.values()),
+            rng,
+        )
+        main.db.run_sync(main.used_numbers.load)
+        print(f"🗄️ Base synthétique prête en {perf_counter() - started:.1f} s")
+
+        plan_problems = main.db.run_sync(check_query_plans)
+        results = asyncio.run(run(main, args, used, rng))
+    finally:
+        main.db.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = find_regressions(results, baseline, args.tolerance)
+    regressions += [f"Plan de requête : {problem}" for problem in plan_problems]
+
+    report = {
+        "created_at": str(datetime.now()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "scale": {
+            key: getattr(args, key)
+            for key in ("users", "orders", "deposits", "accounts", "blocked")
+        },
+        "iterations": args.iterations,
+        "results": results,
+        "regressions": regressions,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {args.out}")
+
+    if regressions:
+        print("❌ Régressions :")
+        for regression in regressions:
+            print(f"   - {regression}")
+        sys.exit(1)
+    print("✅ Aucune régression.")
+
+
+if __name__ == "__main__":
+    main_cli()
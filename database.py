@@ -0,0 +1,638 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter
+
+# --- CONFIGURATION ---
+DB_PATH = os.getenv("QUICKSMS_DB_PATH", "database.db")
+SLOW_QUERY_THRESHOLD = 0.1  # Requêtes plus lentes loggées en console (secondes)
+
+# Réglages appliqués à l'ouverture de la connexion unique
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Lectures sans bloquer l'écriture
+    "PRAGMA synchronous=NORMAL",  # fsync au checkpoint seulement (sûr en WAL)
+    "PRAGMA busy_timeout=5000",  # Si un script externe (import) écrit en même temps
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # ~16 Mo de cache de pages
+)
+
+
+# --- AGRÉGATS DE VENTES (Rollups) ---
+# sales_hourly / sales_daily sont tenus à jour dans la même transaction que le
+# passage d'une commande en COMPLETED (ou sa sortie de COMPLETED). Le coût y est
+# stocké net en Euro : les rapports n'ont plus qu'à sommer quelques lignes.
+ACCOUNT_SERVICE = "Telegram Account"
+PRODUCT_SMS = "SMS"
+PRODUCT_ACCOUNT = "ACCOUNT"
+SMS_COST_RATE = 1.3 * 0.9  # Prix brut API -> coût net en Euro
+
+
+def product_for(service):
+    return PRODUCT_ACCOUNT if service == ACCOUNT_SERVICE else PRODUCT_SMS
+
+
+def net_cost(service, cost):
+    if not cost:
+        return 0.0
+    # Un compte Telegram stocké a déjà son coût net en Euro
+    if service == ACCOUNT_SERVICE:
+        return cost
+    return cost * SMS_COST_RATE
+
+
+def record_sale(conn, created_ts, service, price, cost, sign=1):
+    """Ajoute (sign=1) ou retire (sign=-1) une vente des agrégats."""
+    hour_ts = created_ts - created_ts % 3600
+    day = datetime.fromtimestamp(created_ts).strftime("%Y-%m-%d")
+    values = (sign, sign * (price or 0.0), sign * net_cost(service, cost))
+    product = product_for(service)
+    service = service or ""
+    conn.execute(
+        """INSERT INTO sales_hourly (hour_ts, service, product, orders, sales, cost)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (hour_ts, service, product) DO UPDATE SET
+               orders = orders + excluded.orders,
+               sales = sales + excluded.sales,
+               cost = cost + excluded.cost""",
+        (hour_ts, service, product) + values,
+    )
+    conn.execute(
+        """INSERT INTO sales_daily (day, service, product, orders, sales, cost)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (day, service, product) DO UPDATE SET
+               orders = orders + excluded.orders,
+               sales = sales + excluded.sales,
+               cost = cost + excluded.cost""",
+        (day, service, product) + values,
+    )
+
+
+def rebuild_rollups(conn):
+    """Recalcule entièrement les agrégats depuis orders. Retourne le nombre de ventes."""
+    conn.execute("DELETE FROM sales_hourly")
+    conn.execute("DELETE FROM sales_daily")
+    select = f"""SELECT {{bucket}}, COALESCE(service, ''),
+                    CASE WHEN service = :account THEN '{PRODUCT_ACCOUNT}' ELSE '{PRODUCT_SMS}' END,
+                    COUNT(*), COALESCE(SUM(price), 0),
+                    COALESCE(SUM(CASE WHEN service = :account THEN COALESCE(cost, 0)
+                                      ELSE COALESCE(cost, 0) * :rate END), 0)
+                 FROM orders
+                 WHERE status = 'COMPLETED' AND created_ts IS NOT NULL
+                 GROUP BY 1, 2"""
+    params = {"account": ACCOUNT_SERVICE, "rate": SMS_COST_RATE}
+    conn.execute(
+        "INSERT INTO sales_hourly (hour_ts, service, product, orders, sales, cost) "
+        + select.format(bucket="created_ts - created_ts % 3600"),
+        params,
+    )
+    conn.execute(
+        "INSERT INTO sales_daily (day, service, product, orders, sales, cost) "
+        + select.format(bucket="date(created_ts, 'unixepoch', 'localtime')"),
+        params,
+    )
+    return conn.execute("SELECT COALESCE(SUM(orders), 0) FROM sales_daily").fetchone()[
+        0
+    ]
+
+
+# --- MIGRATIONS (Schéma versionné) ---
+# Chaque migration est appliquée une seule fois, dans l'ordre, et enregistrée
+# dans schema_version. Ne jamais modifier une migration déjà publiée : en ajouter une.
+def _migration_1_base_schema(conn):
+    c = conn.cursor()
+    # Table Utilisateurs
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS users
+                 (discord_id INTEGER PRIMARY KEY, balance REAL DEFAULT 0.0)"""
+    )
+    # Table Commandes
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS orders
+                 (order_id TEXT PRIMARY KEY, discord_id INTEGER, 
+                  phone TEXT, price REAL, status TEXT, created_at TEXT, service TEXT)"""
+    )
+    # Table Numéros Bloqués
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS blocked_numbers
+                 (phone TEXT PRIMARY KEY, service TEXT, reported_at TEXT)"""
+    )
+
+    # Migration : Ajout colonne service si elle existe pas (pour les anciennes DB)
+    try:
+        c.execute("ALTER TABLE orders ADD COLUMN service TEXT")
+    except sqlite3.OperationalError:
+        pass  # La colonne existe déjà
+
+    # Migration : Ajout colonne cost pour le calcul de bénéfice
+    try:
+        c.execute("ALTER TABLE orders ADD COLUMN cost REAL")
+    except sqlite3.OperationalError:
+        pass  # La colonne existe déjà
+
+    # Migration : Pays de la commande + délai d'arrivée du 1er code (cadence de polling)
+    try:
+        c.execute("ALTER TABLE orders ADD COLUMN country TEXT")
+    except sqlite3.OperationalError:
+        pass  # La colonne existe déjà
+    try:
+        c.execute("ALTER TABLE orders ADD COLUMN code_delay REAL")
+    except sqlite3.OperationalError:
+        pass  # La colonne existe déjà
+
+    # Table Paramètres (Settings)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS settings
+                 (key TEXT PRIMARY KEY, value TEXT)"""
+    )
+
+    # Table Admins
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS admins
+                 (discord_id INTEGER PRIMARY KEY, added_at TEXT)"""
+    )
+
+    # Table Dépôts (Historique rechargements)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS deposits
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, discord_id INTEGER, 
+                  amount REAL, source TEXT, created_at TEXT)"""
+    )
+
+    # Table Comptes Telegram (Stock)
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS telegram_accounts
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                  phone TEXT, 
+                  session_string TEXT, 
+                  password_2fa TEXT, 
+                  origin TEXT DEFAULT 'MANUAL', 
+                  price_cost REAL DEFAULT 0.0,
+                  added_at TEXT,
+                  status TEXT DEFAULT 'AVAILABLE', 
+                  sold_to INTEGER DEFAULT NULL,
+                  sold_at TEXT DEFAULT NULL)"""
+    )
+
+
+def _migration_2_hot_path_indexes(conn):
+    # is_number_used (phone + service)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_phone_service ON orders (phone, service)"
+    )
+    # /history (commandes d'un membre, les plus récentes d'abord)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (discord_id, created_at)"
+    )
+    # /stats, rapport quotidien, reprise des commandes PENDING au démarrage
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)"
+    )
+    # /history (dépôts)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_deposits_user_created ON deposits (discord_id, created_at)"
+    )
+    # Stock : prochain compte disponible (FIFO) et comptages par statut
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tg_status_id ON telegram_accounts (status, id)"
+    )
+    # /myaccounts
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tg_sold_to ON telegram_accounts (sold_to, sold_at)"
+    )
+
+    # Un numéro ne peut être qu'une fois en base : on supprime d'abord les doublons
+    # encore en stock (on garde le compte vendu, sinon le plus ancien)
+    removed = conn.execute(
+        """DELETE FROM telegram_accounts
+           WHERE status='AVAILABLE' AND EXISTS (
+               SELECT 1 FROM telegram_accounts AS other
+               WHERE other.phone = telegram_accounts.phone
+                 AND (other.status != 'AVAILABLE' OR other.id < telegram_accounts.id))"""
+    ).rowcount
+    if removed:
+        print(f"🗄️ {removed} doublons de numéros supprimés du stock Telegram.")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_tg_phone ON telegram_accounts (phone)"
+    )
+
+
+def _migration_3_epoch_timestamps(conn):
+    # Colonnes epoch (secondes, UTC) à côté des dates texte, qui restent lisibles.
+    # Les dates texte sont en heure locale : le modificateur 'utc' les convertit.
+    for table, text_col, ts_col in (
+        ("orders", "created_at", "created_ts"),
+        ("deposits", "created_at", "created_ts"),
+        ("telegram_accounts", "sold_at", "sold_ts"),
+    ):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {ts_col} INTEGER")
+        conn.execute(
+            f"""UPDATE {table}
+                SET {ts_col} = CAST(strftime('%s', substr({text_col}, 1, 19), 'utc') AS INTEGER)
+                WHERE {text_col} IS NOT NULL"""
+        )
+
+    # Les index sur les dates texte sont remplacés par leurs équivalents epoch
+    conn.execute("DROP INDEX IF EXISTS idx_orders_user_created")
+    conn.execute("DROP INDEX IF EXISTS idx_orders_status_created")
+    conn.execute("DROP INDEX IF EXISTS idx_deposits_user_created")
+    conn.execute("DROP INDEX IF EXISTS idx_tg_sold_to")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_ts ON orders (discord_id, created_ts)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_ts ON orders (status, created_ts)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_deposits_user_ts ON deposits (discord_id, created_ts)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tg_sold_to_ts ON telegram_accounts (sold_to, sold_ts)"
+    )
+
+
+def _migration_4_sales_rollups(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS sales_hourly
+                 (hour_ts INTEGER, service TEXT, product TEXT,
+                  orders INTEGER, sales REAL, cost REAL,
+                  PRIMARY KEY (hour_ts, service, product))"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS sales_daily
+                 (day TEXT, service TEXT, product TEXT,
+                  orders INTEGER, sales REAL, cost REAL,
+                  PRIMARY KEY (day, service, product))"""
+    )
+    rebuild_rollups(conn)
+
+
+def _migration_5_stock_reservations(conn):
+    # Statut RESERVED : compte bloqué pour un acheteur jusqu'à reserved_until (epoch)
+    conn.execute("ALTER TABLE telegram_accounts ADD COLUMN reserved_by INTEGER")
+    conn.execute("ALTER TABLE telegram_accounts ADD COLUMN reserved_until INTEGER")
+
+
+def _migration_6_cancel_queue(conn):
+    # Annulations d'activations en attente de confirmation du fournisseur
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS cancel_queue
+                 (activation_id TEXT PRIMARY KEY, reason TEXT,
+                  bought_ts INTEGER, next_attempt_ts INTEGER,
+                  attempts INTEGER DEFAULT 0, last_response TEXT,
+                  created_ts INTEGER)"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_cancel_due ON cancel_queue (next_attempt_ts)"
+    )
+
+
+def _migration_7_providers(conn):
+    # Fournisseur SMS de chaque commande / annulation (NULL = fournisseur par défaut)
+    conn.execute("ALTER TABLE orders ADD COLUMN provider TEXT")
+    conn.execute("ALTER TABLE cancel_queue ADD COLUMN provider TEXT")
+
+
+def _migration_8_stock_health(conn):
+    # Dernière vérification de session du stock (/fix_stock) : OK, INVALID ou ERROR
+    conn.execute("ALTER TABLE telegram_accounts ADD COLUMN health_status TEXT")
+    conn.execute("ALTER TABLE telegram_accounts ADD COLUMN checked_ts INTEGER")
+
+
+def _migration_9_stock_checks(conn):
+    # Vérification programmée du stock : 2FA et username vus à la dernière
+    # vérification (NULL = inconnu), comptes à revérifier par ancienneté
+    conn.execute("ALTER TABLE telegram_accounts ADD COLUMN has_2fa INTEGER")
+    conn.execute("ALTER TABLE telegram_accounts ADD COLUMN username TEXT")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tg_status_checked ON telegram_accounts (status, checked_ts)"
+    )
+
+
+def _migration_10_stock_phone_unique(conn):
+    # Un numéro n'est qu'une fois en stock (AVAILABLE / RESERVED) ; un numéro
+    # déjà vendu peut être remis en stock. Remplace idx_tg_phone (migration 2,
+    # unique sur tous les statuts), qui empêchait ces remises en stock.
+    conn.execute("DROP INDEX IF EXISTS idx_tg_phone")
+
+    # Doublons déjà en stock : on garde le plus ancien, les autres sont écartés
+    # (statut DUPLICATE, visible dans /stock) sans être supprimés
+    duplicates = conn.execute(
+        """SELECT id, phone FROM telegram_accounts
+           WHERE status IN ('AVAILABLE', 'RESERVED') AND EXISTS (
+               SELECT 1 FROM telegram_accounts AS other
+               WHERE other.phone = telegram_accounts.phone
+                 AND other.status IN ('AVAILABLE', 'RESERVED')
+                 AND other.id < telegram_accounts.id)"""
+    ).fetchall()
+    conn.executemany(
+        "UPDATE telegram_accounts SET status='DUPLICATE', reserved_by=NULL, reserved_until=NULL WHERE id=?",
+        [(account_id,) for account_id, _ in duplicates],
+    )
+    for account_id, phone in duplicates:
+        print(f"⚠️ Doublon écarté du stock Telegram : id {account_id} ({phone})")
+
+    conn.execute(
+        """CREATE UNIQUE INDEX IF NOT EXISTS idx_tg_stock_phone ON telegram_accounts (phone)
+           WHERE status IN ('AVAILABLE', 'RESERVED')"""
+    )
+    # /check_account (tous statuts confondus)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tg_phone_all ON telegram_accounts (phone)"
+    )
+
+
+def _migration_11_provider_history(conn):
+    # Historique récent par fournisseur (ProviderRouter) : index couvrant qui
+    # commence par created_ts, la requête ne lit que la fenêtre demandée
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_orders_created_provider
+           ON orders (created_ts, provider, service, country, status, code_delay)"""
+    )
+
+
+def _migration_12_stock_check_errors(conn):
+    # Comptes dont la dernière vérification a échoué (réseau, FloodWait) :
+    # revérifiés après un court délai plutôt qu'au bout de TG_SWEEP_MAX_AGE
+    conn.execute(
+        """CREATE INDEX IF NOT EXISTS idx_tg_check_errors ON telegram_accounts (checked_ts)
+           WHERE status='AVAILABLE' AND health_status='ERROR'"""
+    )
+
+
+MIGRATIONS = [
+    (1, "Schéma initial", _migration_1_base_schema),
+    (
+        2,
+        "Index des chemins critiques + numéro unique en stock",
+        _migration_2_hot_path_indexes,
+    ),
+    (3, "Dates en epoch indexées (created_ts, sold_ts)", _migration_3_epoch_timestamps),
+    (4, "Agrégats de ventes horaires et journaliers", _migration_4_sales_rollups),
+    (5, "Réservation temporaire du stock Telegram", _migration_5_stock_reservations),
+    (6, "File persistante des annulations", _migration_6_cancel_queue),
+    (7, "Fournisseur SMS des commandes", _migration_7_providers),
+    (8, "Santé des sessions du stock Telegram", _migration_8_stock_health),
+    (9, "Vérification programmée du stock Telegram", _migration_9_stock_checks),
+    (10, "Numéro unique parmi le stock Telegram", _migration_10_stock_phone_unique),
+    (11, "Index de l'historique des fournisseurs", _migration_11_provider_history),
+    (
+        12,
+        "Revérification rapide des erreurs de vérification",
+        _migration_12_stock_check_errors,
+    ),
+]
+
+
+def migrate(conn):
+    """Applique les migrations manquantes. Retourne la version finale du schéma."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS schema_version
+                 (version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)"""
+    )
+    conn.commit()
+    current = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+
+    for version, description, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        # Une transaction par migration (DDL compris) : tout ou rien
+        conn.execute("BEGIN")
+        try:
+            fn(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, str(datetime.now())),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        print(f"🗄️ Migration v{version} appliquée : {description}")
+        current = version
+
+    return current
+
+
+# --- PLANS DE REQUÊTE (Chemins critiques) ---
+# (nom, requête, paramètres factices) : chacune doit passer par un index
+HOT_QUERIES = [
+    (
+        "is_number_used (orders)",
+        "SELECT 1 FROM orders WHERE phone=? AND service=?",
+        ("0", "x"),
+    ),
+    (
+        "is_number_used (blocked)",
+        "SELECT 1 FROM blocked_numbers WHERE phone=?",
+        ("0",),
+    ),
+    (
+        "/history",
+        "SELECT order_id, phone, price, status, service, created_ts FROM orders WHERE discord_id=? ORDER BY created_ts DESC LIMIT 20",
+        (0,),
+    ),
+    (
+        "/history (dépôts)",
+        "SELECT amount, source, created_at FROM deposits WHERE discord_id=? ORDER BY created_ts DESC LIMIT 20",
+        (0,),
+    ),
+    (
+        "/stats",
+        "SELECT SUM(orders), SUM(sales), SUM(cost) FROM sales_daily WHERE day >= ? AND day < ?",
+        ("2024-01-01", "2024-02-01"),
+    ),
+    (
+        "/stats (détails)",
+        "SELECT day, SUM(orders), SUM(sales), SUM(cost) FROM sales_daily WHERE day >= ? AND day < ? GROUP BY day",
+        ("2024-01-01", "2024-02-01"),
+    ),
+    (
+        "Rapport quotidien",
+        "SELECT SUM(orders), SUM(sales), SUM(cost) FROM sales_hourly WHERE hour_ts >= ?",
+        (0,),
+    ),
+    (
+        "Rapport quotidien (heure entamée)",
+        "SELECT service, price, cost FROM orders WHERE status='COMPLETED' AND created_ts >= ? AND created_ts < ?",
+        (0, 0),
+    ),
+    (
+        "Reprise PENDING",
+        "SELECT order_id, discord_id, price, service, status, provider FROM orders WHERE status='PENDING'",
+        (),
+    ),
+    (
+        "Réservation stock (FIFO)",
+        "UPDATE telegram_accounts SET status='RESERVED', reserved_by=?, reserved_until=? WHERE id = (SELECT id FROM telegram_accounts WHERE status='AVAILABLE' AND (health_status IS NULL OR (health_status='OK' AND +checked_ts >= ?)) AND NOT (has_2fa IS 1 AND password_2fa IS NULL) ORDER BY id LIMIT 1)",
+        (0, 0, 0),
+    ),
+    (
+        "Vérification programmée du stock",
+        "SELECT id, phone, session_string FROM telegram_accounts WHERE status='AVAILABLE' AND (checked_ts IS NULL OR checked_ts < ?) ORDER BY checked_ts LIMIT ?",
+        (0, 5),
+    ),
+    (
+        "Vérification programmée du stock (erreurs)",
+        "SELECT id, phone, session_string FROM telegram_accounts WHERE status='AVAILABLE' AND health_status='ERROR' AND checked_ts < ? ORDER BY checked_ts LIMIT ?",
+        (0, 5),
+    ),
+    (
+        "Réservations expirées",
+        "UPDATE telegram_accounts SET status='AVAILABLE', reserved_by=NULL, reserved_until=NULL WHERE status='RESERVED' AND reserved_until < ?",
+        (0,),
+    ),
+    (
+        "/myaccounts",
+        "SELECT id, phone, session_string, password_2fa, sold_at FROM telegram_accounts WHERE sold_to=? ORDER BY sold_ts DESC LIMIT 5",
+        (0,),
+    ),
+    (
+        "Historique des fournisseurs",
+        "SELECT provider, service, country, status, code_delay FROM orders WHERE created_ts >= ? AND country IS NOT NULL",
+        (0,),
+    ),
+    (
+        "Annulations dues",
+        "SELECT activation_id, reason, provider, bought_ts, attempts FROM cancel_queue WHERE next_attempt_ts <= ? ORDER BY next_attempt_ts LIMIT 20",
+        (0,),
+    ),
+    (
+        "/check_account",
+        "SELECT id, session_string, password_2fa, health_status, has_2fa, username, checked_ts FROM telegram_accounts WHERE phone=? ORDER BY id DESC LIMIT 1",
+        ("0",),
+    ),
+]
+
+
+def check_query_plans(conn, queries=HOT_QUERIES):
+    """
+    EXPLAIN QUERY PLAN sur les requêtes critiques. Retourne la liste des
+    problèmes (scan complet de table ou tri temporaire), vide si tout va bien.
+    """
+    problems = []
+    for name, sql, params in queries:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detail = row[-1]
+            if detail.startswith("SCAN") and "USING" not in detail:
+                problems.append(f"{name} : {detail}")
+            elif "TEMP B-TREE" in detail:
+                problems.append(f"{name} : {detail}")
+    return problems
+
+
+# --- ACCÈS BASE DE DONNÉES (Thread dédié) ---
+class Database:
+    """
+    Toutes les requêtes SQLite passent par un thread unique qui possède une
+    connexion longue durée : la boucle asyncio (Discord) n'est jamais bloquée
+    par un fsync ou un gros scan. Les helpers sont awaitables.
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.conn = None
+        # Statistiques de temps par requête : sql -> [nombre, total, max]
+        self.stats = {}
+        # Optionnel (harnais de charge) : deque de (label, durée vue de la boucle,
+        # attente dans la file du thread comprise)
+        self.timings = None
+
+    # -- Côté thread SQLite --
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            for pragma in PRAGMAS:
+                self.conn.execute(pragma)
+        return self.conn
+
+    def _record(self, label, elapsed):
+        entry = self.stats.setdefault(label, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        if elapsed > SLOW_QUERY_THRESHOLD:
+            print(f"🐢 Requête SQL lente ({elapsed * 1000:.0f} ms) : {label[:120]}")
+
+    def _call(self, label, fn, args):
+        conn = self._connection()
+        started = perf_counter()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._record(label, perf_counter() - started)
+
+    # -- Côté asyncio --
+    async def run(self, fn, *args, label=None):
+        """
+        Exécute fn(conn, *args) sur le thread SQLite dans une seule transaction
+        (commit si tout passe, rollback sinon).
+        """
+        loop = asyncio.get_running_loop()
+        label = label or fn.__name__
+        started = perf_counter()
+        try:
+            return await loop.run_in_executor(
+                self.executor, self._call, label, fn, args
+            )
+        finally:
+            if self.timings is not None:
+                self.timings.append((label, perf_counter() - started))
+
+    def run_sync(self, fn, *args, label=None):
+        """Variante bloquante, pour le démarrage (avant la boucle asyncio)."""
+        return self.executor.submit(self._call, label or fn.__name__, fn, args).result()
+
+    async def execute(self, sql, params=()):
+        """Requête d'écriture. Retourne le nombre de lignes modifiées."""
+        return await self.run(
+            lambda conn: conn.execute(sql, params).rowcount, label=sql
+        )
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.run(
+            lambda conn: conn.executemany(sql, seq_of_params).rowcount, label=sql
+        )
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(
+            lambda conn: conn.execute(sql, params).fetchone(), label=sql
+        )
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(
+            lambda conn: conn.execute(sql, params).fetchall(), label=sql
+        )
+
+    async def fetchval(self, sql, params=(), default=None):
+        """Première colonne de la première ligne (ou default)."""
+        row = await self.fetchone(sql, params)
+        return row[0] if row else default
+
+    def report(self, limit=5):
+        """Requêtes les plus coûteuses : [(sql, nombre, moyenne_ms, max_ms)]."""
+        rows = [
+            (label, count, total / count * 1000, worst * 1000)
+            for label, (count, total, worst) in list(self.stats.items())
+        ]
+        rows.sort(key=lambda row: row[1] * row[2], reverse=True)
+        return rows[:limit]
+
+    def close(self):
+        def _close():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+        self.executor.submit(_close).result()
+        self.executor.shutdown(wait=True)
+
+
+db = Database()
@@ -0,0 +1,336 @@
+"""
+Simulateur local de SMS-Activate (handler_api) et de Hoodpay.
+
+Permet de faire tourner le bot (ou load_test.py) sans argent ni API réelles :
+    python fake_apis.py --port 8081 --latency 80 --error-rate 0.02 --dup-rate 0.05
+
+Puis lancer le bot avec :
+    SMS_ACTIVATE_BASE_URL=http://127.0.0.1:8081/stubs/handler_api.php
+    HOODPAY_BASE_URL=http://127.0.0.1:8081/v1
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from itertools import count
+from time import monotonic
+
+import aiohttp
+from aiohttp import web
+
+# Codes services / pays connus du bot (voir SERVICES et COUNTRIES dans main.py)
+SERVICE_CODES = ("wa", "tg", "go", "am", "oi", "mm", "fb", "ig", "lf", "ub")
+COUNTRY_CODES = ("78", "36", "16")
+COUNTRY_PREFIXES = {"78": "33", "36": "1", "16": "44"}
+
+
+class FakeProvider:
+    """État en mémoire des activations et des paiements simulés."""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.ids = count(100000)
+        self.activations = {}  # id -> dict (phone, statut, code prévu...)
+        self.issued_phones = []
+        self.payments = {}
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "numbers": 0,
+            "duplicates": 0,
+            "no_numbers": 0,
+            "codes": 0,
+            "cancels": 0,
+            "payments": 0,
+            "webhooks_failed": 0,
+        }
+        self.session = None
+        self.tasks = set()
+
+    # -- Outils --
+    async def simulate_latency(self):
+        delay = self.config.latency + self.rng.uniform(
+            -self.config.jitter, self.config.jitter
+        )
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    def failing(self):
+        return self.rng.random() < self.config.error_rate
+
+    def background(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def new_phone(self, country):
+        prefix = COUNTRY_PREFIXES.get(str(country), "33")
+        return prefix + "".join(str(self.rng.randint(0, 9)) for _ in range(9))
+
+    def schedule_code(self, activation):
+        if self.rng.random() < self.config.code_rate:
+            low, high = self.config.code_delay
+            activation["code_at"] = monotonic() + self.rng.uniform(low, high)
+            activation["code"] = str(self.rng.randint(100000, 999999))
+        else:
+            activation["code_at"] = None
+
+    def code_of(self, activation):
+        """Code arrivé pour cette activation, sinon None."""
+        code_at = activation.get("code_at")
+        if activation["status"] != "WAIT" or code_at is None or monotonic() < code_at:
+            return None
+        if not activation.get("delivered"):
+            activation["delivered"] = True
+            self.stats["codes"] += 1
+        return activation["code"]
+
+    # -- SMS-Activate (handler_api) --
+    async def handler_api(self, request):
+        self.stats["requests"] += 1
+        await self.simulate_latency()
+        if self.failing():
+            self.stats["errors"] += 1
+            return web.Response(status=502, text="Bad Gateway")
+
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        action = params.get("action")
+        handler = {
+            "getNumber": self.get_number,
+            "getPrices": self.get_prices,
+            "getStatus": self.get_status,
+            "setStatus": self.set_status,
+            "getActiveActivations": self.get_active_activations,
+        }.get(action)
+        if handler is None:
+            return web.Response(text="WRONG_ACTION")
+        return web.Response(text=handler(params))
+
+    def get_number(self, params):
+        if self.rng.random() < self.config.no_numbers_rate:
+            self.stats["no_numbers"] += 1
+            return "NO_NUMBERS"
+
+        country = params.get("country", "0")
+        if self.issued_phones and self.rng.random() < self.config.dup_rate:
+            # Numéro déjà attribué : le bot doit le détecter et l'annuler
+            phone = self.rng.choice(self.issued_phones)
+            self.stats["duplicates"] += 1
+        else:
+            phone = self.new_phone(country)
+            self.issued_phones.append(phone)
+
+        activation_id = str(next(self.ids))
+        activation = {
+            "phone": phone,
+            "service": params.get("service"),
+            "country": country,
+            "status": "WAIT",
+            "created": monotonic(),
+        }
+        self.schedule_code(activation)
+        self.activations[activation_id] = activation
+        self.stats["numbers"] += 1
+
+        if self.config.sms_push_url and activation["code_at"] is not None:
+            self.background(self.push_code(activation_id, activation))
+        return f"ACCESS_NUMBER:{activation_id}:{phone}"
+
+    def get_prices(self, params):
+        services = [params["service"]] if params.get("service") else SERVICE_CODES
+        countries = [params["country"]] if params.get("country") else COUNTRY_CODES
+        data = {
+            str(country): {
+                service: {"cost": self.config.cost, "count": self.config.stock}
+                for service in services
+            }
+            for country in countries
+        }
+        return json.dumps(data)
+
+    def get_status(self, params):
+        activation = self.activations.get(str(params.get("id")))
+        if activation is None:
+            return "NO_ACTIVATION"
+        if activation["status"] == "CANCEL":
+            return "STATUS_CANCEL"
+        code = self.code_of(activation)
+        if code:
+            return f"STATUS_OK:{code}"
+        return "STATUS_WAIT_CODE"
+
+    def set_status(self, params):
+        activation = self.activations.get(str(params.get("id")))
+        if activation is None:
+            return "NO_ACTIVATION"
+        status = str(params.get("status"))
+        if status == "8":
+            if activation["status"] == "CANCEL":
+                return "ACCESS_ACTIVATION_CANCELED"
+            if monotonic() - activation["created"] < self.config.min_cancel_age:
+                return "EARLY_CANCEL_DENIED"
+            activation["status"] = "CANCEL"
+            self.stats["cancels"] += 1
+            return "ACCESS_CANCEL"
+        if status == "6":
+            activation["status"] = "DONE"
+            return "ACCESS_ACTIVATION"
+        if status == "3":
+            # Nouveau SMS demandé
+            activation["delivered"] = False
+            self.schedule_code(activation)
+            return "ACCESS_RETRY_GET"
+        return "BAD_STATUS"
+
+    def get_active_activations(self, params):
+        active = []
+        for activation_id, activation in self.activations.items():
+            if activation["status"] != "WAIT":
+                continue
+            code = self.code_of(activation)
+            active.append(
+                {
+                    "activationId": activation_id,
+                    "phoneNumber": activation["phone"],
+                    "smsCode": [code] if code else None,
+                }
+            )
+        if not active:
+            return json.dumps({"status": "error", "error": "NO_ACTIVATIONS"})
+        return json.dumps({"status": "success", "activeActivations": active})
+
+    async def push_code(self, activation_id, activation):
+        await asyncio.sleep(max(0.0, activation["code_at"] - monotonic()))
+        if activation["status"] != "WAIT":
+            return
+        payload = {"activationId": activation_id, "code": activation["code"]}
+        await self.post_webhook(self.config.sms_push_url, payload)
+
+    # -- Hoodpay --
+    async def create_payment(self, request):
+        self.stats["requests"] += 1
+        await self.simulate_latency()
+        if self.failing():
+            self.stats["errors"] += 1
+            return web.json_response({"message": "Internal error"}, status=500)
+
+        body = await request.json()
+        payment_id = f"pay_{next(self.ids)}"
+        self.payments[payment_id] = body
+        self.stats["payments"] += 1
+        # Le "client" paie après payment_delay : webhook payment.succeeded
+        self.background(self.complete_payment(payment_id, body))
+        return web.json_response(
+            {
+                "data": {
+                    "id": payment_id,
+                    "checkoutUrl": f"http://{request.host}/checkout/{payment_id}",
+                }
+            },
+            status=201,
+        )
+
+    async def complete_payment(self, payment_id, body):
+        await asyncio.sleep(self.config.payment_delay)
+        payload = {
+            "type": "payment.succeeded",
+            "data": {
+                "id": payment_id,
+                "amount": body.get("amount"),
+                "currency": body.get("currency"),
+                "metadata": body.get("metadata") or {},
+            },
+        }
+        await self.post_webhook(self.config.webhook_url, payload)
+
+    async def post_webhook(self, url, payload):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        try:
+            async with self.session.post(url, json=payload) as resp:
+                if resp.status != 200:
+                    self.stats["webhooks_failed"] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats["webhooks_failed"] += 1
+            print(f"Webhook simulé en échec ({url}): {e!r}")
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def close(self, app):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+
+def build_app(config):
+    provider = FakeProvider(config)
+    app = web.Application()
+    app.router.add_route("*", "/stubs/handler_api.php", provider.handler_api)
+    app.router.add_post("/v1/payments", provider.create_payment)
+    app.router.add_get("/_stats", provider.get_stats)
+    app.on_cleanup.append(provider.close)
+    app["provider"] = provider
+    return app
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Simulateur SMS-Activate + Hoodpay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=50, help="ms")
+    parser.add_argument("--jitter", type=float, default=20, help="ms (+/-)")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="part de réponses HTTP 5xx"
+    )
+    parser.add_argument(
+        "--dup-rate", type=float, default=0.0, help="part de numéros déjà attribués"
+    )
+    parser.add_argument(
+        "--no-numbers-rate", type=float, default=0.0, help="part de NO_NUMBERS"
+    )
+    parser.add_argument(
+        "--code-delay",
+        type=float,
+        nargs=2,
+        default=(5.0, 20.0),
+        metavar=("MIN", "MAX"),
+        help="délai d'arrivée du SMS (s)",
+    )
+    parser.add_argument(
+        "--code-rate", type=float, default=1.0, help="part d'activations avec SMS"
+    )
+    parser.add_argument(
+        "--min-cancel-age",
+        type=float,
+        default=0.0,
+        help="annulation refusée avant (s), EARLY_CANCEL_DENIED",
+    )
+    parser.add_argument("--cost", type=float, default=0.25)
+    parser.add_argument("--stock", type=int, default=5000)
+    parser.add_argument(
+        "--webhook-url",
+        default="http://127.0.0.1:5000/webhook",
+        help="webhook Hoodpay du bot",
+    )
+    parser.add_argument("--payment-delay", type=float, default=1.0, help="s")
+    parser.add_argument(
+        "--sms-push-url",
+        default=None,
+        help="webhook SMS du bot (/sms_webhook?token=...), sinon polling seul",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+if __name__ == "__main__":
+    config = build_parser().parse_args()
+    print(f"🧪 Simulateur SMS-Activate/Hoodpay sur http://{config.host}:{config.port}")
+    web.run_app(build_app(config), host=config.host, port=config.port, print=None)
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import os
 import glob
@@ -5,141 +6,213 @@ import json
 import sqlite3
 import shutil
 from datetime import datetime
+from time import monotonic
 from telethon import TelegramClient
+from telethon.crypto import AuthKey
+from telethon.errors import FloodWaitError
 from telethon.sessions import StringSession
 from telethon.tl.functions.account import GetPasswordRequest
 from dotenv import load_dotenv
 
-# Charger la config
+# Charger la config (avant database.py, qui lit QUICKSMS_DB_PATH)
 load_dotenv()
 
+from database import DB_PATH, migrate
+from telethon_governor import PRIORITY_BACKGROUND, TelethonGovernor, session_dc
+
 # Dossiers
 SESSIONS_DIR = "sessions"
 PROCESSED_DIR = "sessions/processed"
-DB_PATH = "database.db"
+
+# Identifiants d'application par défaut si le JSON n'en fournit pas
+DEFAULT_API_ID = 2040
+DEFAULT_API_HASH = "b18441a1ff607e10a989891a5462e627"
+VALIDATE_CONCURRENCY = 5  # Connexions Telegram simultanées (--validate)
 
 # Créer le dossier processed si inexistant
 if not os.path.exists(PROCESSED_DIR):
     os.makedirs(PROCESSED_DIR)
 
 
-# Connexion DB
-def add_to_db(phone, session_string, password, cost):
-    conn = sqlite3.connect(DB_PATH)
-    # Vérif doublon
-    exists = conn.execute(
-        "SELECT 1 FROM telegram_accounts WHERE phone=?", (phone,)
-    ).fetchone()
-    if exists:
-        print(f"⚠️ {phone} déjà en base. Skipped.")
-        conn.close()
-        return False
-
-    conn.execute(
-        "INSERT INTO telegram_accounts (phone, session_string, password_2fa, price_cost, origin, added_at, status) VALUES (?, ?, ?, ?, ?, ?, 'AVAILABLE')",
-        (phone, session_string, password, cost, "IMPORT_SCRIPT", str(datetime.now())),
-    )
-    conn.commit()
-    conn.close()
-    return True
-
+class SessionFile:
+    """Un compte à importer : fichier .session + JSON optionnel."""
 
-async def process_file(file_path, cost):
-    filename = os.path.basename(file_path)
-    phone_raw = os.path.splitext(filename)[0]  # +12345
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.filename = os.path.basename(file_path)
+        self.phone = os.path.splitext(self.filename)[0]  # +12345
+        self.json_path = file_path.replace(".session", ".json")
+        self.api_id = DEFAULT_API_ID
+        self.api_hash = DEFAULT_API_HASH
+        self.password = None
+        self.session_string = None
+        self.error = None
+        self.has_2fa = None  # Connu seulement avec --validate
 
-    json_path = file_path.replace(".session", ".json")
 
-    # Lecture JSON pour infos
-    api_id = 2040  # Default backup
-    api_hash = "b18441a1ff607e10a989891a5462e627"
-    password = None
+def read_json_info(account):
+    if not os.path.exists(account.json_path):
+        return
+    try:
+        with open(account.json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("app_id"):
+            account.api_id = data["app_id"]
+        if data.get("app_hash"):
+            account.api_hash = data["app_hash"]
+
+        # Tentative de récupération du mot de passe avec plusieurs clés possibles
+        account.password = (
+            data.get("twoFA") or data.get("password") or data.get("cloud_password")
+        )
+    except Exception as e:
+        print(f"⚠️ Erreur lecture JSON pour {account.phone}: {e}")
 
-    if os.path.exists(json_path):
-        try:
-            with open(json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if data.get("app_id"):
-                    api_id = data["app_id"]
-                if data.get("app_hash"):
-                    api_hash = data["app_hash"]
-
-                # Tentative de récupération du mot de passe avec plusieurs clés possibles
-                password = (
-                    data.get("twoFA")
-                    or data.get("password")
-                    or data.get("cloud_password")
-                )
-        except Exception as e:
-            print(f"⚠️ Erreur lecture JSON pour {phone_raw}: {e}")
 
-    # Connexion Telethon en utilisant le fichier .session
-    # Note: On doit passer le chemin SANS l'extension .session à TelegramClient
-    session_path_root = os.path.join(SESSIONS_DIR, phone_raw)
+def read_session_string(file_path):
+    """
+    Convertit un fichier .session Telethon (SQLite) en StringSession sans
+    connexion réseau : on lit directement le DC et la clé d'autorisation.
+    """
+    conn = sqlite3.connect(f"file:{file_path}?mode=ro", uri=True)
+    try:
+        row = conn.execute(
+            "SELECT dc_id, server_address, port, auth_key FROM sessions"
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row or not row[3]:
+        return None
 
-    print(f"🔄 Traitement de {phone_raw}...")
+    dc_id, server_address, port, auth_key = row
+    session = StringSession()
+    session.set_dc(dc_id, server_address, port)
+    session.auth_key = AuthKey(auth_key)
+    return session.save()
 
-    client = TelegramClient(session_path_root, api_id, api_hash)
 
+def load_offline(file_path):
+    """Étape 1 (hors ligne) : JSON + conversion en StringSession."""
+    account = SessionFile(file_path)
+    read_json_info(account)
     try:
-        await client.connect()
-
-        if not await client.is_user_authorized():
-            print(f"❌ {phone_raw} : Session invalide ou déconnectée.")
-            await client.disconnect()
-            await client.disconnect()
-            return False
+        account.session_string = read_session_string(file_path)
+        if not account.session_string:
+            account.error = "pas de clé d'autorisation dans le fichier"
+    except sqlite3.Error as e:
+        account.error = f"fichier .session illisible ({e})"
+    return account
+
+
+class Validator:
+    """
+    Étape 2 (optionnelle) : vérification en ligne via un régulateur Telethon
+    propre au script (connexions plafonnées, pause FloodWait commune).
+    """
+
+    def __init__(self, concurrency):
+        self.governor = TelethonGovernor(concurrency, concurrency)
+
+    async def validate(self, account):
+        async def check():
+            client = TelegramClient(
+                StringSession(account.session_string),
+                account.api_id,
+                account.api_hash,
+            )
+            try:
+                await client.connect()
+                if not await client.is_user_authorized():
+                    return None
+                return await client(GetPasswordRequest())
+            finally:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
 
-        # Vérification réelle du 2FA sur le compte
         try:
-            password_status = await client(GetPasswordRequest())
-            has_2fa_real = password_status.has_password
-
-            if has_2fa_real and not password:
-                print(
-                    f"⚠️ ATTENTION : {phone_raw} a un 2FA actif mais AUCUN mot de passe dans le JSON !"
-                )
-            elif not has_2fa_real and password:
-                print(
-                    f"⚠️ Info : {phone_raw} a un mot de passe dans le JSON mais le 2FA semble inactif."
-                )
-
-        except Exception as exc_2fa:
-            print(f"⚠️ Impossible de vérifier le statut 2FA pour {phone_raw}: {exc_2fa}")
-
-        # Conversion en StringSession
-        string_session = StringSession.save(client.session)
-
-        # Ajout DB
-        added = add_to_db(phone_raw, string_session, password, cost)
-
-        if added:
-            print(f"✅ {phone_raw} importé avec succès !")
+            password_status = await self.governor.run(
+                check,
+                priority=PRIORITY_BACKGROUND,
+                dc_id=session_dc(account.session_string),
+            )
+        except FloodWaitError:
+            account.error = "FloodWait répété"
+            return
+        except Exception as e:
+            account.error = f"erreur de connexion ({e})"
+            return
+        if password_status is None:
+            account.error = "session invalide ou déconnectée"
+            return
+        self.check_2fa(account, password_status)
+
+    @staticmethod
+    def check_2fa(account, password_status):
+        # Vérification réelle du 2FA sur le compte
+        account.has_2fa = password_status.has_password
+        if account.has_2fa and not account.password:
+            # Invendable : rejeté (laissé dans sessions/ pour compléter le JSON)
+            account.error = "2FA actif mais AUCUN mot de passe dans le JSON"
+        elif not account.has_2fa and account.password:
+            print(
+                f"⚠️ Info : {account.phone} a un mot de passe dans le JSON mais le 2FA semble inactif."
+            )
 
-        await client.disconnect()
 
-        # Déplacement vers processed (pour ne pas réimporter)
-        shutil.move(file_path, os.path.join(PROCESSED_DIR, filename))
-        if os.path.exists(json_path):
-            shutil.move(
-                json_path, os.path.join(PROCESSED_DIR, os.path.basename(json_path))
+def add_to_db(accounts, cost, validated):
+    """
+    Étape 3 : insertion en une transaction. L'index unique des numéros en stock écarte
+    les comptes déjà en stock. Retourne le nombre de comptes ajoutés.
+    """
+    now = datetime.now()
+    # Comptes vérifiés en ligne : santé connue dès l'import (voir /fix_stock)
+    health = "OK" if validated else None
+    checked_ts = int(now.timestamp()) if validated else None
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        migrate(conn)
+        before = conn.total_changes
+        with conn:
+            conn.executemany(
+                """INSERT OR IGNORE INTO telegram_accounts
+                       (phone, session_string, password_2fa, price_cost, origin, added_at,
+                        status, health_status, checked_ts, has_2fa)
+                   VALUES (?, ?, ?, ?, 'IMPORT_SCRIPT', ?, 'AVAILABLE', ?, ?, ?)""",
+                [
+                    (
+                        account.phone,
+                        account.session_string,
+                        account.password,
+                        cost,
+                        str(now),
+                        health,
+                        checked_ts,
+                        None if account.has_2fa is None else int(account.has_2fa),
+                    )
+                    for account in accounts
+                ],
             )
+        return conn.total_changes - before
+    finally:
+        conn.close()
 
-        return True
 
-    except Exception as e:
-        print(f"❌ Erreur critique sur {phone_raw}: {e}")
-        try:
-            await client.disconnect()
-        except:
-            pass
-        return False
+def move_processed(account):
+    # Déplacement vers processed (pour ne pas réimporter)
+    shutil.move(account.file_path, os.path.join(PROCESSED_DIR, account.filename))
+    if os.path.exists(account.json_path):
+        shutil.move(
+            account.json_path,
+            os.path.join(PROCESSED_DIR, os.path.basename(account.json_path)),
+        )
 
 
-async def main():
+async def main(args):
     print("🚀 Démarrage de l'import des sessions...")
 
-    # Liste tous les .session
+    # Liste tous les .session (glob non récursif : processed/ est ignoré)
     files = glob.glob(os.path.join(SESSIONS_DIR, "*.session"))
     print(f"📂 {len(files)} fichiers trouvés.")
 
@@ -147,28 +220,63 @@ async def main():
         print("Fin du script (rien à faire).")
         return
 
-    try:
-        cost_input = input("💰 Entrez le coût d'achat par compte (en €) [ex: 1.5] : ")
-        cost = float(cost_input)
-    except ValueError:
-        print("❌ Prix invalide. Utilisation de la valeur par défaut : 1.5€")
-        cost = 1.5
-
-    count = 0
-    for f in files:
-        # On ignore ceux qui sont déjà dans processed (meme si glob ne devrait pas les voir si pas recursif)
-        if "processed" in f:
-            continue
-
-        success = await process_file(f, cost)
-        if success:
-            count += 1
+    cost = args.cost
+    if cost is None:
+        try:
+            cost_input = input(
+                "💰 Entrez le coût d'achat par compte (en €) [ex: 1.5] : "
+            )
+            cost = float(cost_input)
+        except ValueError:
+            print("❌ Prix invalide. Utilisation de la valeur par défaut : 1.5€")
+            cost = 1.5
+
+    timings = {}
+    started = monotonic()
+    accounts = [load_offline(f) for f in files]
+    timings["Conversion hors ligne"] = monotonic() - started
+
+    if args.validate:
+        step = monotonic()
+        validator = Validator(args.concurrency)
+        await asyncio.gather(*(validator.validate(a) for a in accounts if not a.error))
+        timings["Validation en ligne"] = monotonic() - step
+
+    ready = [a for a in accounts if not a.error]
+    for account in accounts:
+        if account.error:
+            print(f"❌ {account.phone} : {account.error}")
+
+    step = monotonic()
+    added = add_to_db(ready, cost, args.validate) if ready else 0
+    for account in ready:
+        move_processed(account)
+    timings["Écriture en base"] = monotonic() - step
+    total = monotonic() - started
+
+    print(f"\n✨ Terminé ! {added} comptes importés dans la Base de Données.")
+    print(
+        f"📊 {len(files)} fichiers | {added} ajoutés | {len(ready) - added} déjà en stock | "
+        f"{len(accounts) - len(ready)} rejetés"
+    )
+    for name, elapsed in timings.items():
+        print(f"   {name} : {elapsed:.2f}s")
+    print(
+        f"   Total : {total:.2f}s ({len(files) / total if total else 0:.1f} fichiers/s)"
+    )
 
-        # Petite pause pour éviter de flood Telegram
-        await asyncio.sleep(1)
 
-    print(f"\n✨ Terminé ! {count} comptes importés dans la Base de Données.")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import des sessions Telegram")
+    parser.add_argument("--cost", type=float, default=None, help="coût par compte (€)")
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="vérifie chaque session en ligne (autorisation + 2FA) avant import",
+    )
+    parser.add_argument("--concurrency", type=int, default=VALIDATE_CONCURRENCY)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
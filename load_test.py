@@ -0,0 +1,433 @@
+"""
+Harnais de charge de bout en bout (sans Discord, sans argent réel).
+
+Lance fake_apis.py, importe le bot sur une base SQLite temporaire, puis simule
+N clients en parallèle : recharge Hoodpay (webhook), achat via
+execute_buy_logic, attente du code (check_sms_loop), puis "Terminer" ou
+"Annuler" via les boutons d'OrderView.
+
+    python load_test.py --customers 50 --purchases 2 --dup-rate 0.05 --json out.json
+
+Rapporte p50/p95/p99 : temps jusqu'au numéro, jusqu'au code, latence des
+écritures SQLite (vue de la boucle) et retard de la boucle asyncio.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import sys
+import tempfile
+from collections import Counter, deque
+from time import perf_counter
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOOP_LAG_INTERVAL = 0.05  # Période de la sonde de retard de boucle (s)
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Harnais de charge QuickSMS")
+    parser.add_argument("--customers", type=int, default=20)
+    parser.add_argument("--purchases", type=int, default=1, help="achats par client")
+    parser.add_argument("--deposit", type=float, default=20.0, help="€ par client")
+    parser.add_argument(
+        "--cancel-rate",
+        type=float,
+        default=0.0,
+        help="part des clients qui annulent au lieu d'attendre le code",
+    )
+    parser.add_argument("--code-timeout", type=float, default=90.0, help="s")
+    parser.add_argument(
+        "--ramp", type=float, default=2.0, help="étalement des départs (s)"
+    )
+    parser.add_argument("--services", default="telegram,whatsapp")
+    parser.add_argument("--countries", default="france,united_kingdom")
+    parser.add_argument("--fake-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=5055)
+    parser.add_argument("--latency", type=float, default=50, help="ms (simulateur)")
+    parser.add_argument("--jitter", type=float, default=20, help="ms (simulateur)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dup-rate", type=float, default=0.0)
+    parser.add_argument("--no-numbers-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--code-delay", type=float, nargs=2, default=(2.0, 10.0), metavar=("MIN", "MAX")
+    )
+    parser.add_argument("--sms-push", action="store_true", help="codes par webhook")
+    parser.add_argument("--db", default=None, help="base SQLite (défaut: temporaire)")
+    parser.add_argument("--json", default=None, help="écrit le rapport dans ce fichier")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser
+
+
+def configure_env(args, db_path, sms_secret):
+    """À faire AVANT d'importer main/database : la config est lue à l'import."""
+    fake = f"http://127.0.0.1:{args.fake_port}"
+    os.environ["SMS_ACTIVATE_BASE_URL"] = f"{fake}/stubs/handler_api.php"
+    os.environ["SMS_ACTIVATE_API_KEY"] = "load-test"
+    os.environ["SMS_EXTRA_PROVIDERS"] = ""
+    os.environ["HOODPAY_BASE_URL"] = f"{fake}/v1"
+    os.environ["HOODPAY_API_KEY"] = "load-test"
+    os.environ["HOODPAY_BUSINESS_ID"] = "load-test"
+    os.environ["WEBHOOK_PORT"] = str(args.webhook_port)
+    os.environ["QUICKSMS_DB_PATH"] = db_path
+    if sms_secret:
+        os.environ["SMS_WEBHOOK_SECRET"] = sms_secret
+    else:
+        os.environ.pop("SMS_WEBHOOK_SECRET", None)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {
+        "count": len(values),
+        "p50": pick(50),
+        "p95": pick(95),
+        "p99": pick(99),
+        "max": values[-1],
+    }
+
+
+# --- FAUX OBJETS DISCORD ---
+class FakeMessage:
+    def __init__(self, content=None, view=None):
+        self.content = content
+        self.view = view
+
+    async def edit(self, **kwargs):
+        self.view = kwargs.get("view", self.view)
+
+
+class FakeChannel:
+    """MP du client : on repère l'envoi du numéro et l'arrivée du code."""
+
+    def __init__(self):
+        self.messages = []
+        self.view = None
+        self.code_event = asyncio.Event()
+
+    async def send(self, content=None, view=None, **kwargs):
+        self.messages.append(content)
+        if view is not None and self.view is None:
+            self.view = view
+        if content and "CODE REÇU" in content:
+            self.code_event.set()
+        return FakeMessage(content, view)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.dm = FakeChannel()
+
+    async def create_dm(self):
+        return self.dm
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content)
+        return FakeMessage(content)
+
+
+class FakeResponse:
+    def __init__(self, followup):
+        self.followup = followup
+        self.done = False
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        self.followup.messages.append(content)
+
+    def is_done(self):
+        return self.done
+
+
+class FakeInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.guild = None
+        self.followup = FakeFollowup()
+        self.response = FakeResponse(self.followup)
+
+    async def edit_original_response(self, **kwargs):
+        return None
+
+
+# --- SONDES ---
+async def watch_loop_lag(samples, stop):
+    while not stop.is_set():
+        started = perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        samples.append(perf_counter() - started - LOOP_LAG_INTERVAL)
+
+
+async def wait_for_balance(main, user_id, amount, timeout):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if await main.get_balance(user_id) >= amount:
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+# --- SCÉNARIO CLIENT ---
+async def customer(main, index, args, rng, results):
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    user_id = 900000 + index
+    services = args.services.split(",")
+    countries = args.countries.split(",")
+
+    # 1. Recharge via Hoodpay (création du paiement puis webhook du simulateur)
+    started = perf_counter()
+    url = await main.hoodpay_api.create_payment(args.deposit, user_id, 0)
+    if not url or not await wait_for_balance(main, user_id, args.deposit, 30):
+        results["outcomes"]["recharge_échouée"] += 1
+        return
+    results["time_to_credit"].append(perf_counter() - started)
+
+    for _ in range(args.purchases):
+        user = FakeUser(user_id)
+        interaction = FakeInteraction(user)
+        service_key = rng.choice(services)
+        country_key = rng.choice(countries)
+
+        # 2. Achat (même chemin que le bouton du dashboard)
+        started = perf_counter()
+        await main.execute_buy_logic(interaction, service_key, country_key)
+        view = user.dm.view
+        if view is None:
+            reason = (
+                interaction.followup.messages[-1]
+                if interaction.followup.messages
+                else "?"
+            )
+            results["outcomes"]["achat_refusé"] += 1
+            results["errors"][str(reason)[:80]] += 1
+            continue
+        results["time_to_number"].append(perf_counter() - started)
+
+        # 3. Annulation immédiate ou attente du code
+        if rng.random() < args.cancel_rate:
+            click = FakeInteraction(user)
+            await view.cancel.callback(click)
+            results["outcomes"][
+                "annulée" if view.is_cancelled else "annulation_refusée"
+            ] += 1
+            continue
+
+        try:
+            await asyncio.wait_for(user.dm.code_event.wait(), timeout=args.code_timeout)
+        except asyncio.TimeoutError:
+            results["outcomes"]["sans_code"] += 1
+            click = FakeInteraction(user)
+            await view.cancel.callback(click)
+            continue
+        results["time_to_code"].append(perf_counter() - started)
+
+        # 4. "Terminer" (check_sms_loop passe la commande en COMPLETED)
+        click = FakeInteraction(user)
+        await view.finish.callback(click)
+        results["outcomes"]["terminée"] += 1
+
+
+async def wait_for_settled(main, timeout):
+    """Laisse check_sms_loop clôturer les commandes (COMPLETED/REFUNDED)."""
+    deadline = perf_counter() + timeout
+    pending = None
+    while perf_counter() < deadline:
+        pending = await main.db.fetchval(
+            "SELECT COUNT(*) FROM orders WHERE status='PENDING'", default=0
+        )
+        if not pending:
+            return 0
+        await asyncio.sleep(0.5)
+    return pending
+
+
+async def start_fake_apis(args, sms_secret):
+    command = [
+        sys.executable,
+        os.path.join(HERE, "fake_apis.py"),
+        "--port",
+        str(args.fake_port),
+        "--latency",
+        str(args.latency),
+        "--jitter",
+        str(args.jitter),
+        "--error-rate",
+        str(args.error_rate),
+        "--dup-rate",
+        str(args.dup_rate),
+        "--no-numbers-rate",
+        str(args.no_numbers_rate),
+        "--code-delay",
+        str(args.code_delay[0]),
+        str(args.code_delay[1]),
+        "--webhook-url",
+        f"http://127.0.0.1:{args.webhook_port}/webhook",
+    ]
+    if sms_secret:
+        command += [
+            "--sms-push-url",
+            f"http://127.0.0.1:{args.webhook_port}/sms_webhook?token={sms_secret}",
+        ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    process = await asyncio.create_subprocess_exec(*command)
+
+    # Attente que le simulateur réponde
+    async with aiohttp.ClientSession() as session:
+        for _ in range(50):
+            try:
+                async with session.get(f"http://127.0.0.1:{args.fake_port}/_stats"):
+                    return process
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Le simulateur fake_apis.py ne démarre pas")
+
+
+async def fetch_fake_stats(args):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{args.fake_port}/_stats") as resp:
+            return await resp.json()
+
+
+async def run(main, args, sms_secret):
+    rng = random.Random(args.seed)
+    results = {
+        "time_to_credit": [],
+        "time_to_number": [],
+        "time_to_code": [],
+        "outcomes": Counter(),
+        "errors": Counter(),
+    }
+    lag_samples = []
+    main.db.timings = deque()
+
+    fake = await start_fake_apis(args, sms_secret)
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(watch_loop_lag(lag_samples, stop))
+    try:
+        await main.start_webhook_server()
+        main.cancel_queue.start()
+
+        started = perf_counter()
+        await asyncio.gather(
+            *(customer(main, i, args, rng, results) for i in range(args.customers))
+        )
+        elapsed = perf_counter() - started
+        still_pending = await wait_for_settled(main, main.SMS_VIEW_CHECK_INTERVAL * 3)
+        fake_stats = await fetch_fake_stats(args)
+    finally:
+        stop.set()
+        await lag_task
+        if main.webhook_runner is not None:
+            await main.webhook_runner.cleanup()
+        await main.sms_router.close()
+        await main.hoodpay_api.close()
+        fake.terminate()
+        await fake.wait()
+
+    writes = [
+        duration
+        for label, duration in main.db.timings
+        if label.startswith("_") or label.lstrip().upper().startswith(WRITE_PREFIXES)
+    ]
+    reads = [
+        duration
+        for label, duration in main.db.timings
+        if label.lstrip().upper().startswith("SELECT")
+    ]
+    return {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("json",)
+        },
+        "duration_s": elapsed,
+        "outcomes": dict(results["outcomes"]),
+        "errors": dict(results["errors"]),
+        "orders_still_pending": still_pending,
+        "time_to_credit_s": percentiles(results["time_to_credit"]),
+        "time_to_number_s": percentiles(results["time_to_number"]),
+        "time_to_code_s": percentiles(results["time_to_code"]),
+        "db_write_s": percentiles(writes),
+        "db_read_s": percentiles(reads),
+        "loop_lag_s": percentiles(lag_samples),
+        "acquisition": [list(row) for row in main.number_acquirer.report()],
+        "fake_apis": fake_stats,
+    }
+
+
+def print_report(report):
+    print("\n📊 RÉSULTATS DU TEST DE CHARGE")
+    print(f"Durée : {report['duration_s']:.1f} s | Issues : {report['outcomes']}")
+    if report["errors"]:
+        print(f"Refus : {report['errors']}")
+    if report["orders_still_pending"]:
+        print(f"⚠️ Commandes encore PENDING : {report['orders_still_pending']}")
+    for key, label in (
+        ("time_to_credit_s", "Recharge -> solde"),
+        ("time_to_number_s", "Temps jusqu'au numéro"),
+        ("time_to_code_s", "Temps jusqu'au code"),
+        ("db_write_s", "Écritures SQLite"),
+        ("db_read_s", "Lectures SQLite"),
+        ("loop_lag_s", "Retard boucle asyncio"),
+    ):
+        stats = report[key]
+        if not stats:
+            print(f"{label:<24} : aucune mesure")
+            continue
+        print(
+            f"{label:<24} : p50 {stats['p50'] * 1000:8.1f} ms | p95 {stats['p95'] * 1000:8.1f} ms | "
+            f"p99 {stats['p99'] * 1000:8.1f} ms | max {stats['max'] * 1000:8.1f} ms (n={stats['count']})"
+        )
+    print(f"Simulateur : {report['fake_apis']}")
+
+
+def main_cli():
+    args = build_parser().parse_args()
+    temp_dir = None
+    db_path = args.db
+    if db_path is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="quicksms-load-")
+        db_path = os.path.join(temp_dir.name, "load.db")
+    sms_secret = secrets.token_hex(8) if args.sms_push else None
+    configure_env(args, db_path, sms_secret)
+
+    # Import tardif : main lit l'environnement et initialise la base à l'import
+    sys.path.insert(0, HERE)
+    import main
+
+    try:
+        report = asyncio.run(run(main, args, sms_secret))
+    finally:
+        main.db.close()
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Rapport écrit dans {args.json}")
+
+
+if __name__ == "__main__":
+    main_cli()
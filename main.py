@@ -1,22 +1,39 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import sqlite3
 import json
 import aiohttp
 import asyncio
+from collections import Counter, OrderedDict, deque
 from datetime import datetime, timedelta, time
+from time import monotonic
 from discord.ext import tasks
 import os
+import hmac
+import hashlib
+import heapq
+import math
 from dotenv import load_dotenv
 import phonenumbers
 from phonenumbers import geocoder
+from database import (
+    db,
+    migrate,
+    check_query_plans,
+    record_sale,
+    rebuild_rollups,
+    net_cost,
+    SMS_COST_RATE,
+)
 
 # --- CONFIGURATION ---
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 API_KEY = os.getenv("SMS_ACTIVATE_API_KEY")
-BASE_URL = "https://api.sms-activate.org/stubs/handler_api.php"
+# Surchargeable pour pointer vers le simulateur local (fake_apis.py)
+BASE_URL = os.getenv(
+    "SMS_ACTIVATE_BASE_URL", "https://api.sms-activate.org/stubs/handler_api.php"
+)
 
 # --- ADMINS ---
 ADMIN_IDS = [
@@ -47,261 +64,1109 @@ COUNTRIES = {"france": "78", "canada": "36", "united_kingdom": "16"}
 HOODPAY_BS_ID = os.getenv("HOODPAY_BUSINESS_ID")
 HOODPAY_API_KEY = os.getenv("HOODPAY_API_KEY")
 HOODPAY_WEBHOOK_SECRET = os.getenv("HOODPAY_WEBHOOK_SECRET")
-WEBHOOK_PORT = 5000  # Port pour écouter les paiements
+HOODPAY_BASE_URL = os.getenv("HOODPAY_BASE_URL", "https://api.hoodpay.io/v1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "5000"))  # Port pour écouter les paiements
+
+# --- SMS PUSH (Webhook SMS-Activate) ---
+# URL à déclarer chez le fournisseur : http://<ip>:5000/sms_webhook?token=<secret>
+# (fournisseurs de SMS_EXTRA_PROVIDERS : ajouter &provider=<nom>)
+SMS_WEBHOOK_SECRET = os.getenv("SMS_WEBHOOK_SECRET")
+SMS_PUSH_ENABLED = bool(SMS_WEBHOOK_SECRET)
+SMS_PUSH_FALLBACK_INTERVAL = 60  # En mode push, le polling n'est plus qu'un filet (s)
+
+# --- RÉSEAU (Session HTTP partagée) ---
+# Une seule session par client API : les connexions TLS restent ouvertes (keep-alive)
+# et sont réutilisées par tous les appels (surtout les getStatus toutes les 5s).
+HTTP_POOL_LIMIT = 100  # Connexions simultanées max (tous hôtes confondus)
+HTTP_POOL_LIMIT_PER_HOST = 50  # Connexions simultanées max vers un même hôte
+HTTP_DNS_CACHE_TTL = 300  # Cache DNS (secondes)
+HTTP_KEEPALIVE_TIMEOUT = 60  # Durée de vie d'une connexion inactive (secondes)
+HTTP_CONNECT_TIMEOUT = 5  # Délai max pour établir la connexion (secondes)
+HTTP_READ_TIMEOUT = 15  # Délai max entre deux lectures sur le socket (secondes)
+HTTP_TOTAL_TIMEOUT = 20  # Deadline par défaut d'un appel complet (secondes)
+HTTP_STATUS_TIMEOUT = 8  # Deadline d'un getStatus (appel le plus fréquent)
+
+# --- LIMITEUR DE DÉBIT (Appels SMS-Activate) ---
+# Seau à jetons partagé par tous les appels, servis par priorité : achats et
+# annulations d'abord, puis statuts, puis prix. Les getPrices sont refusés
+# (le cache sert l'ancienne grille) si la file est trop longue.
+SMS_API_RATE = float(os.getenv("SMS_API_RATE", "20"))  # Appels/seconde soutenus
+SMS_API_BURST = 40  # Rafale max (taille du seau)
+SMS_API_SHED_WAIT = 2.0  # Attente estimée au-delà de laquelle les prix sont refusés (s)
+
+# --- DISJONCTEUR ET REQUÊTES DOUBLÉES (Fournisseur SMS) ---
+# Si le fournisseur échoue en boucle, le circuit s'ouvre : les appels échouent tout
+# de suite (message clair au client) au lieu d'attendre chacun leur timeout.
+SMS_BREAKER_WINDOW = 20  # Derniers appels observés par action
+SMS_BREAKER_MIN_CALLS = 10  # Pas de décision en dessous
+SMS_BREAKER_ERROR_RATE = 0.5  # Taux d'erreur qui ouvre le circuit
+SMS_BREAKER_COOLDOWN = 30  # Durée d'ouverture avant un nouvel essai (secondes)
+SMS_LATENCY_SAMPLES = 200  # Latences gardées par action (calcul du p95)
+# Lectures idempotentes (getStatus, getPrices) : 2e requête si la 1re dépasse le p95
+SMS_HEDGE_ENABLED = os.getenv("SMS_HEDGE_ENABLED", "0") == "1"
+SMS_HEDGE_MIN_SAMPLES = 20  # Latences nécessaires avant de doubler
+SMS_HEDGE_MIN_DELAY = 0.2  # Jamais de 2e requête avant ce délai (secondes)
+
+# --- SUIVI DES SMS (Poller central) ---
+SMS_POLL_TICK = 1  # Intervalle entre deux ticks du poller (secondes)
+SMS_POLL_FALLBACK_CONCURRENCY = 10  # getStatus individuels simultanés max par tick
+SMS_ORDER_TIMEOUT = 25 * 60  # Durée max d'attente d'un code (secondes)
+SMS_VIEW_CHECK_INTERVAL = 5  # Revérification des boutons de la commande (secondes)
+
+# Cadence adaptative : polling dense dans la fenêtre où les codes arrivent
+# d'habitude (apprise depuis l'historique des commandes), plus espacé ensuite.
+SMS_POLL_DENSE_INTERVAL = 3  # Dans la fenêtre habituelle d'arrivée du code
+SMS_POLL_MEDIUM_INTERVAL = 10  # Jusqu'à 3x la fenêtre
+SMS_POLL_SPARSE_INTERVAL = 30  # Au-delà (code très probablement jamais reçu)
+SMS_DENSE_WINDOW_DEFAULT = 180  # Fenêtre par défaut sans historique (secondes)
+SMS_DENSE_WINDOW_MIN = 60
+SMS_DENSE_WINDOW_MAX = 600
+SMS_LATENCY_MIN_SAMPLES = 20  # Échantillons min pour une fenêtre service/pays
+SMS_LATENCY_RELOAD = 3600  # Recalcul des fenêtres depuis la DB (secondes)
+
+# --- CACHE DES PRIX (getPrices) ---
+# Un seul appel getPrices par pays rafraîchit les prix de tous les services.
+PRICE_CACHE_TTL = 60  # Au-delà (secondes), le prix est rafraîchi en tâche de fond
+PRICE_CACHE_MAX_STALE = 600  # Au-delà (secondes), le prix n'est plus servi du tout
+
+# --- ACHAT DE NUMÉRO (Acquisition) ---
+# 1 = séquentiel (un numéro à la fois). N > 1 = spéculatif : N numéros demandés en
+# parallèle, le premier qui n'est pas un doublon est gardé, les autres annulés.
+# Plus rapide quand les doublons sont fréquents, mais des activations sont gaspillées.
+SMS_BUY_MAX_ATTEMPTS = 5  # Tentatives (ou vagues en mode spéculatif) max
+SMS_BUY_PARALLELISM = int(os.getenv("SMS_BUY_PARALLELISM", "1"))
+# Réglage par (service, pays), ex : {("whatsapp", "france"): 3}
+SMS_BUY_PARALLELISM_OVERRIDES = {}
+
+# --- FOURNISSEURS SMS (Routage) ---
+# SMS-Activate est le fournisseur par défaut. Fournisseurs supplémentaires au même
+# protocole handler_api (mêmes codes service/pays), séparés par des ";" :
+# SMS_EXTRA_PROVIDERS="nom|https://hote/stubs/handler_api.php|CLE_API;nom2|..."
+SMS_EXTRA_PROVIDERS = os.getenv("SMS_EXTRA_PROVIDERS", "")
+SMS_ROUTER_HISTORY_DAYS = 7  # Historique de commandes pris en compte
+SMS_ROUTER_RELOAD = 600  # Recalcul des statistiques par fournisseur (secondes)
+SMS_ROUTER_PRIOR_SUCCESS = 0.8  # Taux de succès supposé sans historique
+SMS_ROUTER_PRIOR_WEIGHT = 5  # Poids (en commandes) de cet a priori
+SMS_ROUTER_DELAY_REF = 300  # Un code reçu en moyenne en 300 s double le coût effectif
+
+# --- ANNULATIONS (File persistante) ---
+SMS_CANCEL_MIN_AGE = (
+    120  # Le fournisseur refuse d'annuler avant 2 min (EARLY_CANCEL_DENIED)
+)
+SMS_CANCEL_RETRY_BASE = (
+    5  # Premier délai de nouvelle tentative, doublé à chaque échec (s)
+)
+SMS_CANCEL_RETRY_MAX = 120
+SMS_CANCEL_GIVE_UP_AGE = (
+    30 * 60
+)  # Activation expirée chez le fournisseur : on abandonne
+SMS_CANCEL_BATCH = 20  # Annulations traitées en parallèle par passage
+SMS_CANCEL_IDLE = 60  # Revérification de la file quand elle est vide (s)
 
+# --- STOCK TELEGRAM ---
+ACCOUNT_RESERVATION_TTL = 120  # Compte bloqué pendant la confirmation (secondes)
 
-# --- GESTION BASE DE DONNÉES (SQLite) ---
-def init_db():
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-    # Table Utilisateurs
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS users
-                 (discord_id INTEGER PRIMARY KEY, balance REAL DEFAULT 0.0)"""
-    )
-    # Table Commandes
-    # Table Commandes
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS orders
-                 (order_id TEXT PRIMARY KEY, discord_id INTEGER, 
-                  phone TEXT, price REAL, status TEXT, created_at TEXT, service TEXT)"""
-    )
-    # Table Numéros Bloqués
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS blocked_numbers
-                 (phone TEXT PRIMARY KEY, service TEXT, reported_at TEXT)"""
-    )
-
-    # Migration : Ajout colonne service si elle existe pas (pour les anciennes DB)
-    try:
-        c.execute("ALTER TABLE orders ADD COLUMN service TEXT")
-    except sqlite3.OperationalError:
-        pass  # La colonne existe déjà
 
-    # Migration : Ajout colonne cost pour le calcul de bénéfice
-    try:
-        c.execute("ALTER TABLE orders ADD COLUMN cost REAL")
-    except sqlite3.OperationalError:
-        pass  # La colonne existe déjà
+# --- GESTION BASE DE DONNÉES (SQLite) ---
+# Toutes les requêtes passent par le thread SQLite de database.py (helpers awaitables)
+def init_db(conn):
+    # Schéma versionné (voir MIGRATIONS dans database.py)
+    migrate(conn)
 
-    # Table Paramètres (Settings)
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS settings
-                 (key TEXT PRIMARY KEY, value TEXT)"""
-    )
     # Initialisation de la marge par défaut si inexistante
-    c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('margin', '1.20')")
-
-    # Table Admins
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS admins
-                 (discord_id INTEGER PRIMARY KEY, added_at TEXT)"""
-    )
-
-    # Table Dépôts (Historique rechargements)
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS deposits
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, discord_id INTEGER, 
-                  amount REAL, source TEXT, created_at TEXT)"""
+    conn.execute(
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('margin', '1.20')"
     )
 
-    # Migration : On ajoute les admins hardcodés dans la DB pour qu'ils y soient par défaut
+    # On ajoute les admins hardcodés dans la DB pour qu'ils y soient par défaut
     for admin_id in ADMIN_IDS:
-        c.execute(
+        conn.execute(
             "INSERT OR IGNORE INTO admins (discord_id, added_at) VALUES (?, ?)",
             (admin_id, str(datetime.now())),
         )
 
-    # Table Comptes Telegram (Stock)
-    c.execute(
-        """CREATE TABLE IF NOT EXISTS telegram_accounts
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  phone TEXT, 
-                  session_string TEXT, 
-                  password_2fa TEXT, 
-                  origin TEXT DEFAULT 'MANUAL', 
-                  price_cost REAL DEFAULT 0.0,
-                  added_at TEXT,
-                  status TEXT DEFAULT 'AVAILABLE', 
-                  sold_to INTEGER DEFAULT NULL,
-                  sold_at TEXT DEFAULT NULL)"""
+    # Les vues de confirmation ne survivent pas à un redémarrage
+    conn.execute(
+        "UPDATE telegram_accounts SET status='AVAILABLE', reserved_by=NULL, reserved_until=NULL WHERE status='RESERVED'"
     )
 
-    conn.commit()
-    conn.close()
+    # Les requêtes critiques doivent utiliser un index (sinon alerte console)
+    for warning in check_query_plans(conn):
+        print(f"⚠️ Plan SQL sans index : {warning}")
+
+
+# --- DATES (Timestamps numériques) ---
+# Les dates sont stockées en double : texte lisible (created_at...) et epoch
+# indexé (created_ts...). Les filtres par période utilisent toujours l'epoch.
+def to_ts(dt):
+    return int(dt.timestamp())
+
+
+def month_bounds(month_str):
+    """Bornes [début, fin[ d'un mois "YYYY-MM" en jours "YYYY-MM-DD" (sales_daily)."""
+    start = datetime.strptime(month_str, "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
 
 
 # --- GESTION STOCK TELEGRAM ---
-def add_telegram_account_db(
+async def add_telegram_account_db(
     phone, session_string, password_2fa, price_cost, origin="MANUAL"
 ):
-    conn = sqlite3.connect("database.db")
-    conn.execute(
-        "INSERT INTO telegram_accounts (phone, session_string, password_2fa, price_cost, origin, added_at, status) VALUES (?, ?, ?, ?, ?, ?, 'AVAILABLE')",
+    # Un numéro n'est qu'une fois en stock : un doublon est ignoré (retourne False)
+    added = await db.execute(
+        "INSERT OR IGNORE INTO telegram_accounts (phone, session_string, password_2fa, price_cost, origin, added_at, status) VALUES (?, ?, ?, ?, ?, ?, 'AVAILABLE')",
         (phone, session_string, password_2fa, price_cost, origin, str(datetime.now())),
     )
-    conn.commit()
-    conn.close()
-    print(f"✅ Compte Telegram ajouté au stock : {phone}")
+    if added:
+        print(f"✅ Compte Telegram ajouté au stock : {phone}")
+    return bool(added)
+
+
+# Réservation : le bouton d'achat bloque le plus ancien compte disponible
+# (UPDATE ... RETURNING, un seul aller-retour, index (status, id)) pendant la
+# confirmation. Sans réponse, la réservation expire et le compte revient en stock.
+ACCOUNT_COLUMNS = "id, phone, session_string, password_2fa, price_cost"
+
+
+def _account_from_row(row):
+    if row is None:
+        return None
+    return {
+        "id": row[0],
+        "phone": row[1],
+        "session_string": row[2],
+        "password_2fa": row[3],
+        "cost": row[4],
+    }
+
+
+# Comptes mis en vente : jamais vérifiés (stock tout juste ajouté, le
+# StockSweeper les prend en premier) ou vérifiés valides récemment ; jamais un
+# 2FA actif sans mot de passe connu. Le "+" écarte idx_tg_status_checked :
+# l'ordre FIFO reste servi par l'index (status, id)
+SELLABLE_ACCOUNT = (
+    "status='AVAILABLE'"
+    " AND (health_status IS NULL OR (health_status='OK' AND +checked_ts >= ?))"
+    " AND NOT (has_2fa IS 1 AND password_2fa IS NULL)"
+)
+
+
+def _sellable_filter(now_ts):
+    """(clause WHERE, paramètres) des comptes vendables."""
+    if not TG_API_ID or not TG_API_HASH:
+        # Sans config Telethon, aucune vérification possible : tout le stock est vendu
+        return "status='AVAILABLE'", ()
+    return SELLABLE_ACCOUNT, (now_ts - TG_SELL_MAX_CHECK_AGE,)
 
 
-def get_available_telegram_account():
-    conn = sqlite3.connect("database.db")
-    # On prend le premier disponible (FIFO)
+def _release_expired_reservations(conn, now_ts):
+    return conn.execute(
+        "UPDATE telegram_accounts SET status='AVAILABLE', reserved_by=NULL, reserved_until=NULL WHERE status='RESERVED' AND reserved_until < ?",
+        (now_ts,),
+    ).rowcount
+
+
+def _reserve_telegram_account(conn, user_id, ttl):
+    now_ts = to_ts(datetime.now())
+    _release_expired_reservations(conn, now_ts)
+
+    # Un acheteur qui reclique garde (et prolonge) sa réservation
     row = conn.execute(
-        "SELECT id, phone, session_string, password_2fa, price_cost FROM telegram_accounts WHERE status='AVAILABLE' LIMIT 1"
+        f"UPDATE telegram_accounts SET reserved_until=? WHERE status='RESERVED' AND reserved_by=? RETURNING {ACCOUNT_COLUMNS}",
+        (now_ts + ttl, user_id),
     ).fetchone()
-    conn.close()
-
-    if row:
-        return {
-            "id": row[0],
-            "phone": row[1],
-            "session_string": row[2],
-            "password_2fa": row[3],
-            "cost": row[4],
-        }
-    return None
+    if row is None:
+        sellable, params = _sellable_filter(now_ts)
+        row = conn.execute(
+            f"""UPDATE telegram_accounts SET status='RESERVED', reserved_by=?, reserved_until=?
+                WHERE id = (SELECT id FROM telegram_accounts WHERE {sellable} ORDER BY id LIMIT 1)
+                RETURNING {ACCOUNT_COLUMNS}""",
+            (user_id, now_ts + ttl) + params,
+        ).fetchone()
+    return _account_from_row(row)
+
+
+async def reserve_telegram_account(user_id, ttl=ACCOUNT_RESERVATION_TTL):
+    """Réserve le prochain compte (FIFO) pour user_id. None si rupture de stock."""
+    return await db.run(_reserve_telegram_account, user_id, ttl)
+
+
+async def release_telegram_account(account_id, user_id):
+    await db.execute(
+        "UPDATE telegram_accounts SET status='AVAILABLE', reserved_by=NULL, reserved_until=NULL WHERE id=? AND status='RESERVED' AND reserved_by=?",
+        (account_id, user_id),
+    )
 
 
-def mark_telegram_account_sold(account_id, user_id):
-    conn = sqlite3.connect("database.db")
-    conn.execute(
-        "UPDATE telegram_accounts SET status='SOLD', sold_to=?, sold_at=? WHERE id=?",
-        (user_id, str(datetime.now()), account_id),
+def _sell_telegram_account(conn, account_id, user_id):
+    """
+    Passe en SOLD le compte réservé par user_id (ou encore disponible) ;
+    à défaut, le prochain compte disponible. Retourne le compte ou None.
+    """
+    now = datetime.now()
+    sold = "status='SOLD', sold_to=?, sold_at=?, sold_ts=?, reserved_by=NULL, reserved_until=NULL"
+    params = (user_id, str(now), to_ts(now))
+    row = conn.execute(
+        f"""UPDATE telegram_accounts SET {sold}
+            WHERE id=? AND (status='AVAILABLE' OR (status='RESERVED' AND reserved_by=?))
+            RETURNING {ACCOUNT_COLUMNS}""",
+        params + (account_id, user_id),
+    ).fetchone()
+    if row is None:
+        # Réservation expirée et compte reparti : on prend le suivant
+        sellable, sellable_params = _sellable_filter(to_ts(now))
+        row = conn.execute(
+            f"""UPDATE telegram_accounts SET {sold}
+                WHERE id = (SELECT id FROM telegram_accounts WHERE {sellable} ORDER BY id LIMIT 1)
+                RETURNING {ACCOUNT_COLUMNS}""",
+            params + sellable_params,
+        ).fetchone()
+    return _account_from_row(row)
+
+
+async def save_repaired_session(account_id, session_string):
+    await db.execute(
+        "UPDATE telegram_accounts SET session_string=?, health_status='OK', checked_ts=? WHERE id=?",
+        (session_string, to_ts(datetime.now()), account_id),
+    )
+
+
+async def save_account_check(account_id, status, info=None):
+    """Résultat d'une vérification (StockSweeper, /check_account)."""
+    info = info or {}
+    await db.execute(
+        """UPDATE telegram_accounts SET health_status=?, has_2fa=COALESCE(?, has_2fa),
+               username=COALESCE(?, username), checked_ts=?
+           WHERE id=?""",
+        (
+            status,
+            info.get("has_2fa"),
+            info.get("username"),
+            to_ts(datetime.now()),
+            account_id,
+        ),
     )
-    conn.commit()
-    conn.close()
 
 
-def count_telegram_stock():
-    conn = sqlite3.connect("database.db")
-    count = conn.execute(
-        "SELECT COUNT(*) FROM telegram_accounts WHERE status='AVAILABLE'"
-    ).fetchone()[0]
-    conn.close()
-    return count
+async def count_telegram_stock():
+    """Comptes vendables (voir SELLABLE_ACCOUNT)."""
+    sellable, params = _sellable_filter(to_ts(datetime.now()))
+    return await db.fetchval(
+        f"SELECT COUNT(*) FROM telegram_accounts WHERE {sellable}", params
+    )
 
 
-def get_margin():
-    conn = sqlite3.connect("database.db")
-    res = conn.execute("SELECT value FROM settings WHERE key='margin'").fetchone()
-    conn.close()
-    return float(res[0]) if res else 1.20
+async def get_margin():
+    res = await db.fetchval("SELECT value FROM settings WHERE key='margin'")
+    return float(res) if res else 1.20
 
 
-def update_margin_db(new_margin):
-    conn = sqlite3.connect("database.db")
-    conn.execute("UPDATE settings SET value=? WHERE key='margin'", (str(new_margin),))
-    conn.commit()
-    conn.close()
+async def update_margin_db(new_margin):
+    await db.execute(
+        "UPDATE settings SET value=? WHERE key='margin'", (str(new_margin),)
+    )
 
 
-def calculate_selling_price(api_price):
+async def calculate_selling_price(api_price):
     if api_price is None:
         return None
 
-    margin = get_margin()
+    margin = await get_margin()
     # Formule : ((API * 1.3) * margin) * 0.9
     return round(((api_price * 1.3) * margin) * 0.9, 2)
 
 
-def get_balance(user_id):
-    conn = sqlite3.connect("database.db")
-    res = conn.execute(
+async def get_balance(user_id):
+    return await db.fetchval(
+        "SELECT balance FROM users WHERE discord_id=?", (user_id,), default=0.0
+    )
+
+
+def _get_balance(conn, user_id):
+    row = conn.execute(
         "SELECT balance FROM users WHERE discord_id=?", (user_id,)
     ).fetchone()
-    conn.close()
-    return res[0] if res else 0.0
+    return row[0] if row else 0.0
 
 
-def update_balance(user_id, amount):
-    conn = sqlite3.connect("database.db")
+def _debit_balance(conn, user_id, amount):
+    """Débit conditionnel (balance >= amount). False si solde insuffisant."""
+    cursor = conn.execute(
+        "UPDATE users SET balance = balance - ? WHERE discord_id=? AND balance >= ?",
+        (amount, user_id, amount),
+    )
+    return cursor.rowcount == 1
+
+
+def _update_balance(conn, user_id, amount):
     conn.execute(
         "INSERT OR IGNORE INTO users (discord_id, balance) VALUES (?, 0)", (user_id,)
     )
     conn.execute(
         "UPDATE users SET balance = balance + ? WHERE discord_id=?", (amount, user_id)
     )
-    conn.commit()
-    conn.close()
 
 
-def add_deposit_log(user_id, amount, source):
-    conn = sqlite3.connect("database.db")
-    conn.execute(
-        "INSERT INTO deposits (discord_id, amount, source, created_at) VALUES (?, ?, ?, ?)",
-        (user_id, amount, source, str(datetime.now())),
+async def update_balance(user_id, amount):
+    await db.run(_update_balance, user_id, amount)
+
+
+async def add_deposit_log(user_id, amount, source):
+    now = datetime.now()
+    await db.execute(
+        "INSERT INTO deposits (discord_id, amount, source, created_at, created_ts) VALUES (?, ?, ?, ?, ?)",
+        (user_id, amount, source, str(now), to_ts(now)),
     )
-    conn.commit()
-    conn.close()
 
 
-def is_number_used(phone, service):
-    conn = sqlite3.connect("database.db")
+def _is_number_used(conn, phone, service):
     # On regarde si ce numéro a déjà une commande complétée ou en attente pour ce service
     res = conn.execute(
         "SELECT 1 FROM orders WHERE phone=? AND service=?", (phone, service)
     ).fetchone()
-
     if res:
-        conn.close()
         return True
 
     # Vérification dans la table des numéros bloqués
     res_blocked = conn.execute(
         "SELECT 1 FROM blocked_numbers WHERE phone=?", (phone,)
     ).fetchone()
-    conn.close()
     return res_blocked is not None
 
 
-def block_number_db(phone, service):
-    conn = sqlite3.connect("database.db")
-    conn.execute(
+# --- DOUBLONS DE NUMÉROS (Filtre de Bloom) ---
+# Un numéro jamais vu (le cas courant) est écarté sans aller en base. Un
+# "peut-être" (vrai doublon ou faux positif, ~1%) est confirmé par les
+# requêtes indexées de _is_number_used.
+USED_NUMBERS_MIN_CAPACITY = 100_000
+USED_NUMBERS_ERROR_RATE = 0.01
+
+
+def normalize_phone(phone):
+    return "".join(c for c in str(phone) if c.isdigit())
+
+
+class UsedNumberFilter:
+    def __init__(self, error_rate=USED_NUMBERS_ERROR_RATE):
+        self.error_rate = error_rate
+        self.capacity = 0
+        self.count = 0
+        # (taille en bits, nombre de hash, bits) remplacé d'un bloc au rechargement
+        self.state = (8, 1, bytearray(1))
+        self.reloading = False
+        self.pending = None  # Clés ajoutées pendant un redimensionnement
+        self.checks = 0
+        self.skipped = 0  # Vérifications répondues sans la base
+
+    @staticmethod
+    def order_key(phone, service):
+        return f"{normalize_phone(phone)}|{service}"
+
+    @staticmethod
+    def blocked_key(phone):
+        return f"{normalize_phone(phone)}|*"
+
+    @staticmethod
+    def _positions(state, key):
+        size, hashes, _ = state
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % size for i in range(hashes)]
+
+    def _set(self, state, key):
+        bits = state[2]
+        for pos in self._positions(state, key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def _contains(self, key):
+        state = self.state
+        bits = state[2]
+        return all(
+            bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(state, key)
+        )
+
+    def _build(self, conn):
+        total = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM orders) + (SELECT COUNT(*) FROM blocked_numbers)"
+        ).fetchone()[0]
+        capacity = max(USED_NUMBERS_MIN_CAPACITY, total * 2)
+        size = max(8, int(-capacity * math.log(self.error_rate) / math.log(2) ** 2))
+        hashes = max(1, round(size / capacity * math.log(2)))
+        state = (size, hashes, bytearray((size + 7) // 8))
+
+        for phone, service in conn.execute("SELECT phone, service FROM orders"):
+            self._set(state, self.order_key(phone, service))
+        for (phone,) in conn.execute("SELECT phone FROM blocked_numbers"):
+            self._set(state, self.blocked_key(phone))
+        return state, capacity, total
+
+    def load(self, conn):
+        """Construit le filtre depuis la base (sur le thread SQLite, au démarrage)."""
+        self.state, self.capacity, self.count = self._build(conn)
+        return self.count
+
+    async def reload(self):
+        """
+        Redimensionnement en tâche de fond. Le nouveau filtre est lu sur le
+        thread SQLite puis remplacé sur la boucle, après y avoir reporté les
+        clés ajoutées entre-temps (un "non" du filtre doit rester sûr).
+        """
+        try:
+            state, capacity, total = await db.run(self._build)
+            for key in self.pending:
+                self._set(state, key)
+            self.state = state
+            self.capacity = capacity
+            self.count = total + len(self.pending)
+        except Exception as e:
+            print(f"Erreur redimensionnement du filtre des numéros: {e}")
+        finally:
+            self.pending = None
+            self.reloading = False
+
+    def _add(self, key):
+        self._set(self.state, key)
+        self.count += 1
+        # Filtre saturé : le taux de faux positifs monte, on le redimensionne
+        if self.count > self.capacity and not self.reloading:
+            self.reloading = True
+            self.pending = []
+            asyncio.get_running_loop().create_task(self.reload())
+        if self.pending is not None:
+            self.pending.append(key)
+
+    def add_order(self, phone, service):
+        self._add(self.order_key(phone, service))
+
+    def add_blocked(self, phone):
+        self._add(self.blocked_key(phone))
+
+    def might_be_used(self, phone, service):
+        self.checks += 1
+        if self._contains(self.order_key(phone, service)) or self._contains(
+            self.blocked_key(phone)
+        ):
+            return True
+        self.skipped += 1
+        return False
+
+
+used_numbers = UsedNumberFilter()
+
+
+async def is_number_used(phone, service):
+    # Jamais vu : pas d'aller-retour en base
+    if not used_numbers.might_be_used(phone, service):
+        return False
+    return await db.run(_is_number_used, phone, service)
+
+
+async def block_number_db(phone, service):
+    await db.execute(
         "INSERT OR IGNORE INTO blocked_numbers (phone, service, reported_at) VALUES (?, ?, ?)",
         (phone, service, str(datetime.now())),
     )
-    conn.commit()
-    conn.close()
+    used_numbers.add_blocked(phone)
+
+
+async def get_order_meta(order_id):
+    """Service, pays, date de création et fournisseur d'une commande (suivi du SMS)."""
+    row = await db.fetchone(
+        "SELECT service, country, created_ts, provider FROM orders WHERE order_id=?",
+        (order_id,),
+    )
+    return row if row else (None, None, None, None)
+
+
+def _provider_history(conn, since_ts):
+    # Agrégation en Python sur un parcours de l'index (created_ts, ...) : pas de
+    # tri temporaire pour le GROUP BY
+    history = {}
+    for provider, service, country, status, code_delay in conn.execute(
+        """SELECT provider, service, country, status, code_delay FROM orders
+           WHERE created_ts >= ? AND country IS NOT NULL""",
+        (since_ts,),
+    ):
+        stats = history.setdefault((provider, service, country), [0, 0, 0.0, 0])
+        if status == "COMPLETED":
+            stats[0] += 1
+        if status in ("COMPLETED", "REFUNDED"):
+            stats[1] += 1
+        if code_delay is not None:
+            stats[2] += code_delay
+            stats[3] += 1
+    return [
+        key + (ok, done, delay_sum / delays if delays else None)
+        for key, (ok, done, delay_sum, delays) in history.items()
+    ]
+
+
+async def get_provider_history(since_ts):
+    """(fournisseur, service, pays, terminées OK, terminées, délai moyen du code)."""
+    return await db.run(_provider_history, since_ts)
+
+
+async def save_code_delay(order_id, delay):
+    await db.execute(
+        "UPDATE orders SET code_delay=? WHERE order_id=? AND code_delay IS NULL",
+        (delay, order_id),
+    )
+
+
+async def get_code_delays(limit=20000):
+    return await db.fetchall(
+        "SELECT service, country, code_delay FROM orders WHERE code_delay IS NOT NULL ORDER BY rowid DESC LIMIT ?",
+        (limit,),
+    )
+
+
+def _set_order_status(conn, order_id, status):
+    row = conn.execute(
+        "SELECT status, created_ts, service, price, cost FROM orders WHERE order_id=?",
+        (order_id,),
+    ).fetchone()
+    if row is None:
+        return
+    old_status, created_ts, service, price, cost = row
+    conn.execute("UPDATE orders SET status=? WHERE order_id=?", (status, order_id))
+
+    # Les agrégats de ventes ne comptent que les commandes COMPLETED
+    was_completed = old_status == "COMPLETED"
+    if created_ts is not None and was_completed != (status == "COMPLETED"):
+        record_sale(conn, created_ts, service, price, cost, -1 if was_completed else 1)
+
+
+async def set_order_status(order_id, status):
+    await db.run(_set_order_status, order_id, status)
+
+
+def _refund_order(conn, user_id, amount, order_id):
+    _update_balance(conn, user_id, amount)
+    _set_order_status(conn, order_id, "REFUNDED")
+
+
+async def refund_order(user_id, amount, order_id):
+    # Remboursement et statut dans la même transaction
+    await db.run(_refund_order, user_id, amount, order_id)
+
+
+def _add_account_order(conn, order_id, user_id, phone, price, cost):
+    now = datetime.now()
+    conn.execute(
+        "INSERT INTO orders (order_id, discord_id, phone, price, status, created_at, created_ts, service, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            order_id,
+            user_id,
+            phone,
+            price,
+            "COMPLETED",
+            str(now),
+            to_ts(now),
+            "Telegram Account",
+            cost,
+        ),
+    )
+    record_sale(conn, to_ts(now), "Telegram Account", price, cost)
+
+
+# --- ACHATS (Transaction unique) ---
+# Débit conditionnel + enregistrement (+ réservation du stock pour un compte)
+# en un seul commit : deux clics simultanés ne peuvent pas passer tous les deux.
+PURCHASE_OK = "OK"
+PURCHASE_NO_FUNDS = "INSUFFICIENT_FUNDS"
+PURCHASE_SOLD_OUT = "SOLD_OUT"
+
+
+def _purchase_sms_order(
+    conn, user_id, order_id, phone, price, service_name, cost, country_id, provider
+):
+    if not _debit_balance(conn, user_id, price):
+        return PURCHASE_NO_FUNDS, _get_balance(conn, user_id)
+
+    now = datetime.now()
+    conn.execute(
+        "INSERT INTO orders (order_id, discord_id, phone, price, status, created_at, created_ts, service, cost, country, provider) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            order_id,
+            user_id,
+            phone,
+            price,
+            "PENDING",
+            str(now),
+            to_ts(now),
+            service_name,
+            cost,
+            country_id,
+            provider,
+        ),
+    )
+    return PURCHASE_OK, _get_balance(conn, user_id)
+
+
+async def purchase_sms_order(
+    user_id, order_id, phone, price, service_name, cost, country_id, provider
+):
+    """Retourne (statut, solde) avec statut PURCHASE_OK ou PURCHASE_NO_FUNDS."""
+    result = await db.run(
+        _purchase_sms_order,
+        user_id,
+        order_id,
+        phone,
+        price,
+        service_name,
+        cost,
+        country_id,
+        provider,
+    )
+    if result[0] == PURCHASE_OK:
+        used_numbers.add_order(phone, service_name)
+    return result
+
+
+def _purchase_account(conn, user_id, price, account_id):
+    if not _debit_balance(conn, user_id, price):
+        return PURCHASE_NO_FUNDS, _get_balance(conn, user_id), None
+
+    account = _sell_telegram_account(conn, account_id, user_id)
+    if account is None:
+        # Plus rien en stock : on annule le débit
+        conn.rollback()
+        return PURCHASE_SOLD_OUT, None, None
+
+    _add_account_order(
+        conn,
+        f"ACC-{account['id']}",
+        user_id,
+        account["phone"],
+        price,
+        account["cost"],
+    )
+    return PURCHASE_OK, _get_balance(conn, user_id), account
+
 
+async def purchase_account(user_id, price, account_id):
+    """Retourne (statut, solde, compte) ; compte est None si l'achat échoue."""
+    result = await db.run(_purchase_account, user_id, price, account_id)
+    if result[0] == PURCHASE_OK:
+        used_numbers.add_order(result[2]["phone"], "Telegram Account")
+    return result
 
-def is_user_admin(user_id):
+
+async def is_user_admin(user_id):
     # On vérifie dans la liste hardcodée (backup) OU dans la DB
     if user_id in ADMIN_IDS:
         return True
 
-    conn = sqlite3.connect("database.db")
-    res = conn.execute("SELECT 1 FROM admins WHERE discord_id=?", (user_id,)).fetchone()
-    conn.close()
+    res = await db.fetchone("SELECT 1 FROM admins WHERE discord_id=?", (user_id,))
     return res is not None
 
 
-def add_new_admin_db(user_id):
-    conn = sqlite3.connect("database.db")
-    conn.execute(
+async def add_new_admin_db(user_id):
+    await db.execute(
         "INSERT OR IGNORE INTO admins (discord_id, added_at) VALUES (?, ?)",
         (user_id, str(datetime.now())),
     )
-    conn.commit()
-    conn.close()
 
 
-def remove_admin_db(user_id):
-    conn = sqlite3.connect("database.db")
-    conn.execute("DELETE FROM admins WHERE discord_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+async def remove_admin_db(user_id):
+    await db.execute("DELETE FROM admins WHERE discord_id=?", (user_id,))
+
+
+# --- SESSION HTTP ---
+def create_http_session(**kwargs):
+    """
+    Crée une session aiohttp avec un pool de connexions réglé (keep-alive, cache DNS)
+    et des timeouts explicites. À appeler depuis la boucle asyncio.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TOTAL_TIMEOUT,
+        connect=HTTP_CONNECT_TIMEOUT,
+        sock_read=HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, **kwargs)
+
+
+# --- LIMITEUR DE DÉBIT (Seau à jetons + priorités) ---
+PRIORITY_ORDER = 0  # getNumber, setStatus (le client attend)
+PRIORITY_STATUS = 1  # getStatus, getActiveActivations
+PRIORITY_PRICES = 2  # getPrices (servi depuis le cache si refusé)
+PRIORITY_NAMES = {
+    PRIORITY_ORDER: "achats/annulations",
+    PRIORITY_STATUS: "statuts",
+    PRIORITY_PRICES: "prix",
+}
+ACTION_PRIORITIES = {
+    "getNumber": PRIORITY_ORDER,
+    "setStatus": PRIORITY_ORDER,
+    "getStatus": PRIORITY_STATUS,
+    "getActiveActivations": PRIORITY_STATUS,
+    "getPrices": PRIORITY_PRICES,
+}
+
+
+class RateLimiter:
+    """
+    Seau à jetons (rate/s, rafale burst). Quand il est vide, les appels attendent
+    dans une file triée par priorité puis par ordre d'arrivée. La classe la plus
+    basse est refusée tout de suite si l'attente estimée dépasse shed_wait.
+    """
+
+    def __init__(
+        self, rate=SMS_API_RATE, burst=SMS_API_BURST, shed_wait=SMS_API_SHED_WAIT
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.shed_wait = shed_wait
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.waiters = []  # heap (priorité, n° d'arrivée, future)
+        self.counter = 0
+        self.timer = None
+        # Statistiques par priorité : [appels, refusés, attente totale, attente max]
+        self.stats = {priority: [0, 0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _dispatch(self):
+        self.timer = None
+        self._refill()
+        while self.waiters and self.tokens >= 1:
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():  # Appelant annulé entre-temps
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        if self.waiters and self.timer is None:
+            delay = (1 - self.tokens) / self.rate
+            self.timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def queued(self, priority=None):
+        return sum(
+            1
+            for waiter in self.waiters
+            if not waiter[2].done() and (priority is None or waiter[0] == priority)
+        )
+
+    async def acquire(self, priority):
+        """Attend un jeton. Retourne False si l'appel est refusé (délestage)."""
+        entry = self.stats[priority]
+        self._refill()
+        if not self.waiters and self.tokens >= 1:
+            self.tokens -= 1
+            entry[0] += 1
+            return True
+
+        if (
+            priority == PRIORITY_PRICES
+            and len(self.waiters) / self.rate > self.shed_wait
+        ):
+            entry[1] += 1
+            return False
+
+        started = monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.counter += 1
+        heapq.heappush(self.waiters, (priority, self.counter, future))
+        if self.timer is None:
+            self._dispatch()
+        await future
+
+        waited = monotonic() - started
+        entry[0] += 1
+        entry[2] += waited
+        entry[3] = max(entry[3], waited)
+        return True
+
+    def report(self):
+        """(classe, appels, refusés, attente moyenne ms, attente max ms, en file)."""
+        return [
+            (
+                PRIORITY_NAMES[priority],
+                calls,
+                shed,
+                total / calls * 1000 if calls else 0.0,
+                worst * 1000,
+                self.queued(priority),
+            )
+            for priority, (calls, shed, total, worst) in self.stats.items()
+        ]
+
+
+# --- DISJONCTEUR (Santé par action) ---
+PROVIDER_DOWN = "CIRCUIT_OPEN"
+PROVIDER_ERRORS = ("NETWORK_ERROR", "HTTP_ERROR", PROVIDER_DOWN)
+HEDGED_ACTIONS = ("getStatus", "getPrices")
+
+
+def is_provider_error(text):
+    return text.startswith(PROVIDER_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Taux d'erreur et latences récentes d'une action. Fermé : tout passe. Ouvert :
+    échec immédiat pendant cooldown. Ensuite le prochain appel sert de test
+    (succès -> fermé, échec -> rouvert) ; les autres sont refusés tant qu'il est
+    en cours (un test sans réponse au bout de cooldown est abandonné).
+    """
+
+    def __init__(self, name, cooldown=SMS_BREAKER_COOLDOWN):
+        self.name = name
+        self.cooldown = cooldown
+        self.results = deque(maxlen=SMS_BREAKER_WINDOW)  # True = succès
+        self.latencies = deque(maxlen=SMS_LATENCY_SAMPLES)
+        self.opened_at = None
+        self.probe_started = None  # Appel de test en cours
+        # Statistiques (commande /monitor)
+        self.calls = 0
+        self.rejected = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "fermé"
+        if monotonic() - self.opened_at < self.cooldown:
+            return "ouvert"
+        return "test"
+
+    def allow(self):
+        state = self.state
+        if state == "fermé":
+            return True
+        if state == "test" and (
+            self.probe_started is None
+            or monotonic() - self.probe_started >= self.cooldown
+        ):
+            self.probe_started = monotonic()
+            return True
+        self.rejected += 1
+        return False
+
+    def record(self, ok, latency):
+        self.calls += 1
+        self.results.append(ok)
+        if ok:
+            self.latencies.append(latency)
+        if self.opened_at is not None:
+            # Appel de test après cooldown
+            self.probe_started = None
+            if ok:
+                self.opened_at = None
+                self.results.clear()
+            else:
+                self.opened_at = monotonic()
+            return
+        if (
+            len(self.results) >= SMS_BREAKER_MIN_CALLS
+            and self.error_rate() >= SMS_BREAKER_ERROR_RATE
+        ):
+            self.opened_at = monotonic()
+            print(
+                f"🔌 Circuit {self.name} ouvert (taux d'erreur {self.error_rate():.0%})"
+            )
+
+    def error_rate(self):
+        if not self.results:
+            return 0.0
+        return self.results.count(False) / len(self.results)
+
+    def p95(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_delay(self):
+        """Délai avant la 2e requête (p95), None si pas assez d'historique."""
+        if len(self.latencies) < SMS_HEDGE_MIN_SAMPLES:
+            return None
+        return max(SMS_HEDGE_MIN_DELAY, self.p95())
+
+
+# --- INTERFACE FOURNISSEUR SMS ---
+class SMSProvider:
+    """
+    Ce que le bot attend d'un fournisseur de numéros. Les statuts renvoyés
+    suivent le format texte de getStatus (STATUS_OK:code, STATUS_WAIT_CODE,
+    STATUS_CANCEL...) : poller et check_sms_loop sont communs à tous.
+    """
+
+    name = None
+    key_prefix = ""  # Voir order_key
+
+    def order_key(self, activation_id):
+        """
+        Clé d'une activation côté bot (orders, cancel_queue, poller, webhook) :
+        les ids de deux fournisseurs peuvent coïncider, ils sont préfixés par le
+        nom du fournisseur. Le fournisseur par défaut garde les ids nus
+        (commandes existantes, provider NULL).
+        """
+        return f"{self.key_prefix}{activation_id}"
+
+    def activation_id(self, order_key):
+        """Id à envoyer au fournisseur pour une clé renvoyée par order_key."""
+        order_key = str(order_key)
+        if self.key_prefix and order_key.startswith(self.key_prefix):
+            return order_key[len(self.key_prefix) :]
+        return order_key
+
+    async def buy_number(self, service, country, user_info=None):
+        """
+        {"success": True, "id", "phone"} ou {"success": False, "error", "code"?}.
+        "id" est la clé order_key ; toutes les méthodes ci-dessous la reçoivent.
+        """
+        raise NotImplementedError
+
+    async def get_status(self, activation_id):
+        raise NotImplementedError
+
+    async def get_active_statuses(self):
+        """{activation_id: statut} en un appel, ou None (le poller fait des get_status)."""
+        return None
 
+    async def cancel_order(self, activation_id, user_info=None):
+        raise NotImplementedError
+
+    async def complete_order(self, activation_id):
+        raise NotImplementedError
+
+    async def retry_code(self, activation_id):
+        """Demande un autre SMS sur la même activation."""
+        raise NotImplementedError
+
+    async def get_prices(self, country):
+        """{code_service: (cost, count)} ou None."""
+        raise NotImplementedError
+
+    def unavailable(self, *actions):
+        return False
+
+    async def close(self):
+        pass
+
+
+# --- CLIENT API SMS-ACTIVATE (handler_api) ---
+class SMSClient(SMSProvider):
+    def __init__(self, name="smsactivate", base_url=BASE_URL, api_key=API_KEY):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        # Session créée à la demande (il faut une boucle asyncio active)
+        self.session = None
+        self.limiter = RateLimiter()
+        self.breakers = {}  # action -> CircuitBreaker
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = create_http_session()
+        return self.session
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def breaker(self, action):
+        if action not in self.breakers:
+            self.breakers[action] = CircuitBreaker(action)
+        return self.breakers[action]
+
+    def unavailable(self, *actions):
+        """True si le circuit d'une de ces actions est ouvert (fournisseur en panne)."""
+        return any(
+            action in self.breakers and self.breakers[action].state == "ouvert"
+            for action in actions
+        )
 
-# --- CLIENT API SMS-ACTIVATE ---
-class SMSClient:
-    async def request(self, action, params={}):
-        params["api_key"] = API_KEY
+    async def request(self, action, params=None, timeout=None, priority=None):
+        breaker = self.breaker(action)
+        if not breaker.allow():
+            return PROVIDER_DOWN
+
+        if SMS_HEDGE_ENABLED and action in HEDGED_ACTIONS:
+            delay = breaker.hedge_delay()
+            if delay is not None:
+                return await self._hedged(delay, action, params, timeout, priority)
+        return await self._call(action, params, timeout, priority)
+
+    async def _hedged(self, delay, action, params, timeout, priority):
+        # 1re requête ; si elle dépasse le p95, une 2e part en parallèle et la
+        # première réponse valide l'emporte (l'autre est annulée)
+        breaker = self.breaker(action)
+        first = asyncio.create_task(self._call(action, params, timeout, priority))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        breaker.hedges += 1
+        second = asyncio.create_task(self._call(action, params, timeout, priority))
+        pending = {first, second}
+        result = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    result = task.result()
+                    if not is_provider_error(result):
+                        if task is second:
+                            breaker.hedge_wins += 1
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, action, params=None, timeout=None, priority=None):
+        if priority is None:
+            priority = ACTION_PRIORITIES.get(action, PRIORITY_STATUS)
+        if not await self.limiter.acquire(priority):
+            # Délesté : réponse en erreur comme NETWORK_ERROR (cache de prix conservé)
+            return "RATE_LIMITED"
+
+        # Copie pour ne jamais modifier le dict de l'appelant
+        params = dict(params) if params else {}
+        params["api_key"] = self.api_key
         params["action"] = action
-        async with aiohttp.ClientSession() as session:
-            async with session.get(BASE_URL, params=params) as resp:
-                return await resp.text()
+
+        # Deadline spécifique à l'appel (sinon celle de la session)
+        kwargs = {}
+        if timeout:
+            kwargs["timeout"] = aiohttp.ClientTimeout(
+                total=timeout, connect=min(timeout, HTTP_CONNECT_TIMEOUT)
+            )
+
+        session = await self.get_session()
+        breaker = self.breaker(action)
+        started = monotonic()
+        try:
+            async with session.get(self.base_url, params=params, **kwargs) as resp:
+                if resp.status >= 500:
+                    breaker.record(False, monotonic() - started)
+                    return f"HTTP_ERROR:{resp.status}"
+                text = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # On renvoie un statut texte comme l'API pour que les appelants
+            # le traitent comme une réponse en erreur (pas de crash des boucles)
+            breaker.record(False, monotonic() - started)
+            print(f"Erreur réseau {self.name} ({action}): {e!r}")
+            return f"NETWORK_ERROR:{type(e).__name__}"
+        breaker.record(True, monotonic() - started)
+        return text
 
     async def buy_number(self, service, country, user_info=None):
         # Réponse attendue : ACCESS_NUMBER:$ID:$NUMBER
@@ -315,7 +1180,7 @@ class SMSClient:
         )
         if "ACCESS_NUMBER" in text:
             parts = text.split(":")
-            return {"success": True, "id": parts[1], "phone": parts[2]}
+            return {"success": True, "id": self.order_key(parts[1]), "phone": parts[2]}
         elif "NO_NUMBERS" in text:
             return {
                 "success": False,
@@ -327,6 +1192,12 @@ class SMSClient:
                 "success": False,
                 "error": "Erreur interne (Fonds insuffisants chez le bot).",
             }
+        elif text == PROVIDER_DOWN:
+            return {
+                "success": False,
+                "error": "Fournisseur SMS indisponible pour le moment, réessayez dans quelques minutes.",
+                "code": "PROVIDER_DOWN",
+            }
         else:
             return {"success": False, "error": text}
 
@@ -336,22 +1207,9 @@ class SMSClient:
             response = await self.request(
                 "getPrices", {"service": service, "country": country, "freePrice": 1}
             )
-
-            # DEBUG TEMPORAIRE POUR VOIR L'ERREUR
-            print(f"DEBUG RAW RESPONSE ({service}/{country}): {response}")
-
-            # Pas de print global pour éviter le spam, on affiche juste le résultat trouvé
-            data = json.loads(response)
-
-            country_str = str(country)
-
-            if country_str in data and service in data[country_str]:
-                cost = float(data[country_str][service]["cost"])
-                count = int(data[country_str][service]["count"])
-                if count > 0:
-                    return cost
-                else:
-                    return None
+            cost, count = parse_prices(response, country).get(service, (None, 0))
+            if count > 0:
+                return cost
 
             print(f"DEBUG: Pas de prix trouvé pour {service} en pays {country}")
             return None
@@ -359,15 +1217,73 @@ class SMSClient:
             print(f"Erreur get_price: {e}")
             return None
 
+    async def get_prices(self, country):
+        """
+        Récupère la grille complète d'un pays en un seul appel getPrices.
+        Retourne {code_service: (cost, count)} ou None en cas d'erreur.
+        """
+        try:
+            response = await self.request(
+                "getPrices", {"country": country, "freePrice": 1}
+            )
+            return parse_prices(response, country)
+        except Exception as e:
+            print(f"Erreur get_prices ({country}): {e}")
+            return None
+
+    async def get_active_statuses(self):
+        """
+        Statuts de toutes les activations en cours en un seul appel.
+        Retourne {activation_id: texte au format getStatus} ou None si indisponible.
+        """
+        response = await self.request(
+            "getActiveActivations", timeout=HTTP_STATUS_TIMEOUT
+        )
+        try:
+            data = json.loads(response)
+        except ValueError:
+            if response != PROVIDER_DOWN:
+                print(f"Erreur getActiveActivations: {response}")
+            return None
+
+        if not isinstance(data, dict):
+            return None
+        if data.get("status") != "success":
+            # Aucune activation en cours : liste vide, pas une erreur
+            if data.get("error") == "NO_ACTIVATIONS":
+                return {}
+            print(f"Erreur getActiveActivations: {response}")
+            return None
+
+        statuses = {}
+        for activation in data.get("activeActivations") or []:
+            codes = activation.get("smsCode") or []
+            if isinstance(codes, str):
+                codes = [codes]
+            codes = [code for code in codes if code]
+
+            activation_id = self.order_key(activation.get("activationId"))
+            if codes:
+                statuses[activation_id] = f"STATUS_OK:{codes[-1]}"
+            else:
+                statuses[activation_id] = "STATUS_WAIT_CODE"
+        return statuses
+
     async def get_status(self, activation_id):
         # Réponse attendue : STATUS_OK:CODE ou STATUS_WAIT_CODE
-        text = await self.request("getStatus", {"id": activation_id})
+        text = await self.request(
+            "getStatus",
+            {"id": self.activation_id(activation_id)},
+            timeout=HTTP_STATUS_TIMEOUT,
+        )
         return text
 
     async def cancel_order(self, activation_id, user_info=None):
         # On envoie le statut 8 (Annulation)
         # On attend la réponse pour savoir si ça a marché
-        response = await self.request("setStatus", {"id": activation_id, "status": "8"})
+        response = await self.request(
+            "setStatus", {"id": self.activation_id(activation_id), "status": "8"}
+        )
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         initiator = user_info if user_info else "Unknown"
         print(
@@ -375,15 +1291,842 @@ class SMSClient:
         )  # Pour voir ce qui se passe dans ta console
         return response
 
+    async def complete_order(self, activation_id):
+        # Statut 6 : activation terminée
+        return await self.request(
+            "setStatus", {"id": self.activation_id(activation_id), "status": "6"}
+        )
+
+    async def retry_code(self, activation_id):
+        # Statut 3 : on attend un autre SMS
+        return await self.request(
+            "setStatus", {"id": self.activation_id(activation_id), "status": "3"}
+        )
+
+
+def parse_prices(response, country):
+    """
+    Réponse getPrices -> {code_service: (cost, count)} pour ce pays.
+    Lève ValueError si la réponse n'est pas du JSON (texte d'erreur de l'API).
+    """
+    data = json.loads(response)
+    table = {}
+    for service, info in data.get(str(country), {}).items():
+        try:
+            table[service] = (float(info["cost"]), int(info["count"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return table
+
+
+def load_sms_providers():
+    """SMS-Activate puis les fournisseurs de SMS_EXTRA_PROVIDERS."""
+    providers = [SMSClient()]
+    for entry in SMS_EXTRA_PROVIDERS.split(";"):
+        if not entry.strip():
+            continue
+        try:
+            name, base_url, api_key = (part.strip() for part in entry.split("|"))
+        except ValueError:
+            print(f"⚠️ SMS_EXTRA_PROVIDERS : entrée invalide ignorée ({entry})")
+            continue
+        providers.append(SMSClient(name, base_url, api_key))
+    return providers
+
+
+# --- ROUTAGE MULTI-FOURNISSEURS ---
+class ProviderRouter:
+    """
+    Choisit le fournisseur de chaque achat. Classement par coût effectif :
+    prix / taux de succès, pénalisé par le délai moyen du code, d'après nos
+    propres commandes (par fournisseur, service et pays). Bascule sur le
+    suivant en cas de NO_NUMBERS ou de fournisseur en panne. Sert aussi de
+    catalogue de prix pour les menus (le moins cher avec du stock).
+    """
+
+    def __init__(self, providers):
+        self.providers = {provider.name: provider for provider in providers}
+        self.default = providers[0]
+        # Ids d'activation préfixés, sauf fournisseur par défaut (voir order_key)
+        for provider in providers[1:]:
+            provider.key_prefix = f"{provider.name}:"
+        self.catalogs = {
+            provider.name: PriceCatalog(provider) for provider in providers
+        }
+        self.history = {}  # (fournisseur, service, pays) -> (succès, délai moyen)
+        self.loaded_at = None
+        # Statistiques (commande /monitor)
+        self.routed = {name: 0 for name in self.providers}
+        self.failovers = 0
+
+    def get(self, name):
+        return self.providers.get(name) or self.default
+
+    def unavailable(self):
+        return all(
+            provider.unavailable("getNumber") for provider in self.providers.values()
+        )
+
+    async def close(self):
+        for provider in self.providers.values():
+            await provider.close()
+
+    # -- Catalogue de prix (même interface que PriceCatalog) --
+    def refresh_in_background(self, country):
+        for catalog in self.catalogs.values():
+            catalog.refresh_in_background(country)
+
+    async def get_price(self, service, country):
+        prices = await asyncio.gather(
+            *(catalog.get_price(service, country) for catalog in self.catalogs.values())
+        )
+        prices = [price for price in prices if price is not None]
+        return min(prices) if prices else None
+
+    # -- Historique --
+    async def reload_if_needed(self):
+        if self.loaded_at and monotonic() - self.loaded_at < SMS_ROUTER_RELOAD:
+            return
+        since = to_ts(datetime.now() - timedelta(days=SMS_ROUTER_HISTORY_DAYS))
+        rows = await get_provider_history(since)
+        self.history = {
+            (provider or self.default.name, service, country): (ok, done, delay)
+            for provider, service, country, ok, done, delay in rows
+        }
+        self.loaded_at = monotonic()
+
+    def effective_cost(self, name, cost, service_name, country):
+        completed, finished, delay = self.history.get(
+            (name, service_name, str(country)), (0, 0, None)
+        )
+        success = (completed + SMS_ROUTER_PRIOR_SUCCESS * SMS_ROUTER_PRIOR_WEIGHT) / (
+            finished + SMS_ROUTER_PRIOR_WEIGHT
+        )
+        delay = delay if delay is not None else SMS_DENSE_WINDOW_DEFAULT
+        return cost / max(success, 0.05) * (1 + delay / SMS_ROUTER_DELAY_REF)
+
+    def cached_cost(self, provider, service_code, country_id):
+        """Dernier coût connu chez provider (cache seul, sans appel API)."""
+        return self.catalogs[provider.name].cached_cost(service_code, country_id)
+
+    async def rank(self, service_code, country_id, service_name, max_cost=None):
+        """[(fournisseur, prix)] du meilleur au moins bon, avec stock et rentables."""
+        await self.reload_if_needed()
+        candidates = []
+        for name, catalog in self.catalogs.items():
+            provider = self.providers[name]
+            if provider.unavailable("getNumber"):
+                continue
+            cost = await catalog.get_price(service_code, country_id)
+            if cost is None or (max_cost is not None and cost > max_cost):
+                continue
+            score = self.effective_cost(name, cost, service_name, country_id)
+            candidates.append((score, name, cost))
+        candidates.sort()
+        return [(self.providers[name], cost) for _, name, cost in candidates]
+
+    async def acquire(
+        self,
+        acquirer,
+        service_code,
+        country_id,
+        service_name,
+        country_key,
+        user_info,
+        parallelism=1,
+        max_cost=None,
+    ):
+        """Retourne (fournisseur, prix, résultat de buy_number) ; (None, None, échec)."""
+        result = None
+        ranked = await self.rank(service_code, country_id, service_name, max_cost)
+        for index, (provider, cost) in enumerate(ranked):
+            if index:
+                self.failovers += 1
+                print(f"↪️ Bascule vers {provider.name} ({service_name}/{country_key})")
+            result = await acquirer.acquire(
+                provider,
+                service_code,
+                country_id,
+                service_name,
+                country_key,
+                user_info=user_info,
+                parallelism=parallelism,
+            )
+            if result and result["success"]:
+                self.routed[provider.name] += 1
+                return provider, cost, result
+            # Autre erreur que rupture/panne : on n'essaie pas ailleurs
+            if not result or result.get("code") not in BUY_STOP_CODES:
+                break
+        return None, None, result
+
+
+# --- CATALOGUE DES PRIX (Cache getPrices) ---
+class PriceCatalog:
+    """
+    Cache mémoire des grilles de prix par pays (cost, count) avec TTL.
+    Une entrée expirée mais pas trop vieille est servie tout de suite pendant
+    qu'un rafraîchissement tourne en fond (stale-while-revalidate).
+    """
+
+    def __init__(self, client, ttl=PRICE_CACHE_TTL, max_stale=PRICE_CACHE_MAX_STALE):
+        self.client = client
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.tables = {}  # country -> (fetched_at, {service: (cost, count)})
+        self.refreshing = {}  # country -> Task en cours (partagée entre appelants)
+
+    async def refresh(self, country):
+        table = await self.client.get_prices(country)
+        if table is not None:
+            self.tables[country] = (monotonic(), table)
+        return table
+
+    def refresh_in_background(self, country):
+        country = str(country)
+        task = self.refreshing.get(country)
+        if task is None or task.done():
+            task = asyncio.create_task(self.refresh(country))
+            self.refreshing[country] = task
+        return task
+
+    async def get_country(self, country):
+        country = str(country)
+        entry = self.tables.get(country)
+
+        if entry:
+            age = monotonic() - entry[0]
+            if age < self.ttl:
+                return entry[1]
+            if age < self.max_stale:
+                self.refresh_in_background(country)
+                return entry[1]
+
+        # Rien d'utilisable en cache : on attend le rafraîchissement.
+        # shield() : si l'appelant est annulé, la requête continue pour les autres.
+        return await asyncio.shield(self.refresh_in_background(country))
+
+    async def get_price(self, service, country):
+        """Prix API brut du service, ou None si indisponible / plus de stock."""
+        table = await self.get_country(country)
+        if not table or service not in table:
+            return None
+
+        cost, count = table[service]
+        return cost if count > 0 else None
+
+    def cached_cost(self, service, country):
+        """Coût de la dernière grille reçue (même périmée), ou None."""
+        entry = self.tables.get(str(country))
+        if not entry or service not in entry[1]:
+            return None
+        return entry[1][service][0]
+
+
+# --- CADENCE DE POLLING (Statistiques de délai des codes) ---
+class CodeLatencyStats:
+    """
+    Délai observé entre l'achat et le 1er code, par service/pays (table orders).
+    La fenêtre "dense" d'un couple = p90 des délais, bornée.
+    """
+
+    def __init__(self):
+        self.samples = {}  # (service, country) -> [délais]
+        # (service, country) | (service, None) | (None, None) -> secondes
+        self.windows = {}
+        self.loaded_at = None
+
+    async def load(self):
+        self.samples = {}
+        for service, country, delay in await get_code_delays():
+            self.samples.setdefault((service, country), []).append(delay)
+        self.compute()
+        self.loaded_at = monotonic()
+
+    async def reload_if_needed(self):
+        if self.loaded_at is None or monotonic() - self.loaded_at > SMS_LATENCY_RELOAD:
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Erreur chargement délais SMS: {e}")
+                self.loaded_at = monotonic()
+
+    def record(self, service, country, delay):
+        self.samples.setdefault((service, country), []).append(delay)
+
+    @staticmethod
+    def percentile(values, q):
+        values = sorted(values)
+        return values[int(q * (len(values) - 1))]
+
+    def compute(self):
+        # Regroupement à 3 niveaux : service+pays, service seul, global
+        groups = {}
+        for (service, country), delays in self.samples.items():
+            for key in ((service, country), (service, None), (None, None)):
+                groups.setdefault(key, []).extend(delays)
+
+        self.windows = {}
+        for key, delays in groups.items():
+            if len(delays) >= SMS_LATENCY_MIN_SAMPLES:
+                window = self.percentile(delays, 0.9)
+                self.windows[key] = min(
+                    max(window, SMS_DENSE_WINDOW_MIN), SMS_DENSE_WINDOW_MAX
+                )
+
+    def window_for(self, service, country):
+        for key in ((service, country), (service, None), (None, None)):
+            if key in self.windows:
+                return self.windows[key]
+        return SMS_DENSE_WINDOW_DEFAULT
+
+
+class ActivationWatch:
+    """Une commande suivie par le poller : sa file de statuts et son planning."""
+
+    def __init__(self, service, country, age, window, provider):
+        self.queue = asyncio.Queue()  # Statuts au format getStatus
+        self.provider = provider
+        self.service = service
+        self.country = country
+        self.started = monotonic() - age  # "Heure" de l'achat en temps monotone
+        self.window = window
+        self.next_poll = monotonic()
+
+    def age(self):
+        return monotonic() - self.started
+
+    def phase(self):
+        age = self.age()
+        if age < self.window:
+            return "dense"
+        if age < self.window * 3:
+            return "medium"
+        return "sparse"
+
+    def interval(self):
+        interval = {
+            "dense": SMS_POLL_DENSE_INTERVAL,
+            "medium": SMS_POLL_MEDIUM_INTERVAL,
+            "sparse": SMS_POLL_SPARSE_INTERVAL,
+        }[self.phase()]
+        if SMS_PUSH_ENABLED:
+            # Les codes arrivent par webhook : polling lent de secours uniquement
+            return max(interval, SMS_PUSH_FALLBACK_INTERVAL)
+        return interval
+
+    def schedule(self, now):
+        # Échéances calées sur une grille commune (multiples de l'intervalle) :
+        # les commandes d'une même phase sont dues au même tick, une seule liste
+        interval = self.interval()
+        self.next_poll = (now // interval + 1) * interval
+
+    def boost(self):
+        # Nouveau code demandé : on repasse en polling dense
+        self.started = monotonic()
+        self.next_poll = monotonic()
+
+
+# --- POLLER CENTRAL DES ACTIVATIONS ---
+class ActivationPoller:
+    """
+    Une seule boucle interroge les fournisseurs pour toutes les commandes PENDING.
+    À chaque tick, seules les commandes dont l'échéance est passée déclenchent un
+    appel : un getActiveActivations par fournisseur concerné, puis getStatus
+    uniquement pour les activations dues absentes de la liste. Les statuts sont déposés dans
+    la file de chaque commande (consommée par check_sms_loop).
+    Sans commande dense due, la liste d'un fournisseur est demandée au plus une
+    fois par plus court intervalle des commandes dues.
+    """
+
+    def __init__(self, router, tick=SMS_POLL_TICK):
+        self.router = router
+        self.tick_interval = tick
+        self.watchers = {}  # order_id -> ActivationWatch
+        self.last_listing = {}  # fournisseur -> dernier getActiveActivations
+        self.latency = CodeLatencyStats()
+        self.task = None
+        # Statistiques (commande /monitor)
+        self.ticks = 0
+        self.provider_calls = 0
+        self.pushes = 0
+        self.last_tick_duration = 0.0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def push(self, order_id, status_text):
+        """Statut reçu par webhook : on réveille la commande immédiatement."""
+        watch = self.watchers.get(str(order_id))
+        if watch is None:
+            return False
+        watch.queue.put_nowait(status_text)
+        self.pushes += 1
+        return True
+
+    async def track(self, order_id, service=None, country=None, age=0.0, provider=None):
+        order_id = str(order_id)
+        watch = self.watchers.get(order_id)
+        if watch is None:
+            await self.latency.reload_if_needed()
+            window = self.latency.window_for(service, country)
+            watch = ActivationWatch(
+                service, country, age, window, self.router.get(provider)
+            )
+            self.watchers[order_id] = watch
+        self.start()
+        return watch.queue
+
+    def untrack(self, order_id):
+        self.watchers.pop(str(order_id), None)
+
+    def boost(self, order_id):
+        watch = self.watchers.get(str(order_id))
+        if watch:
+            watch.boost()
+
+    def code_received(self, order_id):
+        """Enregistre le délai d'arrivée du code. Retourne ce délai (secondes)."""
+        watch = self.watchers.get(str(order_id))
+        if watch is None:
+            return None
+        delay = watch.age()
+        self.latency.record(watch.service, watch.country, delay)
+        return delay
+
+    def phase_counts(self):
+        counts = {"dense": 0, "medium": 0, "sparse": 0}
+        for watch in self.watchers.values():
+            counts[watch.phase()] += 1
+        return counts
+
+    async def run(self):
+        while True:
+            started = monotonic()
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Erreur poller activations: {e}")
+            self.last_tick_duration = monotonic() - started
+            await asyncio.sleep(max(0.0, self.tick_interval - self.last_tick_duration))
+
+    async def tick(self):
+        now = monotonic()
+        due = [
+            order_id
+            for order_id, watch in self.watchers.items()
+            if watch.next_poll <= now
+        ]
+        if not due:
+            return
+
+        by_provider = {}
+        for order_id in due:
+            by_provider.setdefault(self.watchers[order_id].provider, []).append(
+                order_id
+            )
+        # Commandes moyennes / espacées seules : elles ont reçu le statut de la
+        # dernière liste, elles attendent (toujours dues) la prochaine
+        for provider, order_ids in list(by_provider.items()):
+            watches = [self.watchers[order_id] for order_id in order_ids]
+            if any(watch.phase() == "dense" for watch in watches):
+                continue
+            shortest = min(watch.interval() for watch in watches)
+            if now - self.last_listing.get(provider, float("-inf")) < shortest:
+                del by_provider[provider]
+        if not by_provider:
+            return
+        due = [order_id for order_ids in by_provider.values() for order_id in order_ids]
+
+        self.ticks += 1
+
+        statuses = {}
+        results = await asyncio.gather(
+            *(
+                self.poll_provider(provider, order_ids)
+                for provider, order_ids in by_provider.items()
+            )
+        )
+        for provider_statuses in results:
+            statuses.update(provider_statuses)
+
+        # La liste couvre aussi les commandes pas encore dues : on leur transmet
+        # gratuitement leur statut, mais seules les dues sont replanifiées
+        for order_id, status_text in statuses.items():
+            watch = self.watchers.get(order_id)
+            if watch is not None:
+                watch.queue.put_nowait(status_text)
+
+        now = monotonic()
+        for order_id in due:
+            watch = self.watchers.get(order_id)
+            if watch is not None:
+                watch.schedule(now)
+
+    async def poll_provider(self, provider, due):
+        self.last_listing[provider] = monotonic()
+        statuses = await provider.get_active_statuses()
+        self.provider_calls += 1
+
+        # Liste indisponible -> on interroge toutes les commandes dues, sinon
+        # seulement celles absentes (activation terminée / annulée côté fournisseur)
+        if statuses is None:
+            statuses = {}
+            missing = due
+        else:
+            missing = [order_id for order_id in due if order_id not in statuses]
+
+        if missing:
+            semaphore = asyncio.Semaphore(SMS_POLL_FALLBACK_CONCURRENCY)
+
+            async def fetch(order_id):
+                async with semaphore:
+                    statuses[order_id] = await provider.get_status(order_id)
+
+            await asyncio.gather(*(fetch(order_id) for order_id in missing))
+            self.provider_calls += len(missing)
+        return statuses
+
+
+# --- FILE D'ANNULATION (Persistée en base) ---
+class CancelQueue:
+    """
+    Les annulations d'activations sont enregistrées dans cancel_queue : l'appelant
+    repart tout de suite, un worker les rejoue avec backoff (en respectant l'âge
+    minimum imposé par le fournisseur) jusqu'à confirmation. La file survit aux
+    redémarrages, aucune activation payée n'est oubliée.
+    """
+
+    DONE_RESPONSES = ("ACCESS_CANCEL", "ACCESS_ACTIVATION_CANCELED", "NO_ACTIVATION")
+
+    def __init__(self, router):
+        self.router = router
+        self.task = None
+        self.wakeup = asyncio.Event()
+        # Statistiques (commande /monitor)
+        self.attempts = 0
+        self.cancelled = 0
+        self.given_up = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def enqueue(self, activation_id, reason, provider=None, bought_ts=None):
+        """
+        Demande l'annulation d'une activation. Fournisseur et date d'achat sont lus
+        dans orders s'ils ne sont pas donnés.
+        """
+        now = to_ts(datetime.now())
+        activation_id = str(activation_id)
+        await db.execute(
+            """INSERT OR IGNORE INTO cancel_queue
+               (activation_id, reason, provider, bought_ts, next_attempt_ts, attempts, created_ts)
+               VALUES (?, ?,
+                       COALESCE(?, (SELECT provider FROM orders WHERE order_id=?)),
+                       COALESCE(?, (SELECT created_ts FROM orders WHERE order_id=?), ?),
+                       ?, 0, ?)""",
+            (
+                activation_id,
+                reason,
+                provider,
+                activation_id,
+                bought_ts,
+                activation_id,
+                now,
+                now,
+                now,
+            ),
+        )
+        self.wakeup.set()
+        self.start()
+
+    async def outstanding(self):
+        return await db.fetchval("SELECT COUNT(*) FROM cancel_queue", default=0)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                delay = await self.process_due()
+            except Exception as e:
+                print(f"Erreur file d'annulation: {e}")
+                delay = SMS_CANCEL_RETRY_BASE
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_due(self):
+        """Traite les annulations dues. Retourne le délai avant la prochaine (s)."""
+        now = to_ts(datetime.now())
+        rows = await db.fetchall(
+            "SELECT activation_id, reason, provider, bought_ts, attempts FROM cancel_queue WHERE next_attempt_ts <= ? ORDER BY next_attempt_ts LIMIT ?",
+            (now, SMS_CANCEL_BATCH),
+        )
+        await asyncio.gather(*(self.attempt(*row) for row in rows))
+        if len(rows) == SMS_CANCEL_BATCH:
+            return 0
+
+        next_ts = await db.fetchval("SELECT MIN(next_attempt_ts) FROM cancel_queue")
+        if next_ts is None:
+            return SMS_CANCEL_IDLE
+        return min(max(0, next_ts - to_ts(datetime.now())), SMS_CANCEL_IDLE)
+
+    async def attempt(self, activation_id, reason, provider, bought_ts, attempts):
+        client = self.router.get(provider)
+        response = await client.cancel_order(activation_id, user_info=reason)
+        self.attempts += 1
+        now = to_ts(datetime.now())
+
+        if any(done in response for done in self.DONE_RESPONSES):
+            self.cancelled += 1
+        elif now - bought_ts > SMS_CANCEL_GIVE_UP_AGE:
+            # Le fournisseur a expiré l'activation de lui-même
+            self.given_up += 1
+            print(
+                f"⚠️ Annulation abandonnée pour {activation_id} après {attempts + 1} essais : {response}"
+            )
+        else:
+            if "EARLY_CANCEL_DENIED" in response:
+                next_ts = max(
+                    bought_ts + SMS_CANCEL_MIN_AGE, now + SMS_CANCEL_RETRY_BASE
+                )
+            else:
+                next_ts = now + min(
+                    SMS_CANCEL_RETRY_BASE * 2**attempts, SMS_CANCEL_RETRY_MAX
+                )
+            await db.execute(
+                "UPDATE cancel_queue SET attempts=attempts+1, next_attempt_ts=?, last_response=? WHERE activation_id=?",
+                (next_ts, response, activation_id),
+            )
+            return
+
+        await db.execute(
+            "DELETE FROM cancel_queue WHERE activation_id=?", (activation_id,)
+        )
+
+
+# --- ACQUISITION DE NUMÉRO (Séquentielle ou spéculative) ---
+BUY_STOP_CODES = ("NO_NUMBERS", "PROVIDER_DOWN")
+
+
+class NumberAcquirer:
+    """
+    Obtient un numéro qui n'est ni un doublon ni bloqué chez un fournisseur donné.
+    Tient des compteurs par (fournisseur, service, pays) pour arbitrer entre dépense chez le fournisseur (activations
+    annulées) et temps d'attente du client.
+    """
+
+    def __init__(self, cancels, max_attempts=SMS_BUY_MAX_ATTEMPTS):
+        self.cancels = cancels
+        self.max_attempts = max_attempts
+        self.stats = {}
+        self.background = set()  # Achats en vol après le gagnant (références gardées)
+
+    def parallelism_for(self, service_key, country_key):
+        return SMS_BUY_PARALLELISM_OVERRIDES.get(
+            (service_key, country_key), SMS_BUY_PARALLELISM
+        )
+
+    def stats_for(self, provider_name, service_name, country_key):
+        return self.stats.setdefault(
+            (provider_name, service_name, country_key),
+            {
+                "acquisitions": 0,
+                "failures": 0,
+                "requests": 0,
+                "numbers": 0,
+                "duplicates": 0,
+                "wasted": 0,
+                "total_time": 0.0,
+            },
+        )
+
+    def _in_background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    async def _discard_pending(self, client, tasks, stats, user_info):
+        # Numéros arrivés après le gagnant : annulés dès qu'ils arrivent
+        for task in tasks:
+            result = await task
+            stats["requests"] += 1
+            if result["success"]:
+                stats["numbers"] += 1
+                stats["wasted"] += 1
+                await self.cancels.enqueue(
+                    result["id"], f"{user_info} (surplus)", provider=client.name
+                )
+
+    async def acquire(
+        self,
+        client,
+        service_code,
+        country_id,
+        service_name,
+        country_key,
+        user_info,
+        parallelism=1,
+    ):
+        """Retourne le dict de buy_number du numéro retenu, ou le dernier échec (ou None)."""
+        stats = self.stats_for(client.name, service_name, country_key)
+        started = monotonic()
+        if parallelism > 1:
+            result = await self._acquire_speculative(
+                client,
+                service_code,
+                country_id,
+                service_name,
+                user_info,
+                parallelism,
+                stats,
+            )
+        else:
+            result = await self._acquire_sequential(
+                client, service_code, country_id, service_name, user_info, stats
+            )
+
+        if result and result["success"]:
+            stats["acquisitions"] += 1
+            stats["total_time"] += monotonic() - started
+        else:
+            stats["failures"] += 1
+        return result
+
+    async def _acquire_sequential(
+        self, client, service_code, country_id, service_name, user_info, stats
+    ):
+        last = None
+        for _ in range(self.max_attempts):
+            result = await client.buy_number(
+                service_code, country_id, user_info=user_info
+            )
+            stats["requests"] += 1
+
+            if result["success"]:
+                stats["numbers"] += 1
+                # Vérif doublons
+                if await is_number_used(result["phone"], service_name):
+                    print(f"DOUBLON REJETÉ: {result['phone']}")
+                    stats["duplicates"] += 1
+                    await self.cancels.enqueue(
+                        result["id"], f"{user_info} (doublon)", provider=client.name
+                    )
+                    await asyncio.sleep(1)
+                    continue
+                return result
+
+            last = result
+            # Plus de stock ou fournisseur en panne : inutile d'insister
+            if result.get("code") in BUY_STOP_CODES:
+                break
+            await asyncio.sleep(0.5)
+        return last
+
+    async def _acquire_speculative(
+        self,
+        client,
+        service_code,
+        country_id,
+        service_name,
+        user_info,
+        parallelism,
+        stats,
+    ):
+        last = None
+        for _ in range(self.max_attempts):
+            pending = {
+                asyncio.create_task(
+                    client.buy_number(service_code, country_id, user_info=user_info)
+                )
+                for _ in range(parallelism)
+            }
+            winner = None
+            stop = False
+
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    result = task.result()
+                    stats["requests"] += 1
+                    if not result["success"]:
+                        last = result
+                        stop = stop or result.get("code") in BUY_STOP_CODES
+                        continue
+
+                    stats["numbers"] += 1
+                    if winner is not None:
+                        # Arrivé en même temps que le gagnant
+                        stats["wasted"] += 1
+                        await self.cancels.enqueue(
+                            result["id"], f"{user_info} (surplus)", provider=client.name
+                        )
+                    elif await is_number_used(result["phone"], service_name):
+                        print(f"DOUBLON REJETÉ: {result['phone']}")
+                        stats["duplicates"] += 1
+                        await self.cancels.enqueue(
+                            result["id"], f"{user_info} (doublon)", provider=client.name
+                        )
+                    else:
+                        winner = result
+
+            if winner is not None:
+                if pending:
+                    self._in_background(
+                        self._discard_pending(client, pending, stats, user_info)
+                    )
+                return winner
+
+            if stop:
+                break
+            await asyncio.sleep(0.5)
+        return last
+
+    def report(self, limit=5):
+        """(fournisseur, service, pays, achats, taux de doublons, gaspillées, délai moyen)."""
+        rows = []
+        for (provider, service, country), entry in self.stats.items():
+            numbers = entry["numbers"] or 1
+            acquisitions = entry["acquisitions"] or 1
+            rows.append(
+                (
+                    provider,
+                    service,
+                    country,
+                    entry["acquisitions"],
+                    entry["duplicates"] / numbers,
+                    entry["wasted"],
+                    entry["total_time"] / acquisitions,
+                )
+            )
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
 
 # --- CLIENT HOODPAY ---
 class HoodpayClient:
     def __init__(self):
-        self.base_url = "https://api.hoodpay.io/v1"
+        self.base_url = HOODPAY_BASE_URL
         self.headers = {
             "Authorization": f"Bearer {HOODPAY_API_KEY}",
             "Content-Type": "application/json",
         }
+        self.session = None
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = create_http_session(headers=self.headers)
+        return self.session
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
 
     async def create_payment(self, amount, user_id, guild_id):
         url = f"{self.base_url}/payments"
@@ -395,8 +2138,9 @@ class HoodpayClient:
             "metadata": {"user_id": str(user_id), "guild_id": str(guild_id)},
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=self.headers) as resp:
+        session = await self.get_session()
+        try:
+            async with session.post(url, json=payload) as resp:
                 if resp.status == 200 or resp.status == 201:
                     data = await resp.json()
                     return data.get("data", {}).get("checkoutUrl")
@@ -404,17 +2148,489 @@ class HoodpayClient:
                     text = await resp.text()
                     print(f"Erreur Hoodpay ({resp.status}): {text}")
                     return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Erreur réseau Hoodpay: {e!r}")
+            return None
 
 
 # --- HANDLER TELETHON ---
-from telethon import TelegramClient
+from telethon import TelegramClient, events
+from telethon.errors import AuthKeyDuplicatedError, FloodWaitError, UnauthorizedError
 from telethon.sessions import StringSession
 from telethon.tl.functions.account import GetPasswordRequest
 import re
 
+from telethon_governor import (
+    PRIORITY_ADMIN,
+    PRIORITY_BACKGROUND,
+    PRIORITY_CUSTOMER,
+    TelethonBusy,
+    TelethonGovernor,
+    session_dc,
+)
+
 # --- CONFIG TELETHON ---
 TG_API_ID = os.getenv("TELEGRAM_API_ID")
 TG_API_HASH = os.getenv("TELEGRAM_API_HASH")
+# Régulateur commun : opérations Telethon simultanées (toutes origines confondues)
+TG_MAX_OPERATIONS = int(os.getenv("TG_MAX_OPERATIONS", "10"))
+TG_MAX_OPERATIONS_PER_DC = int(os.getenv("TG_MAX_OPERATIONS_PER_DC", "6"))
+TG_CUSTOMER_MAX_WAIT = 30  # Pause FloodWait au-delà de laquelle le client est prévenu
+# Clients connectés gardés au chaud entre deux clics "Recevoir le Code"
+TG_POOL_MAX_CLIENTS = int(os.getenv("TG_POOL_MAX_CLIENTS", "20"))
+TG_POOL_IDLE_TTL = 10 * 60  # Fermeture après 10 min sans utilisation (secondes)
+TG_POOL_SWEEP_INTERVAL = 60  # Ménage des clients inactifs (secondes)
+# Écoute des codes de connexion (777000) après un clic "Recevoir le Code"
+TG_LISTEN_WINDOW = 10 * 60  # Durée de l'écoute (secondes)
+TG_LISTEN_MAX = int(os.getenv("TG_LISTEN_MAX", "10"))  # Comptes écoutés à la fois
+TG_CODE_MAX_AGE = 60 * 60  # Codes plus vieux ignorés par la recherche manuelle
+# Vérification du stock (/fix_stock), sous le plafond global pour laisser de la
+# place aux clients
+TG_HEALTH_CONCURRENCY = int(os.getenv("TG_HEALTH_CONCURRENCY", "5"))
+TG_HEALTH_BATCH = 50  # Résultats enregistrés par lots
+TG_HEALTH_PROGRESS_INTERVAL = 3  # Mise à jour du message de progression (secondes)
+# Vérification programmée du stock (StockSweeper), en tâche de fond
+TG_SWEEP_INTERVAL = int(os.getenv("TG_SWEEP_INTERVAL", "60"))  # secondes
+# Taille des passages : de quoi revérifier tout le stock en TG_SWEEP_MAX_AGE,
+# entre TG_SWEEP_BATCH et TG_SWEEP_MAX_BATCH comptes
+TG_SWEEP_BATCH = int(os.getenv("TG_SWEEP_BATCH", "5"))
+TG_SWEEP_MAX_BATCH = int(os.getenv("TG_SWEEP_MAX_BATCH", "200"))
+# Vérifications simultanées : une par tranche de 10 comptes du passage, plafonnée
+TG_SWEEP_CONCURRENCY = int(os.getenv("TG_SWEEP_CONCURRENCY", "3"))
+TG_SWEEP_MAX_AGE = 6 * 60 * 60  # Revérification après 6h (secondes)
+TG_SWEEP_ERROR_RETRY = 5 * 60  # Vérification en erreur : nouvel essai après 5 min
+TG_SELL_MAX_CHECK_AGE = 24 * 60 * 60  # Plus vendu sans vérification depuis 24h
+
+# Code de connexion dans les messages de Telegram (777000) : "Login code: 12345"
+LOGIN_CODE_LABELLED = re.compile(r":\s*(\d{5})")
+LOGIN_CODE_BARE = re.compile(r"\b(\d{5})\b")
+
+
+def extract_login_code(text):
+    """Code à 5 chiffres d'un message de Telegram, ou None."""
+    match = LOGIN_CODE_LABELLED.search(text) or LOGIN_CODE_BARE.search(text)
+    return match.group(1) if match else None
+
+
+# --- RÉGULATEUR TELETHON ---
+telethon_governor = TelethonGovernor(TG_MAX_OPERATIONS, TG_MAX_OPERATIONS_PER_DC)
+
+
+# --- POOL DE CLIENTS TELETHON ---
+class SessionNotAuthorized(Exception):
+    """La session n'est plus autorisée (déconnectée ou révoquée)."""
+
+
+# Erreurs Telegram d'une session révoquée en cours de connexion (401 / clé dupliquée)
+SESSION_REVOKED_ERRORS = (UnauthorizedError, AuthKeyDuplicatedError)
+
+
+class PooledClient:
+    def __init__(self, client):
+        self.client = client
+        self.lock = asyncio.Lock()  # Une opération à la fois par compte
+        self.last_used = monotonic()
+        self.connected_once = False
+        self.pinned = 0  # Écoutes en cours : jamais évincé tant que > 0
+
+
+class TelethonPool:
+    """
+    Clients Telethon connectés, par session, réutilisés d'un clic à l'autre :
+    seul le premier clic paie la connexion au DC (5-10 s). LRU + TTL
+    d'inactivité, nombre de connexions plafonné, reconnexion si le client a
+    décroché. Chaque opération passe par le régulateur Telethon.
+    """
+
+    def __init__(
+        self, governor, max_clients=TG_POOL_MAX_CLIENTS, idle_ttl=TG_POOL_IDLE_TTL
+    ):
+        self.governor = governor
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.entries = OrderedDict()  # session_string -> PooledClient (LRU en tête)
+        self.listeners = []  # Appelés avec la session de chaque client fermé
+        self.changed = asyncio.Condition()
+        self.task = None
+        # Statistiques (commande /monitor)
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_sweeper())
+
+    async def run_sweeper(self):
+        while True:
+            await asyncio.sleep(TG_POOL_SWEEP_INTERVAL)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                print(f"Erreur pool Telethon: {e}")
+
+    async def evict_idle(self):
+        deadline = monotonic() - self.idle_ttl
+        for key, entry in list(self.entries.items()):
+            if (
+                entry.last_used < deadline
+                and not entry.pinned
+                and not entry.lock.locked()
+            ):
+                await self.discard(key)
+
+    async def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.evictions += 1
+        for listener in self.listeners:
+            listener(key)
+        try:
+            await entry.client.disconnect()
+        except Exception:
+            pass
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def _entry(self, session_string):
+        entry = self.entries.get(session_string)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(session_string)
+            return entry
+
+        self.misses += 1
+        # Plafond atteint : on ferme le moins récemment utilisé qui est libre,
+        # sinon on attend qu'une opération se termine
+        while len(self.entries) >= self.max_clients:
+            idle = next(
+                (
+                    key
+                    for key, e in self.entries.items()
+                    if not e.pinned and not e.lock.locked()
+                ),
+                None,
+            )
+            if idle is not None:
+                await self.discard(idle)
+            else:
+                async with self.changed:
+                    await self.changed.wait()
+            # Un clic simultané sur la même session a pu créer le client pendant l'attente
+            entry = self.entries.get(session_string)
+            if entry is not None:
+                return entry
+
+        client = TelegramClient(
+            StringSession(session_string), int(TG_API_ID), TG_API_HASH
+        )
+        entry = PooledClient(client)
+        self.entries[session_string] = entry
+        return entry
+
+    async def run(
+        self, session_string, operation, priority=PRIORITY_CUSTOMER, max_wait=None
+    ):
+        """
+        Exécute await operation(client) avec un client connecté et autorisé.
+        Une coupure réseau provoque une reconnexion et un seul nouvel essai.
+        """
+        dc_id = session_dc(session_string)
+        for attempt in range(2):
+            entry = await self._entry(session_string)
+            try:
+                async with entry.lock:
+                    return await self.governor.run(
+                        lambda: self._call(entry, operation),
+                        priority=priority,
+                        dc_id=dc_id,
+                        max_wait=max_wait,
+                    )
+            except SessionNotAuthorized:
+                await self.discard(session_string)
+                raise
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                await self.discard(session_string)
+                if attempt:
+                    raise
+            finally:
+                async with self.changed:
+                    self.changed.notify_all()
+
+    async def _call(self, entry, operation):
+        client = entry.client
+        if not client.is_connected():
+            if entry.connected_once:
+                self.reconnects += 1
+            await client.connect()
+            entry.connected_once = True
+            if not await client.is_user_authorized():
+                raise SessionNotAuthorized()
+        try:
+            return await operation(client)
+        except SESSION_REVOKED_ERRORS as e:
+            # Révoquée alors que le client était connecté : l'entrée sera retirée
+            raise SessionNotAuthorized() from e
+        finally:
+            entry.last_used = monotonic()
+
+    def pin(self, session_string):
+        entry = self.entries.get(session_string)
+        if entry is not None:
+            entry.pinned += 1
+
+    async def unpin(self, session_string):
+        entry = self.entries.get(session_string)
+        if entry is not None and entry.pinned:
+            entry.pinned -= 1
+            entry.last_used = monotonic()
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def close(self):
+        for key in list(self.entries):
+            await self.discard(key)
+        if self.task is not None:
+            self.task.cancel()
+
+
+telethon_pool = TelethonPool(telethon_governor)
+
+
+# --- ÉCOUTE DES CODES DE CONNEXION ---
+class LoginWatch:
+    def __init__(self, session_string, channel, deadline):
+        self.session_string = session_string
+        self.channel = channel  # MP du client
+        self.deadline = deadline
+        self.client = None
+        self.handler = None
+        self.codes = set()  # Codes déjà envoyés
+        self.task = None
+        self.subscribing = False
+
+
+class LoginCodeWatcher:
+    """
+    Pendant TG_LISTEN_WINDOW après un clic "Recevoir le Code", écoute les
+    nouveaux messages de Telegram (777000) sur le client du pool et envoie le
+    code en MP dès son arrivée. Nombre d'écoutes simultanées plafonné.
+    """
+
+    def __init__(self, pool, max_sessions=TG_LISTEN_MAX, window=TG_LISTEN_WINDOW):
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.window = window
+        self.watches = {}  # session_string -> LoginWatch
+        self.closing = False
+        # Client fermé par le pool (coupure, session révoquée...) : on se réabonne
+        pool.listeners.append(self.client_dropped)
+        # Statistiques (commande /monitor)
+        self.pushed = 0
+        self.refused = 0
+        self.resubscribed = 0
+
+    async def watch(self, session_string, channel):
+        """True si l'écoute est lancée (ou prolongée), False si plafond atteint."""
+        watch = self.watches.get(session_string)
+        if watch is not None:
+            watch.deadline = monotonic() + self.window
+            watch.channel = channel
+            if watch.client is None and not watch.subscribing:
+                # Client perdu depuis le premier clic : nouvel abonnement
+                await self.subscribe(watch)
+            return True
+        if len(self.watches) >= self.max_sessions:
+            self.refused += 1
+            return False
+
+        watch = LoginWatch(session_string, channel, monotonic() + self.window)
+        # Place réservée avant le premier await (clics simultanés)
+        self.watches[session_string] = watch
+        try:
+            await self.subscribe(watch)
+        except Exception:
+            self.watches.pop(session_string, None)
+            raise
+        watch.task = asyncio.create_task(self.expire(watch))
+        return True
+
+    async def subscribe(self, watch):
+        """Abonne watch aux messages de 777000 sur le client du pool (épinglé)."""
+
+        async def attach(client):
+            async def handler(event):
+                await self.on_message(watch, event)
+
+            watch.client = client
+            watch.handler = handler
+            client.add_event_handler(handler, events.NewMessage(chats=777000))
+            # Une requête après connexion pour que le serveur pousse les mises à jour
+            await client.get_me()
+
+        watch.subscribing = True
+        try:
+            await self.pool.run(
+                watch.session_string, attach, max_wait=TG_CUSTOMER_MAX_WAIT
+            )
+        except Exception:
+            self.unsubscribe(watch)
+            watch.client = None
+            raise
+        finally:
+            watch.subscribing = False
+        self.pool.pin(watch.session_string)
+
+    def client_dropped(self, session_string):
+        watch = self.watches.get(session_string)
+        if self.closing or watch is None or watch.client is None or watch.subscribing:
+            return
+        # Le gestionnaire est parti avec l'ancien client
+        watch.client = None
+        watch.handler = None
+        asyncio.create_task(self.resubscribe(watch))
+
+    async def resubscribe(self, watch):
+        if self.watches.get(watch.session_string) is not watch:
+            return
+        try:
+            await self.subscribe(watch)
+            self.resubscribed += 1
+        except Exception as e:
+            # Le prochain clic "Recevoir le Code" retentera l'abonnement
+            print(f"Écoute des codes interrompue: {e}")
+
+    async def on_message(self, watch, event):
+        code = extract_login_code(event.raw_text or "")
+        if not code or code in watch.codes:
+            return
+        watch.codes.add(code)
+        try:
+            await watch.channel.send(
+                f"📩 **CODE TELEGRAM REÇU :** `{code}`\n📄 ||{event.raw_text}||"
+            )
+            self.pushed += 1
+        except discord.HTTPException as e:
+            print(f"Erreur envoi code Telegram en MP: {e}")
+
+    def unsubscribe(self, watch):
+        if watch.client is not None and watch.handler is not None:
+            watch.client.remove_event_handler(watch.handler)
+            watch.handler = None
+
+    async def expire(self, watch):
+        try:
+            # La fenêtre peut être prolongée par un nouveau clic
+            while (remaining := watch.deadline - monotonic()) > 0:
+                await asyncio.sleep(remaining)
+        finally:
+            self.unsubscribe(watch)
+            self.watches.pop(watch.session_string, None)
+            await self.pool.unpin(watch.session_string)
+
+    async def close(self):
+        self.closing = True
+        for watch in list(self.watches.values()):
+            if watch.task is not None:
+                watch.task.cancel()
+
+
+login_code_watcher = LoginCodeWatcher(telethon_pool)
+
+
+# --- VÉRIFICATION DU STOCK (Santé des sessions) ---
+HEALTH_OK = "OK"
+HEALTH_INVALID = "INVALID"  # Session non autorisée : à réparer
+HEALTH_ERROR = "ERROR"  # Vérification impossible (réseau, FloodWait répété...)
+
+
+class StockHealthChecker:
+    """
+    Vérifie les sessions du stock en parallèle (TG_HEALTH_CONCURRENCY à la
+    fois) via le régulateur Telethon, qui gère les pauses FloodWait.
+    Résultats enregistrés par lots (health_status, checked_ts) ; les comptes
+    invalides partent dans une file de réparation traitée à part du scan.
+    """
+
+    def __init__(self, concurrency=TG_HEALTH_CONCURRENCY):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.repairs = asyncio.Queue()  # (id, phone, session_string)
+        self.pending_results = []
+        self.total = 0
+        self.checked = 0
+        self.counts = {HEALTH_OK: 0, HEALTH_INVALID: 0, HEALTH_ERROR: 0}
+        self.started = monotonic()
+
+    async def check_session(self, phone, session_string):
+        async def connect():
+            client = TelegramClient(
+                StringSession(session_string), int(TG_API_ID), TG_API_HASH
+            )
+            try:
+                await client.connect()
+                if await client.is_user_authorized():
+                    return HEALTH_OK
+                return HEALTH_INVALID
+            finally:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
+
+        async with self.semaphore:
+            try:
+                return await telethon_governor.run(
+                    connect, priority=PRIORITY_ADMIN, dc_id=session_dc(session_string)
+                )
+            except Exception as e:
+                print(f"Erreur check {phone}: {e}")
+                return HEALTH_ERROR
+
+    async def flush(self):
+        results, self.pending_results = self.pending_results, []
+        if results:
+            await db.executemany(
+                "UPDATE telegram_accounts SET health_status=?, checked_ts=? WHERE id=?",
+                results,
+            )
+
+    async def check_account(self, account):
+        account_id, phone, session_string = account
+        status = await self.check_session(phone, session_string)
+        self.checked += 1
+        self.counts[status] += 1
+        self.pending_results.append((status, to_ts(datetime.now()), account_id))
+        if len(self.pending_results) >= TG_HEALTH_BATCH:
+            await self.flush()
+        if status == HEALTH_INVALID:
+            self.repairs.put_nowait(account)
+
+    async def run(self, accounts):
+        self.total = len(accounts)
+        self.started = monotonic()
+        try:
+            await asyncio.gather(*(self.check_account(a) for a in accounts))
+        finally:
+            await self.flush()
+
+    def progress_text(self, finished=False):
+        elapsed = monotonic() - self.started
+        title = "🏁 Vérification terminée" if finished else "🔄 Vérification du stock"
+        lines = [
+            f"{title} : {self.checked}/{self.total} comptes ({elapsed:.0f}s)",
+            f"✅ {self.counts[HEALTH_OK]} valides | ❌ {self.counts[HEALTH_INVALID]} invalides | "
+            f"⚠️ {self.counts[HEALTH_ERROR]} erreurs",
+        ]
+        pause = telethon_governor.pause_remaining()
+        if pause > 0:
+            lines.append(f"⏸️ FloodWait : reprise dans {pause:.0f}s")
+        if not self.repairs.empty():
+            lines.append(
+                f"🔧 {self.repairs.qsize()} compte(s) en attente de réparation"
+            )
+        return "\n".join(lines)
 
 
 # --- HANDLER TELETHON (Gestionnaire de Sessions) ---
@@ -422,8 +2638,8 @@ class TelethonHandler:
     @staticmethod
     async def get_login_code(session_string):
         """
-        Se connecte au compte via session_string, récupère le dernier code Telegram,
-        et se déconnecte.
+        Récupère les derniers codes Telegram du compte. Le client connecté est
+        gardé dans le pool : les clics suivants ne refont pas la connexion.
         """
         if not TG_API_ID or not TG_API_HASH:
             return {
@@ -431,89 +2647,115 @@ class TelethonHandler:
                 "error": "Config Bot Telegram manquante (API_ID/HASH).",
             }
 
-        client = TelegramClient(
-            StringSession(session_string), int(TG_API_ID), TG_API_HASH
-        )
-
         try:
-            print(f"📡 [Telethon] Tentative de connexion pour la session du compte...")
-            await client.connect()
-
-            if await client.is_user_authorized():
-                print(f"✅ [Telethon] Connexion CLIENT réussie. Session active.")
+            found_codes = await telethon_pool.run(
+                session_string,
+                TelethonHandler.read_login_codes,
+                max_wait=TG_CUSTOMER_MAX_WAIT,
+            )
+        except TelethonBusy as e:
+            return {"success": False, "error": f"{e}. Réessayez plus tard."}
+        except SessionNotAuthorized:
+            print(
+                f"❌ [Telethon] Connexion ECHOUÉE : Session non autorisée (invalide ou déconnectée)."
+            )
+            return {
+                "success": False,
+                "error": "Session du bot invalide. Contactez le support.",
+            }
+        except Exception as e:
+            print(f"❌Erreur Telethon CRITIQUE: {e}")
+            return {"success": False, "error": f"Erreur connexion : {str(e)}"}
 
-                # On cherche le message de Telegram (777000)
-                # On prend l'historique récent
-                print(f"🔍 [Telethon] Recherche du code dans les messages de 777000...")
+        if found_codes:
+            # On trie du plus récent au plus vieux
+            found_codes.sort(key=lambda x: x["age"])
+            return {"success": True, "codes": found_codes}
+        else:
+            return {
+                "success": False,
+                "error": "Aucun code trouvé dans la dernière heure.",
+            }
 
-                try:
-                    system_user = await client.get_entity(777000)
-                except Exception as e:
-                    print(
-                        f"⚠️ [Telethon] Impossible de résoudre l'entité 777000 directement : {e}"
-                    )
-                    # Fallback éventuel ou abandon
-
-                # On lit les 5 derniers messages
-                messages = await client.get_messages(777000, limit=5)
-
-                code = None
-                print(f"📨 [Telethon] {len(messages)} messages trouvés de Telegram.")
-
-                found_codes = []
-                for msg in messages:
-                    if msg.message:
-                        print(f"   -> Message reçu ({msg.date}): {msg.message[:50]}...")
-
-                        match = re.search(r":\s*(\d{5})", msg.message)
-                        if not match:
-                            match = re.search(r"\b(\d{5})\b", msg.message)
-
-                        if match:
-                            now = datetime.now(msg.date.tzinfo)
-                            diff = now - msg.date
-                            # On prend tout ce qui a moins de 24h (86400s) pour être large
-                            if diff.total_seconds() < 86400:
-                                code = match.group(1)
-                                found_codes.append(
-                                    {
-                                        "code": code,
-                                        "age": int(diff.total_seconds()),
-                                        "message": msg.message,
-                                    }
-                                )
-                                print(
-                                    f"✅ Code trouvé : {code} ({int(diff.total_seconds())}s)"
-                                )
+    @staticmethod
+    async def read_login_codes(client):
+        """Codes des 5 derniers messages de Telegram (777000) de moins d'une heure."""
+        # On cherche le message de Telegram (777000)
+        print(f"🔍 [Telethon] Recherche du code dans les messages de 777000...")
+        try:
+            # Résolu une fois puis gardé dans le cache d'entités du client
+            await client.get_entity(777000)
+        except Exception as e:
+            print(
+                f"⚠️ [Telethon] Impossible de résoudre l'entité 777000 directement : {e}"
+            )
 
-                await client.disconnect()
+        # On lit les 5 derniers messages
+        messages = await client.get_messages(777000, limit=5)
+        print(f"📨 [Telethon] {len(messages)} messages trouvés de Telegram.")
 
-                if found_codes:
-                    # On trie du plus récent au plus vieux
-                    found_codes.sort(key=lambda x: x["age"])
-                    return {"success": True, "codes": found_codes}
-                else:
-                    return {
-                        "success": False,
-                        "error": "Aucun code trouvé dans les dernières 24h.",
+        found_codes = []
+        for msg in messages:
+            if not msg.message:
+                continue
+            code = extract_login_code(msg.message)
+            if not code:
+                continue
+            now = datetime.now(msg.date.tzinfo)
+            diff = now - msg.date
+            # Au-delà d'une heure le code est forcément expiré
+            if diff.total_seconds() < TG_CODE_MAX_AGE:
+                found_codes.append(
+                    {
+                        "code": code,
+                        "age": int(diff.total_seconds()),
+                        "message": msg.message,
                     }
-            else:
-                print(
-                    f"❌ [Telethon] Connexion ECHOUÉE : Session non autorisée (invalide ou déconnectée)."
                 )
-                await client.disconnect()
+                print(f"✅ Code trouvé : {code} ({int(diff.total_seconds())}s)")
+        return found_codes
+
+    @staticmethod
+    async def probe_account(session_string, priority=PRIORITY_ADMIN, retries=1):
+        """
+        Se connecte au compte : 2FA actif (Cloud Password) et infos du compte.
+        Lève SessionNotAuthorized si la session est invalide, FloodWaitError...
+        """
+
+        async def probe():
+            client = TelegramClient(
+                StringSession(session_string), int(TG_API_ID), TG_API_HASH
+            )
+            try:
+                await client.connect()
+                if not await client.is_user_authorized():
+                    raise SessionNotAuthorized()
+
+                # Vérification du 2FA
+                password_status = await client(GetPasswordRequest())
+
+                # On récupère aussi les infos du compte pour être sûr
+                me = await client.get_me()
                 return {
-                    "success": False,
-                    "error": "Session du bot invalide. Contactez le support.",
+                    "has_2fa": password_status.has_password,
+                    "username": me.username,
+                    "first_name": me.first_name,
+                    "phone": me.phone,
                 }
+            except SESSION_REVOKED_ERRORS as e:
+                raise SessionNotAuthorized() from e
+            finally:
+                try:
+                    await client.disconnect()
+                except Exception:
+                    pass
 
-        except Exception as e:
-            try:
-                await client.disconnect()
-            except:
-                pass
-            print(f"❌Erreur Telethon CRITIQUE: {e}")
-            return {"success": False, "error": f"Erreur connexion : {str(e)}"}
+        return await telethon_governor.run(
+            probe,
+            priority=priority,
+            dc_id=session_dc(session_string),
+            retries=retries,
+        )
 
     @staticmethod
     async def check_2fa_status(session_string):
@@ -523,38 +2765,143 @@ class TelethonHandler:
         if not TG_API_ID or not TG_API_HASH:
             return {"success": False, "error": "Config manquante"}
 
-        client = TelegramClient(
-            StringSession(session_string), int(TG_API_ID), TG_API_HASH
-        )
         try:
-            await client.connect()
-            if not await client.is_user_authorized():
-                await client.disconnect()
-                return {"success": False, "error": "Session invalide"}
+            info = await TelethonHandler.probe_account(session_string)
+        except SessionNotAuthorized:
+            return {"success": False, "invalid": True, "error": "Session invalide"}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        return {"success": True, **info}
+
+
+# --- VÉRIFICATION PROGRAMMÉE DU STOCK ---
+class StockSweeper:
+    """
+    Revérifie le stock disponible en tâche de fond (basse priorité) : d'abord
+    les vérifications en erreur (après TG_SWEEP_ERROR_RETRY), puis les comptes
+    jamais vérifiés et les vérifications les plus anciennes.
+    Taille des passages et vérifications simultanées suivent la taille du
+    stock, pour que tout soit revérifié en TG_SWEEP_MAX_AGE. Le résultat
+    (santé, 2FA, username) est gardé en base pour la mise en vente et
+    /check_account. Dernier servi par le régulateur Telethon ; pas de
+    vérification pendant une pause FloodWait.
+    """
 
-            # Vérification du 2FA
-            password_status = await client(GetPasswordRequest())
-            has_password = password_status.has_password
+    def __init__(
+        self,
+        interval=TG_SWEEP_INTERVAL,
+        min_batch=TG_SWEEP_BATCH,
+        max_batch=TG_SWEEP_MAX_BATCH,
+        max_concurrency=TG_SWEEP_CONCURRENCY,
+        max_age=TG_SWEEP_MAX_AGE,
+        error_retry=TG_SWEEP_ERROR_RETRY,
+    ):
+        self.interval = interval
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.max_concurrency = max_concurrency
+        self.max_age = max_age
+        self.error_retry = error_retry
+        self.task = None
+        # Statistiques (commande /monitor)
+        self.checked = 0
+        self.invalid = 0
+        self.errors = 0
+        self.flood_waits = 0
+        self.last_batch = 0
+        self.last_concurrency = 0
+
+    def start(self):
+        if not TG_API_ID or not TG_API_HASH:
+            return
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_forever())
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Erreur vérification programmée du stock: {e}")
+            await asyncio.sleep(self.interval)
+
+    def batch_size(self, stock):
+        # stock x interval / max_age comptes par passage : un tour complet en max_age
+        needed = -(-stock * self.interval // self.max_age)
+        return max(self.min_batch, min(self.max_batch, needed))
+
+    async def due_accounts(self, limit):
+        now_ts = to_ts(datetime.now())
+        # Échecs temporaires (ERROR = hors vente) : nouvel essai après error_retry
+        accounts = await db.fetchall(
+            "SELECT id, phone, session_string FROM telegram_accounts WHERE status='AVAILABLE' AND health_status='ERROR' AND checked_ts < ? ORDER BY checked_ts LIMIT ?",
+            (now_ts - self.error_retry, limit),
+        )
+        seen = {account[0] for account in accounts}
+        for account in await db.fetchall(
+            "SELECT id, phone, session_string FROM telegram_accounts WHERE status='AVAILABLE' AND (checked_ts IS NULL OR checked_ts < ?) ORDER BY checked_ts LIMIT ?",
+            (now_ts - self.max_age, limit),
+        ):
+            if len(accounts) >= limit:
+                break
+            if account[0] not in seen:
+                accounts.append(account)
+        return accounts
 
-            # On récupère aussi les infos du compte pour être sûr
-            me = await client.get_me()
+    async def sweep(self):
+        if telethon_governor.pause_remaining() > 0:
+            return
+        stock = await db.fetchval(
+            "SELECT COUNT(*) FROM telegram_accounts WHERE status='AVAILABLE'",
+            default=0,
+        )
+        accounts = await self.due_accounts(self.batch_size(stock))
+        self.last_batch = len(accounts)
+        self.last_concurrency = max(
+            1, min(self.max_concurrency, -(-len(accounts) // 10))
+        )
+        semaphore = asyncio.Semaphore(self.last_concurrency)
+        await asyncio.gather(*(self.check(a, semaphore) for a in accounts))
+
+    async def check(self, account, semaphore):
+        account_id, phone, session_string = account
+        async with semaphore:
+            if telethon_governor.pause_remaining() > 0:
+                return  # Compte revérifié au prochain passage
+            try:
+                info = await TelethonHandler.probe_account(
+                    session_string, priority=PRIORITY_BACKGROUND, retries=0
+                )
+            except SessionNotAuthorized:
+                self.invalid += 1
+                await save_account_check(account_id, HEALTH_INVALID)
+            except FloodWaitError:
+                # Pause commune posée par le régulateur ; compte revérifié à la reprise
+                self.flood_waits += 1
+                return
+            except Exception as e:
+                self.errors += 1
+                print(f"Erreur vérification {phone}: {e}")
+                await save_account_check(account_id, HEALTH_ERROR)
+            else:
+                await save_account_check(account_id, HEALTH_OK, info)
+            self.checked += 1
+
+    def status_text(self):
+        if not TG_API_ID or not TG_API_HASH:
+            return "Vérification programmée : désactivée"
+        return (
+            f"Vérification programmée : {self.checked} comptes | invalides {self.invalid} | "
+            f"erreurs {self.errors} | FloodWait {self.flood_waits} | dernier passage "
+            f"{self.last_batch} comptes ({self.last_concurrency} à la fois)"
+        )
 
-            await client.disconnect()
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
 
-            return {
-                "success": True,
-                "has_2fa": has_password,
-                "username": me.username,
-                "first_name": me.first_name,
-                "phone": me.phone,
-            }
 
-        except Exception as e:
-            try:
-                await client.disconnect()
-            except:
-                pass
-            return {"success": False, "error": str(e)}
+stock_sweeper = StockSweeper()
 
 
 # --- WEBHOOK SERVER ---
@@ -577,8 +2924,8 @@ async def handle_webhook(request):
 
             if user_id > 0:
                 print(f"✅ Paiement validé pour {user_id} : +{amount}€")
-                update_balance(user_id, amount)
-                add_deposit_log(user_id, amount, "Hoodpay")
+                await update_balance(user_id, amount)
+                await add_deposit_log(user_id, amount, "Hoodpay")
 
                 # Notification utilisateur (Optionnel, requiert d'avoir le bot accessible)
                 # On ne peut pas facilement await bot.fetch_user ici sans contexte,
@@ -590,20 +2937,86 @@ async def handle_webhook(request):
         return web.Response(status=500, text="Error")
 
 
+async def handle_sms_webhook(request):
+    # Sécurité : le token secret doit être présent dans l'URL déclarée chez le fournisseur
+    token = request.query.get("token", "")
+    if not hmac.compare_digest(token, SMS_WEBHOOK_SECRET or ""):
+        return web.Response(status=403, text="Forbidden")
+
+    try:
+        data = await request.json()
+    except Exception:
+        return web.Response(status=400, text="Bad Request")
+
+    activation_id = str(data.get("activationId") or "")
+    code = str(data.get("code") or "").strip()
+    if not code and data.get("text"):
+        # Pas de code extrait par le fournisseur : on le cherche dans le texte
+        match = re.search(r"\b(\d{4,8})\b", str(data["text"]))
+        if match:
+            code = match.group(1)
+
+    if not activation_id or not code:
+        return web.Response(status=400, text="Bad Request")
+    # Fournisseurs additionnels : URL déclarée avec &provider=<nom>
+    activation_id = sms_router.get(request.query.get("provider")).order_key(
+        activation_id
+    )
+
+    # Commande inconnue ou déjà terminée : on acquitte quand même (sinon renvois)
+    if sms_poller.push(activation_id, f"STATUS_OK:{code}"):
+        print(f"📨 SMS PUSH reçu pour l'activation {activation_id}")
+    else:
+        print(f"SMS PUSH ignoré (activation {activation_id} non suivie)")
+    return web.Response(text="OK")
+
+
+webhook_runner = None
+
+
 async def start_webhook_server():
+    global webhook_runner
+    # on_ready peut être rappelé après une reconnexion : un seul serveur
+    if webhook_runner is not None:
+        return
+
     app = web.Application()
     app.router.add_post("/webhook", handle_webhook)
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", WEBHOOK_PORT)
+    if SMS_PUSH_ENABLED:
+        app.router.add_post("/sms_webhook", handle_sms_webhook)
+    webhook_runner = web.AppRunner(app)
+    await webhook_runner.setup()
+    site = web.TCPSite(webhook_runner, "0.0.0.0", WEBHOOK_PORT)
     await site.start()
     print(f"🌍 Serveur Webhook démarré sur le port {WEBHOOK_PORT}")
 
 
 # --- LOGIQUE DU BOT ---
-init_db()
-bot = commands.Bot(command_prefix="!", intents=discord.Intents.all())
-sms_api = SMSClient()
+db.run_sync(init_db)
+print(
+    f"🔎 Index des numéros utilisés chargé ({db.run_sync(used_numbers.load)} entrées)."
+)
+
+
+class QuickSMSBot(commands.Bot):
+    async def close(self):
+        # Arrêt propre : on ferme la connexion Discord, les sessions HTTP partagées
+        # puis la connexion SQLite
+        await super().close()
+        await sms_router.close()
+        await hoodpay_api.close()
+        await login_code_watcher.close()
+        await stock_sweeper.close()
+        await telethon_pool.close()
+        telethon_governor.close()
+        db.close()
+
+
+bot = QuickSMSBot(command_prefix="!", intents=discord.Intents.all())
+sms_router = ProviderRouter(load_sms_providers())
+sms_poller = ActivationPoller(sms_router)
+cancel_queue = CancelQueue(sms_router)
+number_acquirer = NumberAcquirer(cancel_queue)
 hoodpay_api = HoodpayClient()
 
 
@@ -614,8 +3027,19 @@ async def on_ready():
     if not daily_stats_task.is_running():
         daily_stats_task.start()
 
-    # Démarrage du serveur Webhook
-    if HOODPAY_API_KEY:
+    # Reprise des annulations restées en file avant le redémarrage
+    cancel_queue.start()
+    # Ménage des clients Telethon inactifs
+    telethon_pool.start()
+    # Revérification du stock Telegram en tâche de fond
+    stock_sweeper.start()
+
+    # Préchargement des grilles de prix (menus instantanés dès le démarrage)
+    for country_id in COUNTRIES.values():
+        sms_router.refresh_in_background(country_id)
+
+    # Démarrage du serveur Webhook (paiements Hoodpay et/ou SMS en push)
+    if HOODPAY_API_KEY or SMS_PUSH_ENABLED:
         await start_webhook_server()
 
     # Setup Dashboard sur tous les serveurs
@@ -624,20 +3048,18 @@ async def on_ready():
 
     # REPRISE DES COMMANDES EN COURS (Après redémarrage)
     print("🔄 Recherche des commandes en attente...")
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT order_id, discord_id, price, service, status FROM orders WHERE status='PENDING'"
+    pending_orders = await db.fetchall(
+        "SELECT order_id, discord_id, price, service, status, provider FROM orders WHERE status='PENDING'"
     )
-    pending_orders = cursor.fetchall()
-    conn.close()
 
     count = 0
-    for order_id, user_id, price, service_name, status in pending_orders:
+    for order_id, user_id, price, service_name, status, provider in pending_orders:
         try:
             # DEBUG: Identifier la ligne qui plante
             # print(f"DEBUG REPRISE {order_id} - Step 1: Create View")
-            view = OrderView(order_id, price, user_id, original_interaction=None)
+            view = OrderView(
+                order_id, price, user_id, original_interaction=None, provider=provider
+            )
 
             # print(f"DEBUG REPRISE {order_id} - Step 2: Add View")
             bot.add_view(view)
@@ -671,36 +3093,43 @@ async def on_guild_join(guild):
     await setup_dashboard(guild)
 
 
+def _sales_since(conn, since_ts):
+    """
+    (commandes, ventes, coût net) depuis since_ts : lignes brutes de orders
+    pour l'heure entamée, agrégats horaires pour les heures pleines.
+    """
+    first_hour = -(-since_ts // 3600) * 3600
+    count, sales, cost = conn.execute(
+        "SELECT SUM(orders), SUM(sales), SUM(cost) FROM sales_hourly WHERE hour_ts >= ?",
+        (first_hour,),
+    ).fetchone()
+    count, sales, cost = count or 0, sales or 0.0, cost or 0.0
+    for service, price, raw_cost in conn.execute(
+        "SELECT service, price, cost FROM orders WHERE status='COMPLETED' AND created_ts >= ? AND created_ts < ?",
+        (since_ts, first_hour),
+    ):
+        count += 1
+        sales += price or 0.0
+        cost += net_cost(service, raw_cost)
+    return count, sales, cost
+
+
 @tasks.loop(time=time(hour=10, minute=0))
 async def daily_stats_task():
-    limit_date = (datetime.now() - timedelta(hours=24)).strftime("%Y-%m-%d %H:%M:%S")
+    # 24h exactes : 23 heures pleines agrégées + l'heure entamée en lignes brutes
+    limit_ts = to_ts(datetime.now() - timedelta(hours=24))
 
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT order_id, price, cost FROM orders WHERE status='COMPLETED' AND created_at >= ?",
-        (limit_date,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    count, total_sales, total_cost = await db.run(_sales_since, limit_ts)
 
-    if not rows:
+    if not count:
         return  # Pas de commande, pas de stats
 
-    total_sales = 0.0
-    total_cost = 0.0
-
-    for _, price, cost in rows:
-        total_sales += price
-        if cost:
-            total_cost += cost * 1.3 * 0.9
-
     profit = total_sales - total_cost
 
     embed = discord.Embed(title="📅 Rapport Quotidien (24h)", color=0x3498DB)
     embed.add_field(name="Ventes", value=f"{total_sales:.2f}€", inline=True)
     embed.add_field(name="Bénéfice Net", value=f"{profit:.2f}€", inline=True)
-    embed.set_footer(text=f"{len(rows)} commandes traitées.")
+    embed.set_footer(text=f"{count} commandes traitées.")
 
     for admin_id in ADMIN_IDS:
         try:
@@ -715,7 +3144,7 @@ async def daily_stats_task():
 async def deposit(
     interaction: discord.Interaction, amount: float, user: discord.Member
 ):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Vous n'avez pas la permission d'utiliser cette commande.",
             ephemeral=True,
@@ -723,13 +3152,14 @@ async def deposit(
 
     await interaction.response.defer(ephemeral=True)
 
-    update_balance(user.id, amount)
-    add_deposit_log(user.id, amount, f"Admin Deposit by {interaction.user.id}")
+    await update_balance(user.id, amount)
+    await add_deposit_log(user.id, amount, f"Admin Deposit by {interaction.user.id}")
     print(
         f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ADMIN LOG: {interaction.user} (ID: {interaction.user.id}) credited {amount}€ to {user} (ID: {user.id})"
     )
+    new_balance = await get_balance(user.id)
     await interaction.followup.send(
-        f"✅ Compte de {user.mention} crédité de {amount}€. Nouveau solde : {get_balance(user.id):.2f}€",
+        f"✅ Compte de {user.mention} crédité de {amount}€. Nouveau solde : {new_balance:.2f}€",
         ephemeral=True,
     )
 
@@ -739,7 +3169,7 @@ async def deposit(
 )
 async def recharge(interaction: discord.Interaction, amount: float):
     # --- DESACTIVATION TEMPORAIRE ---
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "⚠️ Cette commande est désactivée pour le moment. Veuillez contacter un administrateur pour recharger.",
             ephemeral=True,
@@ -782,7 +3212,7 @@ async def recharge(interaction: discord.Interaction, amount: float):
 
 @bot.tree.command(name="setmargin", description="Changer la marge (Admin uniquement)")
 async def setmargin(interaction: discord.Interaction, margin: float):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
@@ -792,7 +3222,7 @@ async def setmargin(interaction: discord.Interaction, margin: float):
             "⚠️ La marge doit être au moins de 1.0 (100%).", ephemeral=True
         )
 
-    update_margin_db(margin)
+    await update_margin_db(margin)
     await interaction.response.send_message(
         f"✅ Marge mise à jour : **x{margin}** ({int((margin-1)*100)}% de bénéfice)",
         ephemeral=True,
@@ -804,7 +3234,7 @@ async def setmargin(interaction: discord.Interaction, margin: float):
 )
 @app_commands.describe(month="Mois au format MM-YYYY (ex: 12-2024)")
 async def stats(interaction: discord.Interaction, month: str = None):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
@@ -826,35 +3256,23 @@ async def stats(interaction: discord.Interaction, month: str = None):
                     raise ValueError
             else:
                 raise ValueError
+            start_day, end_day = month_bounds(target_month_str)
         except:
             return await interaction.response.send_message(
                 "❌ Format de date invalide. Utilisez MM-YYYY (exemple: 10-2024).",
                 ephemeral=True,
             )
+    else:
+        start_day, end_day = month_bounds(target_month_str)
 
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-
-    # On récupère les commandes COMPLETED du mois cible
-    cursor.execute(
-        "SELECT price, cost, service FROM orders WHERE status='COMPLETED' AND created_at LIKE ?",
-        (f"{target_month_str}%",),
+    # Agrégats journaliers du mois (coût déjà converti en Euro net)
+    count, total_sales, total_cost = await db.fetchone(
+        "SELECT SUM(orders), SUM(sales), SUM(cost) FROM sales_daily WHERE day >= ? AND day < ?",
+        (start_day, end_day),
     )
-    rows = cursor.fetchall()
-    conn.close()
-
-    total_sales = 0.0
-    total_cost = 0.0
-
-    for price, cost, service in rows:
-        total_sales += price
-        if cost:
-            # Si c'est un compte Telegram stocké, le coût est déjà net en Euro
-            if service == "Telegram Account":
-                total_cost += cost
-            else:
-                # Sinon c'est un SMS (Prix brut API), on applique la formule de conversion
-                total_cost += cost * 1.3 * 0.9
+    count = count or 0
+    total_sales = total_sales or 0.0
+    total_cost = total_cost or 0.0
 
     profit = total_sales - total_cost
 
@@ -862,7 +3280,7 @@ async def stats(interaction: discord.Interaction, month: str = None):
     embed.add_field(name="Ventes Totales", value=f"{total_sales:.2f}€", inline=True)
     embed.add_field(name="Coût Estimé", value=f"{total_cost:.2f}€", inline=True)
     embed.add_field(name="Bénéfice Net", value=f"{profit:.2f}€", inline=False)
-    embed.set_footer(text=f"{len(rows)} commandes en {target_month_str}.")
+    embed.set_footer(text=f"{count} commandes en {target_month_str}.")
 
     view = StatsView(target_month_str)
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
@@ -883,53 +3301,27 @@ class StatsView(discord.ui.View):
     ):
         await interaction.response.defer(ephemeral=True)
 
-        conn = sqlite3.connect("database.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT price, cost, service, created_at FROM orders WHERE status='COMPLETED' AND created_at LIKE ? ORDER BY created_at ASC",
-            (f"{self.month_str}%",),
+        # Un jour = une ligne (somme des services), déjà trié par la clé primaire
+        start_day, end_day = month_bounds(self.month_str)
+        rows = await db.fetchall(
+            "SELECT day, SUM(orders), SUM(sales), SUM(cost) FROM sales_daily WHERE day >= ? AND day < ? GROUP BY day",
+            (start_day, end_day),
         )
-        rows = cursor.fetchall()
-        conn.close()
+        rows = [row for row in rows if row[1]]
 
         if not rows:
             return await interaction.followup.send(
                 "❌ Aucune commande trouvée pour ce mois.", ephemeral=True
             )
 
-        # Regroupement par jour
-        daily_stats = {}
-
-        for price, cost, service, created_at in rows:
-            # created_at format assumed to be "%Y-%m-%d %H:%M:%S"
-            try:
-                day_key = created_at.split(" ")[0]  # YYYY-MM-DD
-            except:
-                continue
-
-            if day_key not in daily_stats:
-                daily_stats[day_key] = {"sales": 0.0, "cost": 0.0, "count": 0}
-
-            daily_stats[day_key]["sales"] += price
-            daily_stats[day_key]["count"] += 1
-
-            if cost:
-                if service == "Telegram Account":
-                    daily_stats[day_key]["cost"] += cost
-                else:
-                    daily_stats[day_key]["cost"] += cost * 1.3 * 0.9
-
         # Génération du rapport
         lines = [f"**Détails journaliers pour {self.month_str}**"]
 
-        sorted_days = sorted(daily_stats.keys())
-
-        for day in sorted_days:
-            data = daily_stats[day]
-            profit = data["sales"] - data["cost"]
+        for day, count, sales, cost in rows:
+            profit = sales - cost
             day_num = day.split("-")[-1]
             lines.append(
-                f"`{day_num}` : Ventes **{data['sales']:.2f}€** | Bénéfice **{profit:.2f}€** ({data['count']} cmds)"
+                f"`{day_num}` : Ventes **{sales:.2f}€** | Bénéfice **{profit:.2f}€** ({count} cmds)"
             )
 
         full_text = "\n".join(lines)
@@ -963,7 +3355,7 @@ async def history(
     user: discord.User,
     filter: app_commands.Choice[str] = None,
 ):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
@@ -972,35 +3364,27 @@ async def history(
 
     filter_value = filter.value if filter else "all"
 
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-
     rows = []
     is_deposit = False
 
     if filter_value == "deposits":
         is_deposit = True
-        cursor.execute(
-            "SELECT amount, source, created_at FROM deposits WHERE discord_id=? ORDER BY created_at DESC LIMIT 20",
+        rows = await db.fetchall(
+            "SELECT amount, source, created_at FROM deposits WHERE discord_id=? ORDER BY created_ts DESC LIMIT 20",
             (user.id,),
         )
-        rows = cursor.fetchall()
     elif filter_value == "completed":
-        cursor.execute(
-            "SELECT order_id, phone, price, status, service, created_at FROM orders WHERE discord_id=? AND status='COMPLETED' ORDER BY created_at DESC LIMIT 20",
+        rows = await db.fetchall(
+            "SELECT order_id, phone, price, status, service, created_ts FROM orders WHERE discord_id=? AND status='COMPLETED' ORDER BY created_ts DESC LIMIT 20",
             (user.id,),
         )
-        rows = cursor.fetchall()
     else:  # all
-        cursor.execute(
-            "SELECT order_id, phone, price, status, service, created_at FROM orders WHERE discord_id=? ORDER BY created_at DESC LIMIT 20",
+        rows = await db.fetchall(
+            "SELECT order_id, phone, price, status, service, created_ts FROM orders WHERE discord_id=? ORDER BY created_ts DESC LIMIT 20",
             (user.id,),
         )
-        rows = cursor.fetchall()
-
-    conn.close()
 
-    user_balance = get_balance(user.id)
+    user_balance = await get_balance(user.id)
 
     if not rows:
         return await interaction.followup.send(
@@ -1022,18 +3406,10 @@ async def history(
                 inline=False,
             )
     else:
-        for order_id, phone, price, status, service, created_at in rows:
-            # On essaie de parser la date pour faire joli
-            date_str = created_at
-            try:
-                dt = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S.%f")
-                date_str = dt.strftime("%d/%m %H:%M")
-            except:
-                try:
-                    dt = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
-                    date_str = dt.strftime("%d/%m %H:%M")
-                except:
-                    pass  # On garde le format brut si échec
+        for order_id, phone, price, status, service, created_ts in rows:
+            date_str = "?"
+            if created_ts is not None:
+                date_str = datetime.fromtimestamp(created_ts).strftime("%d/%m %H:%M")
 
             status_emoji = (
                 "✅"
@@ -1054,12 +3430,12 @@ async def history(
     name="addadmin", description="Ajouter un administrateur (Admin uniquement)"
 )
 async def addadmin(interaction: discord.Interaction, user: discord.User):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
 
-    add_new_admin_db(user.id)
+    await add_new_admin_db(user.id)
     # On met à jour la liste en mémoire pour éviter d'attendre le redémarrage
     if user.id not in ADMIN_IDS:
         ADMIN_IDS.append(user.id)
@@ -1073,14 +3449,12 @@ async def addadmin(interaction: discord.Interaction, user: discord.User):
     name="listadmins", description="Liste tous les administrateurs (Admin uniquement)"
 )
 async def listadmins(interaction: discord.Interaction):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
 
-    conn = sqlite3.connect("database.db")
-    rows = conn.execute("SELECT discord_id, added_at FROM admins").fetchall()
-    conn.close()
+    rows = await db.fetchall("SELECT discord_id, added_at FROM admins")
 
     description = ""
     for discord_id, added_at in rows:
@@ -1110,7 +3484,7 @@ async def listadmins(interaction: discord.Interaction):
     name="removeadmin", description="Supprimer un administrateur (Admin uniquement)"
 )
 async def removeadmin(interaction: discord.Interaction, user: discord.User):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
@@ -1120,7 +3494,7 @@ async def removeadmin(interaction: discord.Interaction, user: discord.User):
             "❌ Vous ne pouvez pas vous supprimer vous-même.", ephemeral=True
         )
 
-    remove_admin_db(user.id)
+    await remove_admin_db(user.id)
     if user.id in ADMIN_IDS:
         ADMIN_IDS.remove(user.id)
 
@@ -1129,6 +3503,156 @@ async def removeadmin(interaction: discord.Interaction, user: discord.User):
     )
 
 
+# Limites Discord des embeds (au-delà : erreur 400 à l'envoi)
+EMBED_FIELD_MAX = 1024
+EMBED_TOTAL_MAX = 6000
+EMBED_MAX_FIELDS = 25
+
+
+def field_value(lines, empty):
+    """Lignes d'un champ d'embed, tronquées à EMBED_FIELD_MAX caractères."""
+    value = "\n".join(lines)
+    if not value:
+        return empty
+    if len(value) <= EMBED_FIELD_MAX:
+        return value
+    kept = []
+    size = 0
+    for line in lines:
+        size += len(line) + 1
+        if size > EMBED_FIELD_MAX - 30:  # Place pour "… +N lignes"
+            break
+        kept.append(line)
+    if not kept:
+        return value[: EMBED_FIELD_MAX - 1] + "…"
+    return "\n".join(kept) + f"\n… +{len(lines) - len(kept)} lignes"
+
+
+@bot.tree.command(
+    name="monitor", description="État des tâches de fond du bot (Admin uniquement)"
+)
+async def monitor(interaction: discord.Interaction):
+    if not await is_user_admin(interaction.user.id):
+        return await interaction.response.send_message(
+            "❌ Accès refusé.", ephemeral=True
+        )
+
+    phases = sms_poller.phase_counts()
+    pending_cancels = await cancel_queue.outstanding()
+    embed = discord.Embed(title="🩺 Monitoring", color=0x1ABC9C)
+    embed.add_field(
+        name="📡 Suivi SMS",
+        value=(
+            f"**{len(sms_poller.watchers)}** activations suivies "
+            f"(dense {phases['dense']} | moyen {phases['medium']} | espacé {phases['sparse']})\n"
+            f"{sms_poller.ticks} ticks | {sms_poller.provider_calls} appels API\n"
+            f"Dernier tick : {sms_poller.last_tick_duration * 1000:.0f} ms\n"
+            f"Mode push : {'✅' if SMS_PUSH_ENABLED else '❌'} ({sms_poller.pushes} SMS reçus)\n"
+            f"Annulations en attente : **{pending_cancels}** "
+            f"({cancel_queue.cancelled} confirmées, {cancel_queue.given_up} abandonnées)"
+        ),
+        inline=False,
+    )
+
+    # Requêtes SQL les plus coûteuses (temps cumulé)
+    lines = []
+    for sql, count, avg_ms, max_ms in db.report(limit=3):
+        lines.append(
+            f"`{sql[:60]}…` x{count} | moy {avg_ms:.1f} ms | max {max_ms:.0f} ms"
+        )
+    lines.append(
+        f"Doublons : {used_numbers.skipped}/{used_numbers.checks} vérifs sans requête"
+    )
+    embed.add_field(
+        name="🔀 Routage fournisseurs",
+        value=(
+            " | ".join(f"{name} : {count}" for name, count in sms_router.routed.items())
+            + f"\nBascules : {sms_router.failovers}"
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="🎯 Acquisition de numéros",
+        value=field_value(
+            [
+                f"{service} ({country}, {provider}) : {count} achats | doublons {dup_rate:.0%} | "
+                f"{wasted} gaspillés | {avg_time:.1f} s"
+                for provider, service, country, count, dup_rate, wasted, avg_time in number_acquirer.report()
+            ],
+            "Aucun achat.",
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="🚦 Régulateur Telethon",
+        value=telethon_governor.status_text(),
+        inline=False,
+    )
+    embed.add_field(
+        name="📲 Clients Telethon",
+        value=(
+            f"Connectés : {len(telethon_pool.entries)}/{telethon_pool.max_clients} | "
+            f"réutilisés {telethon_pool.hits} | nouveaux {telethon_pool.misses} | "
+            f"reconnexions {telethon_pool.reconnects} | fermés {telethon_pool.evictions}\n"
+            f"Écoutes de codes : {len(login_code_watcher.watches)}/{login_code_watcher.max_sessions} | "
+            f"codes envoyés {login_code_watcher.pushed} | refusées {login_code_watcher.refused} | "
+            f"réabonnements {login_code_watcher.resubscribed}\n"
+            f"{stock_sweeper.status_text()}"
+        ),
+        inline=False,
+    )
+    embed.add_field(
+        name="🗄️ Base de données",
+        value=field_value(lines, "Aucune requête."),
+        inline=False,
+    )
+
+    # Un champ par fournisseur (débit API puis santé par action) ; au-delà de
+    # la taille d'un embed, la suite part dans un second message
+    embeds = [embed]
+    for provider in sms_router.providers.values():
+        provider_lines = [
+            f"{name} : {calls} appels | attente moy {avg_ms:.0f} ms (max {max_ms:.0f}) | "
+            f"file {queued} | refusés {shed}"
+            for name, calls, shed, avg_ms, max_ms, queued in provider.limiter.report()
+        ] + [
+            f"`{action}` : {breaker.state} | erreurs {breaker.error_rate():.0%} | "
+            f"p95 {(breaker.p95() or 0) * 1000:.0f} ms | doublées {breaker.hedges} ({breaker.hedge_wins} gagnées)"
+            for action, breaker in provider.breakers.items()
+        ]
+        name = f"🔌 Fournisseur {provider.name}"
+        value = field_value(provider_lines, "Aucun appel.")
+        page = embeds[-1]
+        if (
+            len(page) + len(name) + len(value) > EMBED_TOTAL_MAX
+            or len(page.fields) >= EMBED_MAX_FIELDS
+        ):
+            page = discord.Embed(title="🩺 Monitoring (suite)", color=0x1ABC9C)
+            embeds.append(page)
+        page.add_field(name=name, value=value, inline=False)
+
+    await interaction.response.send_message(embed=embeds[0], ephemeral=True)
+    for page in embeds[1:]:
+        await interaction.followup.send(embed=page, ephemeral=True)
+
+
+@bot.tree.command(
+    name="rebuildstats",
+    description="Recalculer les agrégats de ventes depuis les commandes (Admin uniquement)",
+)
+async def rebuildstats(interaction: discord.Interaction):
+    if not await is_user_admin(interaction.user.id):
+        return await interaction.response.send_message(
+            "❌ Accès refusé.", ephemeral=True
+        )
+
+    await interaction.response.defer(ephemeral=True)
+    count = await db.run(rebuild_rollups)
+    await interaction.followup.send(
+        f"✅ Agrégats recalculés ({count} ventes).", ephemeral=True
+    )
+
+
 # --- SYSTEME DE REPARATION DE SESSION (MIGRATION IP) ---
 
 
@@ -1141,6 +3665,15 @@ class FixSessionView(discord.ui.View):
         self.code = None
         self.password = None
 
+    async def sign_in(self, *args, **kwargs):
+        # Code à usage unique : pas de nouvel essai après un FloodWait
+        return await telethon_governor.run(
+            lambda: self.client.sign_in(*args, **kwargs),
+            priority=PRIORITY_ADMIN,
+            dc_id=self.client.session.dc_id,
+            retries=0,
+        )
+
     @discord.ui.button(label="Entrer Code", style=discord.ButtonStyle.green)
     async def enter_code(
         self, interaction: discord.Interaction, button: discord.ui.Button
@@ -1157,10 +3690,7 @@ class FixSessionView(discord.ui.View):
     async def delete_account(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
-        conn = sqlite3.connect("database.db")
-        conn.execute("DELETE FROM telegram_accounts WHERE id=?", (self.account_id,))
-        conn.commit()
-        conn.close()
+        await db.execute("DELETE FROM telegram_accounts WHERE id=?", (self.account_id,))
         await interaction.response.send_message(
             f"🗑️ Compte {self.phone} supprimé de la base.", ephemeral=True
         )
@@ -1182,18 +3712,12 @@ class CodeModal(discord.ui.Modal, title="Code de Connexion"):
 
         try:
             # On tente le sign-in avec le code
-            await self.view_ref.client.sign_in(self.view_ref.phone, code)
+            await self.view_ref.sign_in(self.view_ref.phone, code)
 
             # Si ça passe, on sauvegarde
             new_session = StringSession.save(self.view_ref.client.session)
 
-            conn = sqlite3.connect("database.db")
-            conn.execute(
-                "UPDATE telegram_accounts SET session_string=? WHERE id=?",
-                (new_session, self.view_ref.account_id),
-            )
-            conn.commit()
-            conn.close()
+            await save_repaired_session(self.view_ref.account_id, new_session)
 
             await interaction.followup.send(
                 f"✅ Session réparée et sauvegardée pour {self.view_ref.phone} !"
@@ -1222,18 +3746,12 @@ class PasswordModal(discord.ui.Modal, title="Mot de Passe 2FA"):
 
         try:
             # On tente le sign-in avec le mot de passe
-            await self.view_ref.client.sign_in(password=pwd)
+            await self.view_ref.sign_in(password=pwd)
 
             # Si ça passe
             new_session = StringSession.save(self.view_ref.client.session)
 
-            conn = sqlite3.connect("database.db")
-            conn.execute(
-                "UPDATE telegram_accounts SET session_string=? WHERE id=?",
-                (new_session, self.view_ref.account_id),
-            )
-            conn.commit()
-            conn.close()
+            await save_repaired_session(self.view_ref.account_id, new_session)
 
             await interaction.followup.send(
                 f"✅ Session réparée (2FA) et sauvegardée pour {self.view_ref.phone} !"
@@ -1248,73 +3766,94 @@ class PasswordModal(discord.ui.Modal, title="Mot de Passe 2FA"):
     name="fix_stock", description="Réparer les sessions invalides sur le VPS"
 )
 async def fix_stock(interaction: discord.Interaction):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
 
     await interaction.response.defer(ephemeral=True)
 
-    conn = sqlite3.connect("database.db")
-    accounts = conn.execute(
+    if not TG_API_ID or not TG_API_HASH:
+        return await interaction.followup.send("❌ Config TELEGRAM_API_ID manquante.")
+
+    accounts = await db.fetchall(
         "SELECT id, phone, session_string FROM telegram_accounts WHERE status='AVAILABLE'"
-    ).fetchall()
-    conn.close()
+    )
 
-    await interaction.followup.send(
-        f"🔄 Analyse de {len(accounts)} comptes en cours... Cela peut prendre du temps."
+    # Un seul message de progression, mis à jour pendant le scan
+    checker = StockHealthChecker()
+    progress = await interaction.followup.send(
+        checker.progress_text(), ephemeral=True, wait=True
     )
+    scan = asyncio.create_task(checker.run(accounts))
+    # Les comptes invalides sont réparés un par un, sans bloquer le scan
+    repairs = asyncio.create_task(repair_invalid_sessions(interaction, checker, scan))
 
-    issues_found = 0
+    while not scan.done():
+        await asyncio.wait({scan}, timeout=TG_HEALTH_PROGRESS_INTERVAL)
+        try:
+            await progress.edit(content=checker.progress_text())
+        except discord.HTTPException as e:
+            print(f"Erreur mise à jour progression /fix_stock: {e}")
 
-    for acc_id, phone, session_str in accounts:
-        if not TG_API_ID or not TG_API_HASH:
-            await interaction.followup.send("❌ Config TELEGRAM_API_ID manquante.")
-            return
+    try:
+        await scan
+    except Exception as e:
+        print(f"Erreur vérification du stock: {e}")
+    try:
+        await progress.edit(content=checker.progress_text(finished=True))
+    except discord.HTTPException:
+        pass
+
+    if checker.counts[HEALTH_INVALID] == 0:
+        await interaction.followup.send(
+            "✅ Tous les comptes du stock semblent actifs et valides !", ephemeral=True
+        )
+    await repairs
 
-        client = TelegramClient(StringSession(session_str), int(TG_API_ID), TG_API_HASH)
 
+async def repair_invalid_sessions(interaction, checker, scan):
+    """Envoie le code de chaque compte invalide et attend l'admin (un à la fois)."""
+    while not (scan.done() and checker.repairs.empty()):
         try:
+            acc_id, phone, session_str = await asyncio.wait_for(
+                checker.repairs.get(), timeout=TG_HEALTH_PROGRESS_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            continue
+
+        client = TelegramClient(StringSession(session_str), int(TG_API_ID), TG_API_HASH)
+
+        async def send_code():
             await client.connect()
-            if not await client.is_user_authorized():
-                # Session invalide -> Besoin de réparation
-                issues_found += 1
+            # On déclenche l'envoi du code
+            await client.send_code_request(phone)
 
-                # On déclenche l'envoi du code
-                try:
-                    await client.send_code_request(phone)
-                    msg = f"⚠️ **Compte {phone}** : Session invalide. Code envoyé (SMS/Mail)."
-                    view = FixSessionView(client, phone, acc_id)
-                    await interaction.followup.send(msg, view=view, ephemeral=True)
-
-                    # On attend que l'admin interagisse avant de passer au suivant (pour éviter de tout spammer)
-                    # Hack : on attend que la vue soit stoppée
-                    await view.wait()
-
-                except Exception as e:
-                    await interaction.followup.send(
-                        f"❌ Erreur critique sur {phone} (impossible d'envoyer le code) : {e}",
-                        ephemeral=True,
-                    )
-                    await client.disconnect()
-            else:
-                # Session valide, on déconnecte juste
-                await client.disconnect()
+        try:
+            # Pas de nouvel essai après un FloodWait : un seul code envoyé
+            await telethon_governor.run(
+                send_code,
+                priority=PRIORITY_ADMIN,
+                dc_id=session_dc(session_str),
+                retries=0,
+            )
+            msg = f"⚠️ **Compte {phone}** : Session invalide. Code envoyé (SMS/Mail)."
+            view = FixSessionView(client, phone, acc_id)
+            await interaction.followup.send(msg, view=view, ephemeral=True)
 
+            # On attend que l'admin interagisse avant de passer au suivant (pour éviter de tout spammer)
+            await view.wait()
         except Exception as e:
-            print(f"Erreur check {phone}: {e}")
+            await interaction.followup.send(
+                f"❌ Erreur critique sur {phone} (impossible d'envoyer le code) : {e}",
+                ephemeral=True,
+            )
+        finally:
             try:
                 await client.disconnect()
-            except:
+            except Exception:
                 pass
 
-    if issues_found == 0:
-        await interaction.followup.send(
-            "✅ Tous les comptes du stock semblent actifs et valides !", ephemeral=True
-        )
-    else:
-        await interaction.followup.send("🏁 Vérification terminée.", ephemeral=True)
-
 
 @bot.tree.command(
     name="balance", description="Voir mon solde ou celui d'un utilisateur (Admin)"
@@ -1323,12 +3862,14 @@ async def balance(interaction: discord.Interaction, user: discord.User = None):
     target_user = user if user else interaction.user
 
     # Si on demande le solde d'un autre et qu'on n'est PAS admin -> Refusé
-    if target_user.id != interaction.user.id and not is_user_admin(interaction.user.id):
+    if target_user.id != interaction.user.id and not await is_user_admin(
+        interaction.user.id
+    ):
         return await interaction.response.send_message(
             "❌ Vous ne pouvez voir que votre propre solde.", ephemeral=True
         )
 
-    user_balance = get_balance(target_user.id)
+    user_balance = await get_balance(target_user.id)
 
     msg_prefix = (
         "💰 **Votre solde"
@@ -1365,24 +3906,24 @@ async def services(
         selected_country_name = country.name
 
     embed = discord.Embed(title="📱 Services Disponibles", color=0x00FF00)
-    user_balance = get_balance(interaction.user.id)
+    user_balance = await get_balance(interaction.user.id)
     description = f"**Votre solde : {user_balance:.2f}€**\n\n**Pays : {selected_country_name}**\n\n"
 
     country_id = COUNTRIES[selected_country_code]
 
-    # Optimisation : On lance toutes les requêtes en parallèle et non une par une
-    # Cela évite le timeout de Discord si l'API est lente
+    # Les prix viennent du catalogue : un seul getPrices pour tout le pays,
+    # partagé par toutes ces lectures (et servi depuis le cache ensuite)
     tasks = []
     service_list = []
     for name, code in SERVICES.items():
         service_list.append(name)
-        tasks.append(sms_api.get_price(code, country_id))
+        tasks.append(sms_router.get_price(code, country_id))
 
     results = await asyncio.gather(*tasks)
     for i, res in enumerate(results):
         svc_name = service_list[i].capitalize()
         if res is not None:
-            final_price = calculate_selling_price(res)
+            final_price = await calculate_selling_price(res)
             # Petit embellissement
             emoji = "📱"
             if "whatsapp" in svc_name.lower():
@@ -1414,7 +3955,8 @@ async def execute_pack_logic(interaction: discord.Interaction):
 
     # On lance les requêtes de prix en parallèle
     price1_brut, price2_brut = await asyncio.gather(
-        sms_api.get_price(svc1_code, ctry1_id), sms_api.get_price(svc2_code, ctry2_id)
+        sms_router.get_price(svc1_code, ctry1_id),
+        sms_router.get_price(svc2_code, ctry2_id),
     )
 
     if price1_brut is None or price2_brut is None:
@@ -1422,8 +3964,8 @@ async def execute_pack_logic(interaction: discord.Interaction):
             "⚠️ Un des services du pack est indisponible pour le moment.", ephemeral=True
         )
 
-    price1 = calculate_selling_price(price1_brut)
-    price2 = calculate_selling_price(price2_brut)
+    price1 = await calculate_selling_price(price1_brut)
+    price2 = await calculate_selling_price(price2_brut)
     total_price = price1 + price2
 
     # On envoie un DM de confirmation
@@ -1561,50 +4103,41 @@ async def execute_buy_logic(
     service_name = service_key.capitalize()
     country_name = country_key.capitalize()
 
-    # 1. Vérif Prix et Stock
-    cost_price = await sms_api.get_price(service_code, country_id)
+    # 1. Vérif Prix et Stock (prix le plus bas parmi les fournisseurs)
+    if sms_router.unavailable():
+        return await interaction.followup.send(
+            "⚠️ Fournisseur SMS indisponible pour le moment, réessayez dans quelques minutes.",
+            ephemeral=True,
+        )
+    cost_price = await sms_router.get_price(service_code, country_id)
     if cost_price is None:
         return await interaction.followup.send(
             f"⚠️ Stock épuisé ou erreur prix pour **{service_name}** ({country_name}). Réessayez plus tard.",
             ephemeral=True,
         )
 
-    price = calculate_selling_price(cost_price)
+    price = await calculate_selling_price(cost_price)
 
-    # 2. Vérif Solde
-    balance = get_balance(user_id)
+    # 2. Vérif Solde (indicative : le débit final est conditionnel)
+    balance = await get_balance(user_id)
     if balance < price:
         return await interaction.followup.send(
             f"❌ **Solde insuffisant.**\nPrix : {price:.2f}€\nVotre solde : {balance:.2f}€",
             ephemeral=True,
         )
 
-    # 3. Achat (Boucle de tentative)
-    max_retries = 5
-    order = None
-
-    for i in range(max_retries):
-        temp_order = await sms_api.buy_number(
-            service_code, country_id, user_info=f"User {user_id}"
-        )
-
-        if temp_order["success"]:
-            # Vérif doublons
-            if is_number_used(temp_order["phone"], service_name):
-                print(f"DOUBLON REJETÉ: {temp_order['phone']}")
-                await sms_api.cancel_order(
-                    temp_order["id"], user_info=f"User {user_id}"
-                )
-                await asyncio.sleep(1)
-                continue
-            else:
-                order = temp_order
-                break
-        else:
-            # Si erreur NO_NUMBERS, on peut arrêter
-            if temp_order.get("code") == "NO_NUMBERS":
-                break
-            await asyncio.sleep(0.5)
+    # 3. Achat : meilleur fournisseur d'abord, bascule sur le suivant si rupture.
+    # Seuls les fournisseurs dont le coût reste sous le prix de vente sont essayés.
+    provider, cost_price, order = await sms_router.acquire(
+        number_acquirer,
+        service_code,
+        country_id,
+        service_name,
+        country_key,
+        user_info=f"User {user_id}",
+        parallelism=number_acquirer.parallelism_for(service_key, country_key),
+        max_cost=price / SMS_COST_RATE,
+    )
 
     if not order or not order["success"]:
         error_msg = order["error"] if order and "error" in order else "Erreur inconnue"
@@ -1613,27 +4146,48 @@ async def execute_buy_logic(
             ephemeral=True,
         )
 
-    # 4. Débit et Enregistrement
-    update_balance(user_id, -price)
+    # 4. La grille a pu être rafraîchie en fond pendant l'achat : si le coût ne
+    # tient plus dans le prix annoncé, on libère le numéro et le client relance
+    # l'achat au nouveau prix. Jamais de débit au-delà de price.
+    latest_cost = sms_router.cached_cost(provider, service_code, country_id)
+    if latest_cost is not None and latest_cost != cost_price:
+        print(
+            f"💱 Prix {provider.name} {service_name}/{country_key} : "
+            f"{cost_price} -> {latest_cost}"
+        )
+        if latest_cost * SMS_COST_RATE > price:
+            await cancel_queue.enqueue(
+                order["id"], f"User {user_id} (prix)", provider=provider.name
+            )
+            return await interaction.followup.send(
+                f"⚠️ Le prix de **{service_name}** ({country_name}) vient d'augmenter. "
+                "Aucun débit n'a été fait : relancez l'achat pour voir le nouveau prix.",
+                ephemeral=True,
+            )
+        cost_price = latest_cost
 
-    conn = sqlite3.connect("database.db")
-    conn.execute(
-        "INSERT INTO orders (order_id, discord_id, phone, price, status, created_at, service, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            order["id"],
-            user_id,
-            order["phone"],
-            price,
-            "PENDING",
-            str(datetime.now()),
-            service_name,
-            cost_price,
-        ),
+    # 5. Débit et Enregistrement (une seule transaction)
+    result, new_balance = await purchase_sms_order(
+        user_id,
+        order["id"],
+        order["phone"],
+        price,
+        service_name,
+        cost_price,
+        country_id,
+        provider.name,
     )
-    conn.commit()
-    conn.close()
+    if result != PURCHASE_OK:
+        # Solde dépensé entre-temps (autre achat simultané) : on libère le numéro
+        await cancel_queue.enqueue(
+            order["id"], f"User {user_id} (solde)", provider=provider.name
+        )
+        return await interaction.followup.send(
+            f"❌ **Solde insuffisant.**\nPrix : {price:.2f}€\nVotre solde : {new_balance:.2f}€",
+            ephemeral=True,
+        )
 
-    # 5. Envoi DM
+    # 6. Envoi DM
     try:
         dm_channel = await interaction.user.create_dm()
         view = OrderView(
@@ -1646,8 +4200,8 @@ async def execute_buy_logic(
             service_key=service_key,
             country_key=country_key,
             next_steps=next_steps,
+            provider=provider.name,
         )
-        new_balance = get_balance(user_id)
 
         # Formatage du numéro pour le Canada (Retirer le 1 au début)
         display_phone = order["phone"]
@@ -1680,109 +4234,112 @@ async def execute_buy_logic(
 
 # --- TÂCHE DE FOND : VÉRIFICATION DU SMS ---
 async def check_sms_loop(order_id, channel, view, dm_message):
-    attempts = 0
     received_codes = set()  # Pour éviter de renvoyer le même code en boucle
+    deadline = monotonic() + SMS_ORDER_TIMEOUT
+
+    # Les statuts sont récupérés par le poller central, on ne fait que les consommer.
+    # La cadence dépend de l'âge de la commande et du délai habituel du service/pays.
+    service_name, country_id, created_ts, provider_name = await get_order_meta(order_id)
+    provider = sms_router.get(provider_name)
+    age = 0.0
+    if created_ts:
+        age = max(0.0, datetime.now().timestamp() - created_ts)
+    statuses = await sms_poller.track(
+        order_id, service_name, country_id, age, provider=provider.name
+    )
+    try:
+        while monotonic() < deadline:
+            if view.is_cancelled or view.process_finished:
+                break
 
-    while attempts < 300:  # 300 * 5s = 25 minutes max
-        if view.is_cancelled or view.process_finished:
-            break
-
-        status_text = await sms_api.get_status(order_id)
-
-        # CAS 1 : CODE REÇU
-        if "STATUS_OK" in status_text:
-            code = status_text.split(":")[1].strip()
-
-            if code not in received_codes:
-                received_codes.add(code)
-                print(
-                    f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] CODE RECU: {code}"
+            # Attente bornée pour revérifier régulièrement l'état de la vue
+            try:
+                status_text = await asyncio.wait_for(
+                    statuses.get(), timeout=SMS_VIEW_CHECK_INTERVAL
                 )
+            except asyncio.TimeoutError:
+                continue
 
-                # Mise à jour de la vue pour activer les boutons suite au code
-                view.code_received = True
-
-                # On active les boutons Finish et Retry, on désactive Cancel
-                for child in view.children:
-                    if child.custom_id:
-                        if child.custom_id.startswith(
-                            "btn_finish"
-                        ) or child.custom_id.startswith("btn_retry"):
-                            child.disabled = False
-                        if child.custom_id.startswith("btn_cancel"):
-                            child.disabled = True
-
-                # On envoie le code
-                await channel.send(
-                    f"📩 **CODE REÇU :** `{code}`\n*Si ce code ne fonctionne pas, cliquez sur 'Demander un autre code'.*"
-                )
+            # CAS 1 : CODE REÇU
+            if "STATUS_OK" in status_text:
+                code = status_text.split(":")[1].strip()
+
+                if code not in received_codes:
+                    if not received_codes:
+                        # 1er code : on mémorise le délai pour affiner la cadence
+                        delay = sms_poller.code_received(order_id)
+                        if delay is not None:
+                            await save_code_delay(order_id, delay)
+                    received_codes.add(code)
+                    print(
+                        f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] CODE RECU: {code}"
+                    )
 
-                # On met à jour le message original (DM) avec les boutons activés
-                if dm_message:
-                    try:
-                        await dm_message.edit(view=view)
-                    except Exception as e:
-                        print(f"Erreur update view DM: {e}")
+                    # Mise à jour de la vue pour activer les boutons suite au code
+                    view.code_received = True
+
+                    # On active les boutons Finish et Retry, on désactive Cancel
+                    for child in view.children:
+                        if child.custom_id:
+                            if child.custom_id.startswith(
+                                "btn_finish"
+                            ) or child.custom_id.startswith("btn_retry"):
+                                child.disabled = False
+                            if child.custom_id.startswith("btn_cancel"):
+                                child.disabled = True
+
+                    # On envoie le code
+                    await channel.send(
+                        f"📩 **CODE REÇU :** `{code}`\n*Si ce code ne fonctionne pas, cliquez sur 'Demander un autre code'.*"
+                    )
 
-                # On réinitialise le compteur pour laisser du temps si on veut un autre code
-                attempts = 0
+                    # On met à jour le message original (DM) avec les boutons activés
+                    if dm_message:
+                        try:
+                            await dm_message.edit(view=view)
+                        except Exception as e:
+                            print(f"Erreur update view DM: {e}")
 
-            # On ne sort PAS de la boucle, on attend que l'utilisateur choisisse "Terminer" ou "Autre code"
+                    # On repousse la deadline pour laisser du temps si on veut un autre code
+                    deadline = monotonic() + SMS_ORDER_TIMEOUT
 
-        # CAS 2 : ANNULÉ PAR LE FOURNISSEUR
-        elif "STATUS_CANCEL" in status_text:
-            await refund_user_channel(view.user_id, view.price, order_id, channel)
-            return
+                # On ne sort PAS de la boucle, on attend que l'utilisateur choisisse "Terminer" ou "Autre code"
 
-        attempts += 1
-        await asyncio.sleep(5)  # Pause de 5 secondes
+            # CAS 2 : ANNULÉ PAR LE FOURNISSEUR
+            elif "STATUS_CANCEL" in status_text:
+                await refund_user_channel(view.user_id, view.price, order_id, channel)
+                return
+    finally:
+        sms_poller.untrack(order_id)
 
     # Si on sort de la boucle sans code (Timeout) ou si fini
     if view.process_finished:
         # Commande validée par l'utilisateur
-        conn = sqlite3.connect("database.db")
-        conn.execute(
-            "UPDATE orders SET status='COMPLETED' WHERE order_id=?", (order_id,)
-        )
-        conn.commit()
-        conn.close()
+        await set_order_status(order_id, "COMPLETED")
 
     elif not view.is_cancelled and not view.process_finished:
         if not received_codes:
-            # Timeout sans AUCUN code reçu -> On annule et rembourse
-            await sms_api.cancel_order(order_id, user_info=f"User {view.user_id}")
+            # Timeout sans AUCUN code reçu -> On annule (en file) et rembourse
+            await cancel_queue.enqueue(order_id, f"User {view.user_id} (timeout)")
             await refund_user_channel(
                 view.user_id, view.price, order_id, channel, reason="Temps écoulé"
             )
         else:
             # Timeout MAIS on a eu des codes -> On considère "Terminé" (le client a oublié de valider)
-            await sms_api.request("setStatus", {"id": order_id, "status": "6"})
-            conn = sqlite3.connect("database.db")
-            conn.execute(
-                "UPDATE orders SET status='COMPLETED' WHERE order_id=?", (order_id,)
-            )
-            conn.commit()
-            conn.close()
+            await provider.complete_order(order_id)
+            await set_order_status(order_id, "COMPLETED")
             await channel.send("ℹ️ Temps écoulé. Commande validée automatiquement.")
 
 
 async def refund_user_channel(user_id, amount, order_id, channel, reason="Annulation"):
-    update_balance(user_id, amount)
-    conn = sqlite3.connect("database.db")
-    conn.execute("UPDATE orders SET status='REFUNDED' WHERE order_id=?", (order_id,))
-    conn.commit()
-    conn.close()
+    await refund_order(user_id, amount, order_id)
     await channel.send(
         f"info : Commande annulée ({reason}). Vous avez été remboursé de {amount}€."
     )
 
 
 async def refund_user(user_id, amount, order_id, interaction, reason="Annulation"):
-    update_balance(user_id, amount)
-    conn = sqlite3.connect("database.db")
-    conn.execute("UPDATE orders SET status='REFUNDED' WHERE order_id=?", (order_id,))
-    conn.commit()
-    conn.close()
+    await refund_order(user_id, amount, order_id)
     await interaction.followup.send(
         f"info : Commande annulée ({reason}). Vous avez été remboursé de {amount}€.",
         ephemeral=True,
@@ -1802,9 +4359,11 @@ class OrderView(discord.ui.View):
         service_key=None,
         country_key=None,
         next_steps=None,
+        provider=None,
     ):
         super().__init__(timeout=None)
         self.order_id = order_id
+        self.provider = sms_router.get(provider)
         self.price = price
         self.user_id = user_id
         self.original_interaction = original_interaction
@@ -1838,8 +4397,8 @@ class OrderView(discord.ui.View):
             )
 
         await interaction.response.defer()
-        # On valide la commande chez SMS-Activate (Status 6)
-        await sms_api.request("setStatus", {"id": self.order_id, "status": "6"})
+        # On valide la commande chez le fournisseur (Status 6)
+        await self.provider.complete_order(self.order_id)
         self.process_finished = True
         self.stop()  # On arrête la vue
         await interaction.followup.send(
@@ -1876,7 +4435,8 @@ class OrderView(discord.ui.View):
 
         await interaction.response.defer()
         # On demande un autre code (Status 3)
-        await sms_api.request("setStatus", {"id": self.order_id, "status": "3"})
+        await self.provider.retry_code(self.order_id)
+        sms_poller.boost(self.order_id)
         await interaction.followup.send(
             "🔄 Demande de nouveau code envoyée... Attendez le prochain SMS.",
             ephemeral=True,
@@ -1911,7 +4471,7 @@ class OrderView(discord.ui.View):
             pass
 
         # 1. On tente d'annuler chez SMS-Activate D'ABORD
-        api_response = await sms_api.cancel_order(
+        api_response = await self.provider.cancel_order(
             self.order_id, user_info=f"User {self.user_id}"
         )
 
@@ -1941,6 +4501,8 @@ class OrderView(discord.ui.View):
 
             if "EARLY_CANCEL_DENIED" in api_response:
                 error_message = "⏳ **Trop tôt pour annuler !**\nVeuillez attendre **2 minutes** après l'achat avant de pouvoir annuler.\nRéessayez dans quelques instants."
+            elif api_response == PROVIDER_DOWN:
+                error_message = "⚠️ Fournisseur SMS indisponible pour le moment. Réessayez dans quelques minutes."
 
             await interaction.followup.send(error_message, ephemeral=True)
             try:
@@ -1980,14 +4542,9 @@ class OrderView(discord.ui.View):
         except discord.NotFound:
             pass
 
-        # 1. Tentative d'annulation chez SMS-Activate (Best effort)
-        api_response = await sms_api.cancel_order(
-            self.order_id, user_info=f"User {self.user_id}"
-        )
-        # On log mais on ignore l'erreur si ça rate (le remboursement auto se fera plus tard côté API)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(
-            f"[{timestamp}] [Initiator: User {self.user_id}] Cancel Blocked Number response: {api_response}"
+        # 1. Annulation chez SMS-Activate en file (rejouée jusqu'à confirmation)
+        await cancel_queue.enqueue(
+            self.order_id, f"User {self.user_id} (banni)", provider=self.provider.name
         )
 
         # 2. On procède DIRECTEMENT au remboursement interne et au changement de numéro
@@ -2005,7 +4562,7 @@ class OrderView(discord.ui.View):
 
         # 4. Blacklist du numéro
         if self.phone and self.service_name:
-            block_number_db(self.phone, self.service_name)
+            await block_number_db(self.phone, self.service_name)
 
         await interaction.followup.send(
             f"🚫 **Numéro {self.phone} géré (Banni).** Remplacement automatique en cours...",
@@ -2121,7 +4678,7 @@ class DashboardView(discord.ui.View):
     async def balance_btn(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
-        balance = get_balance(interaction.user.id)
+        balance = await get_balance(interaction.user.id)
         await interaction.response.send_message(
             f"💰 **Votre solde : {balance:.2f}€**",
             ephemeral=True,
@@ -2148,21 +4705,17 @@ class DashboardView(discord.ui.View):
     async def buy_account_btn(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
-        # 1. Vérif Stock
-        stock_count = count_telegram_stock()
-        if stock_count == 0:
+        # 1. Réservation du prochain compte (FIFO) le temps de la confirmation
+        next_account = await reserve_telegram_account(interaction.user.id)
+        if not next_account:
             return await interaction.response.send_message(
                 "❌ **Rupture de Stock !**\nRevenez plus tard ou ouvrez un ticket pour pré-commander.",
                 ephemeral=True,
             )
+        stock_count = await count_telegram_stock() + 1
 
         # 2. Prix (Fixe pour l'instant ou récupéré du prochain item)
         # On définit un prix de vente standard ou basé sur le coût du premier item
-        next_account = get_available_telegram_account()
-        if not next_account:
-            return await interaction.response.send_message(
-                "❌ Erreur Stock (Ghost).", ephemeral=True
-            )
 
         cost = next_account["cost"]
         # Prix de vente : 2.00€ minimum OU le double du coût d'achat si supérieur
@@ -2190,17 +4743,42 @@ class DashboardView(discord.ui.View):
         await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
 
+# Confirmations ouvertes par compte réservé : un double clic rend la même
+# réservation à deux vues, seule la dernière fermée la libère
+open_account_views = Counter()
+
+
 class ConfirmAccountBuyView(discord.ui.View):
     def __init__(self, user_id, price, account_id):
-        super().__init__(timeout=120)
+        super().__init__(timeout=ACCOUNT_RESERVATION_TTL)
         self.user_id = user_id
         self.price = price
         self.account_id = account_id
+        self.reserved_id = account_id
+        self.closed = False
+        open_account_views[account_id] += 1
+
+    async def release(self):
+        """Ferme la vue ; remet le compte en stock si plus aucune ne le tient."""
+        if self.closed:
+            return
+        self.closed = True
+        open_account_views[self.reserved_id] -= 1
+        if open_account_views[self.reserved_id] > 0:
+            return
+        del open_account_views[self.reserved_id]
+        await release_telegram_account(self.reserved_id, self.user_id)
+
+    async def on_timeout(self):
+        # Confirmation abandonnée : le compte réservé revient en stock
+        await self.release()
 
     @discord.ui.button(label="❌ Annuler", style=discord.ButtonStyle.secondary)
     async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
         if interaction.user.id != self.user_id:
             return
+        self.stop()
+        await self.release()
         await interaction.response.edit_message(
             content="❌ Achat annulé.", embed=None, view=None
         )
@@ -2213,31 +4791,26 @@ class ConfirmAccountBuyView(discord.ui.View):
             return
 
         await interaction.response.defer()
+        self.stop()
 
-        # Double check stock (Race condition)
-        target_account = get_available_telegram_account()
-        if not target_account or target_account["id"] != self.account_id:
-            # Si l'ID a changé mais qu'il y en a un autre, on prend l'autre
-            if target_account:
-                self.account_id = target_account["id"]
-            else:
-                return await interaction.followup.send(
-                    "❌ Trop tard ! Le dernier compte vient de partir.", ephemeral=True
-                )
-
-        # Check Solde
-        user_balance = get_balance(self.user_id)
-        if user_balance < self.price:
+        # Achat ! (stock, débit conditionnel et historique en une transaction)
+        result, user_balance, target_account = await purchase_account(
+            self.user_id, self.price, self.account_id
+        )
+        # Compte vendu : release() ne touche plus la ligne (status SOLD)
+        await self.release()
+        if result == PURCHASE_SOLD_OUT:
+            return await interaction.followup.send(
+                "❌ Trop tard ! Le dernier compte vient de partir.", ephemeral=True
+            )
+        if result == PURCHASE_NO_FUNDS:
             return await interaction.followup.send(
                 f"❌ Solde insuffisant ({user_balance:.2f}€).", ephemeral=True
             )
-
-        # Achat !
-        update_balance(self.user_id, -self.price)
-        mark_telegram_account_sold(self.account_id, self.user_id)
+        self.account_id = target_account["id"]
 
         # Alert Stock Bas
-        remaining_stock = count_telegram_stock()
+        remaining_stock = await count_telegram_stock()
         if remaining_stock < 10:
             for admin_id in ADMIN_IDS:
                 try:
@@ -2248,24 +4821,6 @@ class ConfirmAccountBuyView(discord.ui.View):
                 except:
                     pass
 
-        # Historique
-        conn = sqlite3.connect("database.db")
-        conn.execute(
-            "INSERT INTO orders (order_id, discord_id, phone, price, status, created_at, service, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                f"ACC-{self.account_id}",
-                self.user_id,
-                target_account["phone"],
-                self.price,
-                "COMPLETED",
-                str(datetime.now()),
-                "Telegram Account",
-                target_account["cost"],
-            ),
-        )
-        conn.commit()
-        conn.close()
-
         # DM
         try:
             dm_channel = await interaction.user.create_dm()
@@ -2321,7 +4876,7 @@ class TelegramAccountView(discord.ui.View):
     ):
         await interaction.response.defer()
         await interaction.followup.send(
-            "⏳ Connexion au compte et recherche du code... (Patientez 5-10s)",
+            "⏳ Recherche du code... (5-10s au premier clic, ensuite instantané)",
             ephemeral=True,
         )
 
@@ -2350,6 +4905,21 @@ class TelegramAccountView(discord.ui.View):
         else:
             await interaction.followup.send(f"⚠️ {result['error']}", ephemeral=True)
 
+        # Fenêtre de connexion ouverte : les prochains codes arrivent tout seuls en MP
+        try:
+            listening = await login_code_watcher.watch(
+                self.session_string, await interaction.user.create_dm()
+            )
+        except Exception as e:
+            print(f"Écoute des codes impossible: {e}")
+            return
+        if listening:
+            await interaction.followup.send(
+                f"🔔 Les nouveaux codes vous seront envoyés en MP dès leur arrivée "
+                f"(pendant {TG_LISTEN_WINDOW // 60} min).",
+                ephemeral=True,
+            )
+
 
 @bot.tree.command(
     name="addstock", description="Ajouter un compte Telegram au stock (Admin)"
@@ -2361,10 +4931,14 @@ async def addstock(
     cost: float,
     password: str = None,
 ):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message("❌", ephemeral=True)
 
-    add_telegram_account_db(phone, session, password, cost)
+    if not await add_telegram_account_db(phone, session, password, cost):
+        return await interaction.response.send_message(
+            f"⚠️ Le compte {phone} est déjà en stock.", ephemeral=True
+        )
+
     await interaction.response.send_message(
         f"✅ Compte {phone} ajouté au stock (Coût: {cost}€)", ephemeral=True
     )
@@ -2374,23 +4948,32 @@ async def addstock(
     name="stock", description="Voir l'état du stock de comptes Telegram (Admin)"
 )
 async def stock(interaction: discord.Interaction):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message("❌", ephemeral=True)
 
-    conn = sqlite3.connect("database.db")
-    total = conn.execute("SELECT COUNT(*) FROM telegram_accounts").fetchone()[0]
-    available = conn.execute(
-        "SELECT COUNT(*) FROM telegram_accounts WHERE status='AVAILABLE'"
-    ).fetchone()[0]
-    sold = conn.execute(
-        "SELECT COUNT(*) FROM telegram_accounts WHERE status='SOLD'"
-    ).fetchone()[0]
-    conn.close()
+    by_status = dict(
+        await db.fetchall(
+            "SELECT status, COUNT(*) FROM telegram_accounts GROUP BY status"
+        )
+    )
+    total = sum(by_status.values())
+    available = await count_telegram_stock()  # En vente (voir SELLABLE_ACCOUNT)
+    # En stock mais pas vendables : session INVALID / ERROR, 2FA sans mot de passe
+    withheld = by_status.get("AVAILABLE", 0) - available
 
     embed = discord.Embed(title="📦 Inventaire Telegram", color=0xF1C40F)
     embed.add_field(name="Total", value=str(total), inline=True)
     embed.add_field(name="🟢 Disponibles", value=str(available), inline=True)
-    embed.add_field(name="🔴 Vendus", value=str(sold), inline=True)
+    embed.add_field(name="🔴 Vendus", value=str(by_status.get("SOLD", 0)), inline=True)
+    embed.add_field(name="🚫 Hors vente", value=str(withheld), inline=True)
+    embed.add_field(
+        name="⏳ Réservés", value=str(by_status.get("RESERVED", 0)), inline=True
+    )
+    embed.add_field(
+        name="⚠️ Doublons écartés",
+        value=str(by_status.get("DUPLICATE", 0)),
+        inline=True,
+    )
 
     # Estimation valeur stock
     estimated_value = available * 1.5  # Prix arbitraire ou moyen
@@ -2403,44 +4986,67 @@ async def stock(interaction: discord.Interaction):
     name="check_account",
     description="Vérifier l'état d'un compte (Admin uniquement)",
 )
-async def check_account(interaction: discord.Interaction, phone: str):
-    if not is_user_admin(interaction.user.id):
+async def check_account(
+    interaction: discord.Interaction, phone: str, force: bool = False
+):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message(
             "❌ Accès refusé.", ephemeral=True
         )
 
     await interaction.response.defer(ephemeral=True)
 
-    # Recherche en DB
-    conn = sqlite3.connect("database.db")
-    row = conn.execute(
-        "SELECT id, session_string, password_2fa FROM telegram_accounts WHERE phone=?",
+    # Recherche en DB (avec le résultat de la dernière vérification)
+    row = await db.fetchone(
+        "SELECT id, session_string, password_2fa, health_status, has_2fa, username, checked_ts FROM telegram_accounts WHERE phone=? ORDER BY id DESC LIMIT 1",
         (phone,),
-    ).fetchone()
-    conn.close()
+    )
 
     if not row:
         return await interaction.followup.send(
             f"❌ Aucun compte trouvé avec le numéro {phone}.", ephemeral=True
         )
 
-    acc_id, session, pwd_db = row
+    acc_id, session, pwd_db, health, has_2fa_real, username, checked_ts = row
+    first_name = None
 
-    await interaction.followup.send(f"🔍 Analyse du compte {phone} en cours...")
+    # Réponse depuis le cache, sauf demande explicite ou 2FA encore inconnu
+    if force or (has_2fa_real is None and health != HEALTH_INVALID):
+        await interaction.followup.send(f"🔍 Analyse du compte {phone} en cours...")
 
-    # Verification Telethon
-    result = await TelethonHandler.check_2fa_status(session)
+        # Verification Telethon
+        result = await TelethonHandler.check_2fa_status(session)
 
-    if not result["success"]:
-        return await interaction.followup.send(
-            f"❌ Erreur connexion Telethon : {result.get('error')}", ephemeral=True
+        if not result["success"]:
+            if result.get("invalid"):
+                await save_account_check(acc_id, HEALTH_INVALID)
+            return await interaction.followup.send(
+                f"❌ Erreur connexion Telethon : {result.get('error')}", ephemeral=True
+            )
+
+        await save_account_check(acc_id, HEALTH_OK, result)
+        health = HEALTH_OK
+        has_2fa_real = result["has_2fa"]
+        username = result.get("username")
+        first_name = result.get("first_name")
+        source = "Vérification en direct"
+    else:
+        age = to_ts(datetime.now()) - checked_ts
+        source = (
+            f"Dernière vérification il y a {age // 60} min (force=True pour revérifier)"
         )
 
-    has_2fa_real = result["has_2fa"]
-    username = result.get("username", "Aucun")
+    if health == HEALTH_INVALID:
+        return await interaction.followup.send(
+            f"❌ Session invalide ou déconnectée ({source.lower()}).", ephemeral=True
+        )
 
     embed = discord.Embed(title=f"Diagnostic {phone}", color=0xFFA500)
-    embed.add_field(name="Session", value="✅ Active", inline=True)
+    embed.add_field(
+        name="Session",
+        value="✅ Active" if health == HEALTH_OK else "⚠️ Vérification en erreur",
+        inline=True,
+    )
     embed.add_field(
         name="2FA (Réel)",
         value="🔒 ACTIF" if has_2fa_real else "🔓 INACTIF",
@@ -2451,7 +5057,7 @@ async def check_account(interaction: discord.Interaction, phone: str):
     )
     embed.add_field(
         name="Infos",
-        value=f"User: {username}\nName: {result.get('first_name')}",
+        value=f"User: {username or 'Aucun'}\nName: {first_name or '?'}",
         inline=False,
     )
 
@@ -2467,6 +5073,7 @@ async def check_account(interaction: discord.Interaction, phone: str):
             value="Nous avons un mdp 2FA en base mais le compte n'en a pas besoin.",
             inline=False,
         )
+    embed.set_footer(text=source)
 
     await interaction.followup.send(embed=embed, ephemeral=True)
 
@@ -2481,7 +5088,7 @@ async def myaccounts(interaction: discord.Interaction, user: discord.Member = No
 
     # Si un admin veut voir les comptes de quelqu'un d'autre
     if user:
-        if not is_user_admin(interaction.user.id):
+        if not await is_user_admin(interaction.user.id):
             return await interaction.response.send_message(
                 "❌ Vous ne pouvez pas voir les comptes des autres.", ephemeral=True
             )
@@ -2490,13 +5097,11 @@ async def myaccounts(interaction: discord.Interaction, user: discord.Member = No
 
     await interaction.response.defer(ephemeral=True)
 
-    conn = sqlite3.connect("database.db")
     # On récupère les 5 derniers comptes achetés par l'utilisateur cible
-    rows = conn.execute(
-        "SELECT id, phone, session_string, password_2fa, sold_at FROM telegram_accounts WHERE sold_to=? ORDER BY sold_at DESC LIMIT 5",
+    rows = await db.fetchall(
+        "SELECT id, phone, session_string, password_2fa, sold_at FROM telegram_accounts WHERE sold_to=? ORDER BY sold_ts DESC LIMIT 5",
         (target_user_id,),
-    ).fetchall()
-    conn.close()
+    )
 
     if not rows:
         return await interaction.followup.send(
@@ -2531,12 +5136,9 @@ class ClearStockView(discord.ui.View):
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         await interaction.response.defer()
-        conn = sqlite3.connect("database.db")
-        count = conn.execute(
+        count = await db.execute(
             "DELETE FROM telegram_accounts WHERE status='AVAILABLE'"
-        ).rowcount
-        conn.commit()
-        conn.close()
+        )
         await interaction.edit_original_response(
             content=f"✅ **{count} comptes disponibles** ont été supprimés du stock.",
             view=None,
@@ -2549,10 +5151,7 @@ class ClearStockView(discord.ui.View):
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         await interaction.response.defer()
-        conn = sqlite3.connect("database.db")
-        count = conn.execute("DELETE FROM telegram_accounts").rowcount
-        conn.commit()
-        conn.close()
+        count = await db.execute("DELETE FROM telegram_accounts")
         await interaction.edit_original_response(
             content=f"⚠️ **Reset Complet** : La table Telegram a été vidée ({count} comptes supprimés).",
             view=None,
@@ -2567,7 +5166,7 @@ class ClearStockView(discord.ui.View):
     name="clearstock", description="Supprimer des comptes Telegram de la DB (Admin)"
 )
 async def clearstock(interaction: discord.Interaction):
-    if not is_user_admin(interaction.user.id):
+    if not await is_user_admin(interaction.user.id):
         return await interaction.response.send_message("❌", ephemeral=True)
 
     view = ClearStockView()
@@ -2618,7 +5217,7 @@ class CountrySelect(discord.ui.Select):
             service_list = []
             for name, code in SERVICES.items():
                 service_list.append(name)
-                tasks.append(sms_api.get_price(code, country_id))
+                tasks.append(sms_router.get_price(code, country_id))
 
             results = await asyncio.gather(*tasks)
 
@@ -2630,7 +5229,7 @@ class CountrySelect(discord.ui.Select):
             for i, res in enumerate(results):
                 svc_name = service_list[i].capitalize()
                 if res is not None:
-                    final_price = calculate_selling_price(res)
+                    final_price = await calculate_selling_price(res)
                     emoji = "📱"
                     if "whatsapp" in svc_name.lower():
                         emoji = "🟢"
@@ -2680,7 +5279,7 @@ class ServiceSelect(discord.ui.Select):
         service_code = SERVICES[service_key]
         country_id = COUNTRIES[self.country_key]
 
-        cost_price = await sms_api.get_price(service_code, country_id)
+        cost_price = await sms_router.get_price(service_code, country_id)
 
         if cost_price is None:
             return await interaction.followup.send(
@@ -2688,7 +5287,7 @@ class ServiceSelect(discord.ui.Select):
                 ephemeral=True,
             )
 
-        final_price = calculate_selling_price(cost_price)
+        final_price = await calculate_selling_price(cost_price)
 
         # 2. Affichage de la confirmation
         embed = discord.Embed(
@@ -2734,4 +5333,6 @@ class ServiceSelect(discord.ui.Select):
             )
 
 
-bot.run(TOKEN)
+# Importable sans lancer le bot (harnais de charge load_test.py)
+if __name__ == "__main__":
+    bot.run(TOKEN)
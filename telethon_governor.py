@@ -0,0 +1,199 @@
+"""
+Régulateur commun des opérations Telethon (connexions MTProto).
+
+Toutes les opérations passent par TelethonGovernor.run() : nombre d'opérations
+simultanées plafonné (global et par DC), file d'attente par priorité (le code
+d'un client passe avant les vérifications admin, elles-mêmes avant la
+vérification de fond), et un FloodWait reçu par un appelant met tout le monde
+en pause le temps demandé.
+"""
+
+import asyncio
+import heapq
+from collections import Counter
+from itertools import count
+from time import monotonic
+
+from telethon.errors import FloodWaitError
+from telethon.sessions import StringSession
+
+# Priorités : la plus petite passe en premier
+PRIORITY_CUSTOMER = 0  # "Recevoir le Code", écoute des codes
+PRIORITY_ADMIN = 1  # /check_account, /fix_stock
+PRIORITY_BACKGROUND = 2  # Vérification programmée du stock, import
+
+PRIORITY_NAMES = {
+    PRIORITY_CUSTOMER: "clients",
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_BACKGROUND: "fond",
+}
+
+DEFAULT_MAX_CONCURRENT = 10
+DEFAULT_MAX_PER_DC = 6
+
+
+class TelethonBusy(Exception):
+    """Pause FloodWait plus longue que l'attente acceptée par l'appelant."""
+
+    def __init__(self, seconds):
+        super().__init__(f"Telegram limite les connexions, reprise dans {seconds}s")
+        self.seconds = seconds
+
+
+def session_dc(session_string):
+    """DC d'une StringSession, ou None si illisible."""
+    try:
+        return StringSession(session_string).dc_id
+    except Exception:
+        return None
+
+
+class TelethonGovernor:
+    """
+    Une instance par processus (le bot, import_sessions.py). Une place est
+    prise pour la durée d'une opération (connexion, requêtes), pas pour un
+    client qui reste connecté entre deux opérations.
+    """
+
+    def __init__(
+        self, max_concurrent=DEFAULT_MAX_CONCURRENT, max_per_dc=DEFAULT_MAX_PER_DC
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_dc = max_per_dc
+        self.waiting = []  # Tas de (priorité, ordre d'arrivée, dc, future)
+        self.order = count()
+        self.paused_until = 0.0
+        self.wake_handle = None
+        # Compteurs (commande /monitor)
+        self.in_flight = 0
+        self.in_flight_by_dc = Counter()
+        self.queued = Counter()  # priorité -> opérations en attente
+        self.completed = 0
+        self.flood_waits = 0
+        self.longest_flood_wait = 0
+        self.max_queue_wait = 0.0
+
+    # -- Pause FloodWait --
+    def pause_remaining(self):
+        return max(0.0, self.paused_until - monotonic())
+
+    def on_flood_wait(self, seconds):
+        self.flood_waits += 1
+        self.longest_flood_wait = max(self.longest_flood_wait, seconds)
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+        print(f"⏸️ FloodWait {seconds}s : opérations Telethon en pause")
+
+    # -- File d'attente --
+    def _dispatch(self):
+        """Lance les opérations en attente tant que les plafonds le permettent."""
+        remaining = self.pause_remaining()
+        if remaining > 0:
+            if self.wake_handle is None:
+                self.wake_handle = asyncio.get_running_loop().call_later(
+                    remaining, self._wake
+                )
+            return
+
+        skipped = []  # DC saturé : on laisse passer les suivants
+        while self.waiting and self.in_flight < self.max_concurrent:
+            item = heapq.heappop(self.waiting)
+            priority, _, dc_id, future = item
+            if future.done():  # Appelant annulé
+                continue
+            if self.in_flight_by_dc[dc_id] >= self.max_per_dc:
+                skipped.append(item)
+                continue
+            self.in_flight += 1
+            self.in_flight_by_dc[dc_id] += 1
+            self.queued[priority] -= 1
+            future.set_result(None)
+        for item in skipped:
+            heapq.heappush(self.waiting, item)
+
+    def _wake(self):
+        self.wake_handle = None
+        self._dispatch()
+
+    async def acquire(self, priority, dc_id):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.order), dc_id, future))
+        self.queued[priority] += 1
+        started = monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self.queued[priority] -= 1
+            else:  # Place accordée juste avant l'annulation : on la rend
+                self.release(dc_id)
+            raise
+        self.max_queue_wait = max(self.max_queue_wait, monotonic() - started)
+
+    def release(self, dc_id):
+        self.in_flight -= 1
+        self.in_flight_by_dc[dc_id] -= 1
+        if not self.in_flight_by_dc[dc_id]:
+            del self.in_flight_by_dc[dc_id]
+        self._dispatch()
+
+    # -- API --
+    async def run(
+        self,
+        operation,
+        priority=PRIORITY_BACKGROUND,
+        dc_id=None,
+        retries=1,
+        max_wait=None,
+    ):
+        """
+        Exécute await operation() dès qu'une place est libre. Sur FloodWait,
+        tout le monde attend puis l'opération est relancée (retries fois).
+        max_wait : lève TelethonBusy si la pause en cours est plus longue.
+        """
+        for attempt in range(retries + 1):
+            remaining = self.pause_remaining()
+            if max_wait is not None and remaining > max_wait:
+                raise TelethonBusy(int(remaining) + 1)
+            await self.acquire(priority, dc_id)
+            try:
+                result = await operation()
+            except FloodWaitError as e:
+                self.on_flood_wait(e.seconds)
+                if attempt == retries:
+                    raise
+                continue
+            finally:
+                self.release(dc_id)
+            self.completed += 1
+            return result
+
+    def status_text(self):
+        queued = " | ".join(
+            f"{name} {self.queued[priority]}"
+            for priority, name in PRIORITY_NAMES.items()
+        )
+        text = (
+            f"En cours : {self.in_flight}/{self.max_concurrent} | en attente : {queued} | "
+            f"terminées {self.completed} | attente max {self.max_queue_wait:.1f}s | "
+            f"FloodWait {self.flood_waits} (max {self.longest_flood_wait}s)"
+        )
+        if self.in_flight_by_dc:
+            text += "\nPar DC : " + ", ".join(
+                f"DC{dc_id or '?'} {n}/{self.max_per_dc}"
+                for dc_id, n in sorted(
+                    self.in_flight_by_dc.items(), key=lambda x: x[0] or 0
+                )
+            )
+        pause = self.pause_remaining()
+        if pause > 0:
+            text += f"\n⏸️ Pause FloodWait : reprise dans {pause:.0f}s"
+        return text
+
+    def close(self):
+        if self.wake_handle is not None:
+            self.wake_handle.cancel()
+            self.wake_handle = None
+        for *_, future in self.waiting:
+            future.cancel()
+        self.waiting.clear()
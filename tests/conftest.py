@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Scripts à la racine du dépôt (database.py, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
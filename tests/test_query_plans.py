@@ -0,0 +1,13 @@
+import sqlite3
+
+from database import HOT_QUERIES, MIGRATIONS, check_query_plans, migrate
+
+
+def test_hot_queries_use_indexes():
+    # Un index perdu ou mal ciblé (SCAN complet, TEMP B-TREE) fait échouer la CI
+    conn = sqlite3.connect(":memory:")
+    try:
+        assert migrate(conn) == MIGRATIONS[-1][0]
+        assert check_query_plans(conn, HOT_QUERIES) == []
+    finally:
+        conn.close()